@@ -48,5 +48,6 @@ async def main():
     await poolserver.start_servers(conf_file=conf_file, host=host, port=port)
 
 
-#if __name__ == "__main__":
-asyncio.run(main())
+# stratum worker processes are spawned, they import this module without running it
+if __name__ == "__main__":
+    asyncio.run(main())
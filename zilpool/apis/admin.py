@@ -25,7 +25,8 @@ from zilpool.common.utils import iso_format, get_client_ip
 from zilpool.database.ziladmin import ZilAdmin, SiteSettings
 from zilpool.database.zilnode import ZilNode
 from zilpool.database.miner import Miner
-from zilpool.database.pow import PowWork, PowResult
+from zilpool.database.pow import PowWork, WorkCounter, RewardLedger
+from zilpool.database import routing
 
 
 def init_apis(config):
@@ -137,22 +138,23 @@ def init_apis(config):
             order_by = "-work_finished"
         if filters is None:
             filters = {}
-        return [
-            {
-                "email": m.email,
-                "nick_name": m.nick_name,
-                "authorized": m.authorized,
-                "email_verified": m.email_verified,
-                "wallet_address": m.wallet_address,
-                "join_date": iso_format(m.join_date),
-                "rewards": m.rewards,
-                "paid": m.paid,
-                "workers": m.workers_name,
-                "works": m.works_stats(),
-            }
-            for m in Miner.paginate(page=page, per_page=per_page,
-                                    order_by=order_by, **filters)
-        ]
+        with routing.secondary_reads():
+            return [
+                {
+                    "email": m.email,
+                    "nick_name": m.nick_name,
+                    "authorized": m.authorized,
+                    "email_verified": m.email_verified,
+                    "wallet_address": m.wallet_address,
+                    "join_date": iso_format(m.join_date),
+                    "rewards": m.rewards,
+                    "paid": m.paid,
+                    "workers": m.workers_name,
+                    "works": m.works_stats(),
+                }
+                for m in Miner.paginate(page=page, per_page=per_page,
+                                        order_by=order_by, **filters)
+            ]
 
     @method
     async def admin_list_nodes(request, visa: str, page=0, per_page=50,
@@ -163,16 +165,19 @@ def init_apis(config):
         if filters is None:
             filters = {}
 
+        with routing.secondary_reads():
+            nodes = list(ZilNode.paginate(page=page, per_page=per_page,
+                                          order_by=order_by, **filters))
+            works_stats = WorkCounter.node_stats([node.pub_key for node in nodes])
         return [
             {
                 "email": node.email,
                 "authorized": node.authorized,
                 "pow_fee": node.pow_fee,
                 "pub_key": node.pub_key,
-                "works": node.works_stats()
+                "works": works_stats[node.pub_key]
             }
-            for node in ZilNode.paginate(page=page, per_page=per_page,
-                                         order_by=order_by, **filters)
+            for node in nodes
         ]
 
     @method
@@ -181,7 +186,8 @@ def init_apis(config):
 
         blocks_list = utils.block_num_to_list(block_num)
 
-        return get_rewards(blocks_list)
+        with routing.secondary_reads():
+            return get_rewards(blocks_list)
 
 
 def login(request, email, password):
@@ -223,24 +229,27 @@ def admin_auth_node(pub_key, approve):
 
 def get_rewards(blocks_list):
     cur_block_num = PowWork.get_latest_block_num()
-    rewards = []
-    for block_num in blocks_list:
-        if block_num is None:
-            block_num = cur_block_num
-        if block_num > cur_block_num:
-            continue
+    blocks_list = [cur_block_num if block_num is None else block_num
+                   for block_num in blocks_list]
+    blocks_list = [block_num for block_num in blocks_list if block_num <= cur_block_num]
 
-        block_rewards = PowResult.rewards_by_miners(block_num)
-        for r in block_rewards:
-            r["date"] = utils.date_format(r["date"])
-            r["date_time"] = utils.iso_format(r["date_time"])
+    # one range scan of ledger and one query of block counters for all blocks
+    ledgers = RewardLedger.rewards_by_blocks(blocks_list)
+    counters = WorkCounter.block_counters(blocks_list)
 
-        work = PowWork.get_one(block_num=block_num)
+    rewards = []
+    for block_num in blocks_list:
+        block_rewards = [
+            dict(r, date=utils.date_format(r["date"]),
+                 date_time=utils.iso_format(r["date_time"]))
+            for r in ledgers[block_num]
+        ]
+        counter = counters[block_num]
 
         rewards.append({
             "block_num": block_num,
-            "date": utils.date_format(work and work.start_time),
-            "count": PowWork.count(block_num=block_num),
+            "date": utils.date_format(counter.start_time),
+            "count": counter.works,
             "rewards": block_rewards,
         })
 
@@ -25,7 +25,6 @@ from zilpool.database import pow, miner
 from zilpool.pyzil import ethash
 from zilpool.pyzil.crypto import hex_str_to_bytes as h2b
 from zilpool.pyzil.crypto import hex_str_to_int as h2i
-from zilpool.pyzil.crypto import bytes_to_hex_str as b2h
 
 
 def init_apis(config):
@@ -56,12 +55,12 @@ def init_apis(config):
             if not blockchain.Zilliqa.is_pow_window():
                 return no_work()
 
-        work = pow.PowWork.get_new_works(count=1, min_fee=min_fee,
-                                         max_dispatch=max_dispatch)
+        work = await pow.PowWork.aio.get_new_works(count=1, min_fee=min_fee,
+                                                   max_dispatch=max_dispatch)
         if not work:
             return no_work()
 
-        if work.increase_dispatched(max_dispatch, inc_seconds=inc_expire):
+        if await work.aio.increase_dispatched(max_dispatch, inc_seconds=inc_expire):
             return work.header, work.seed, work.boundary, True, 0
 
         logging.warning(f"increase_dispatched failed, {work}")
@@ -92,21 +91,21 @@ def init_apis(config):
         mix_digest_bytes = h2b(mix_digest)
 
         # 2. get or create miner/worker
-        _miner = miner.Miner.get_or_create(miner_wallet, worker_name)
-        _worker = miner.Worker.get_or_create(miner_wallet, worker_name)
+        _miner = await miner.Miner.aio.get_or_create(miner_wallet, worker_name)
+        _worker = await miner.Worker.aio.get_or_create(miner_wallet, worker_name)
         if not _miner or not _worker:
             logging.warning("miner/worker not found, {worker_name}@{miner_wallet}")
             return False
 
         if _worker is not None:
-            _worker.update_stat(inc_submitted=1)
+            await _worker.aio.update_stat(inc_submitted=1)
 
         # 3. check work existing
-        work = pow.PowWork.find_work_by_header_boundary(header=header, boundary=boundary,
-                                                        check_expired=True)
+        works = await pow.PowWork.aio.find_works_by_header(header=header, check_expired=True)
+        work = pow.PowWork.pick_work(works, boundary=boundary)
         if not work:
             logging.warning(f"work not found or expired, {header} {boundary}")
-            _worker.update_stat(inc_failed=1)
+            await _worker.aio.update_stat(inc_failed=1)
             return False
 
         # 4. verify result
@@ -117,33 +116,19 @@ def init_apis(config):
                                              nonce_int, boundary_bytes)
         if not hash_result:
             logging.warning(f"wrong result from miner {miner_wallet}-{worker_name}, {work}")
-            _worker.update_stat(inc_failed=1)
+            await _worker.aio.update_stat(inc_failed=1)
             return False
 
-        # 5. check the result if lesser than old one
-        if work.finished:
-            prev_result = pow.PowResult.get_pow_result(work.header, work.boundary)
-            if prev_result:
-                if prev_result.verified:
-                    logging.info(f"submitted too late, work is verified. {work.header} {work.boundary}")
-                    _worker.update_stat(inc_failed=1)
-                    return False
-
-                if ethash.is_less_or_equal(prev_result.hash_result, hash_result):
-                    logging.info(f"submitted result > old result, ignored. {work.header} {work.boundary}")
-                    _worker.update_stat(inc_failed=1)
-                    return False
-
-        # 6. save to database
-        hash_result_str = b2h(hash_result, prefix="0x")
-        if not work.save_result(nonce, mix_digest, hash_result_str, miner_wallet, worker_name):
-            logging.warning(f"failed to save result for miner "
-                            f"{miner_wallet}-{worker_name}, {work}")
+        # 5. save to the dispatched work and other boundaries of the header it meets,
+        #    results not lesser than old ones are ignored
+        works.remove(work)
+        saved = await pow.PowWork.aio.save_result_to_works([work] + works, nonce, mix_digest,
+                                                           hash_result, miner_wallet, worker_name)
+        if not saved:
+            await _worker.aio.update_stat(inc_failed=1)
             return False
 
-        logging.critical(f"Work submitted, {work.header} {work.boundary}")
-
-        _worker.update_stat(inc_finished=1)
+        await _worker.aio.update_stat(inc_finished=len(saved))
 
         # 6. todo: miner reward
         return True
@@ -155,7 +140,7 @@ def init_apis(config):
         hashrate_int, miner_wallet_bytes = h2i(hashrate), h2b(miner_wallet)
         worker_name = valid_worker_name(worker_name)
 
-        hr_record = miner.HashRate.log(hashrate_int, miner_wallet, worker_name)
+        hr_record = await miner.HashRate.aio.log(hashrate_int, miner_wallet, worker_name)
         if not hr_record:
             return False
 
@@ -25,76 +25,86 @@ from mongoengine import Q
 import zilpool
 from zilpool.common import utils, blockchain
 from zilpool.pyzil import crypto, ethash
-from zilpool.database import pow, miner, zilnode
+from zilpool.database import pow, miner, zilnode, aio, routing
+from zilpool.stratum import cluster
 
 
 def init_apis(config):
     @method
+    @routing.stats_reads
     async def stats(request):
-        return summary()
+        res = await aio.run(summary, stratum=False)
+        res["stratum"] = cluster.session_counters()
+        return res
 
     @method
+    @routing.stats_reads
     async def stats_current(request):
-        return current_work(config)
+        return await aio.run(current_work, config)
 
     @method
+    @routing.stats_reads
     @utils.args_to_lower
     async def stats_node(request, pub_key: str):
-        return node_stats(pub_key)
+        return await aio.run(node_stats, pub_key)
 
     @method
+    @routing.stats_reads
     @utils.args_to_lower
     async def stats_miner(request, wallet_address: str):
-        return miner_stats(wallet_address)
+        return await aio.run(miner_stats, wallet_address)
 
     @method
+    @routing.stats_reads
     @utils.args_to_lower
     async def stats_worker(request, wallet_address: str, worker_name: str):
-        return worker_stats(wallet_address, worker_name)
+        return await aio.run(worker_stats, wallet_address, worker_name)
 
     @method
+    @routing.stats_reads
     @utils.args_to_lower
     async def stats_hashrate(request, block_num=None, wallet_address=None, worker_name=None):
         blocks = utils.block_num_to_list(block_num)
 
         return [
-            hashrate_stats(block_num, wallet_address, worker_name)
+            await aio.run(hashrate_stats, block_num, wallet_address, worker_name)
             for block_num in blocks
         ]
 
     @method
+    @routing.stats_reads
     @utils.args_to_lower
     async def stats_reward(request,
                            start_block=None, end_block=None,
                            wallet_address=None, worker_name=None):
-        return reward_stats(start_block, end_block, wallet_address, worker_name)
+        return await aio.run(reward_stats, start_block, end_block,
+                             wallet_address, worker_name)
 
 
 #########################################
 # Stats
 #########################################
-def summary():
-    working_q = Q(expire_time__gte=datetime.utcnow()) & Q(finished=False)
-
-    return {
+def summary(stratum=True):
+    """ :param stratum: False to skip counters of stratum sessions,
+                        which are read in event loop
+    """
+    res = {
         "version": zilpool.version,
         "utc_time": utils.iso_format(datetime.utcnow()),
         "nodes": {
-            "all": zilnode.ZilNode.count(),
+            "all": zilnode.ZilNode.estimated_count(),
             "active": zilnode.ZilNode.active_count(),
         },
-        "miners": miner.Miner.count(),
+        "miners": miner.Miner.estimated_count(),
         "workers": {
-            "all": miner.Worker.count(),
+            "all": miner.Worker.estimated_count(),
             "active": miner.Worker.active_count(),
         },
-        "works": {
-            "all": pow.PowWork.count(),
-            "working": pow.PowWork.count(working_q),
-            "finished": pow.PowWork.count(finished=True),
-            "verified": pow.PowResult.count(verified=True),
-        },
+        "works": pow.WorkCounter.global_stats(),
     }
+    if stratum:
+        res["stratum"] = cluster.session_counters()
+    return res
 
 
 def current_work(config):
@@ -208,11 +218,18 @@ def reward_stats(start_block=None, end_block=None,
     if end_block is None:
         end_block = pow.PowWork.get_latest_block_num()
 
-    rewards = pow.PowResult.epoch_rewards(
-        block_num=(start_block, end_block),
-        miner_wallet=wallet_address,
-        worker_name=worker_name
-    )
+    if worker_name is None:
+        rewards = pow.RewardLedger.epoch_rewards(
+            block_num=(start_block, end_block),
+            miner_wallet=wallet_address
+        )
+    else:
+        # ledger keeps rewards of miners, not workers
+        rewards = pow.PowResult.epoch_rewards(
+            block_num=(start_block, end_block),
+            miner_wallet=wallet_address,
+            worker_name=worker_name
+        )
     rewards["first_work_at"] = utils.iso_format(rewards["first_work_at"])
     rewards["last_work_at"] = utils.iso_format(rewards["last_work_at"])
 
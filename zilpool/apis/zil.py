@@ -16,17 +16,56 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import asyncio
 import logging
-from datetime import datetime
 from jsonrpcserver import method
 
 from zilpool.common import utils, blockchain
 from zilpool.pyzil import crypto, ethash
-from zilpool.database import pow, zilnode
+from zilpool.database import pow, zilnode, aio
 from zilpool.stratum.stratum_server import *
+from zilpool.stratum import cluster
 
 def init_apis(config):
     zil_config = config["api_server"]["zil"]
+    high_water = config["stratum_server"].get("broadcast_high_water", BROADCAST_HIGH_WATER)
+
+    def dispatch_work():
+        """ get a work to dispatch to stratum miners """
+        max_dispatch = config.site_settings.max_dispatch
+        dispatchWork = pow.PowWork.get_new_works(count=1, min_fee=config.site_settings.min_fee,
+                                                 max_dispatch=max_dispatch)
+        if dispatchWork is not None:
+            if dispatchWork.increase_dispatched(max_dispatch,
+                                                inc_seconds=config.site_settings.inc_expire):
+                return dispatchWork
+        return None
+
+    def dispatch_works(count):
+        """ get works to dispatch to `count` stratum sessions """
+        works = []
+        for _ in range(count):
+            work = dispatch_work()
+            if work is None:
+                break
+            works.append(work)
+        return works
+
+    async def fetch_works(count):
+        return await aio.run(dispatch_works, count)
+
+    cluster.work_fetcher = fetch_works
+
+    def on_work_closed(header, boundary):
+        """ give sessions mining a closed work a new one immediately """
+        if cluster.hub is not None:
+            cluster.hub.publish_closed(header, boundary)
+            return
+        sessions = release_closed_work(header, boundary)
+        if sessions:
+            asyncio.ensure_future(broadcast_works(fetch_works, high_water, sessions=sessions))
+
+    pow.work_closed.add(on_work_closed)
 
     def check_network_info(block_num, boundary, timeout):
         if not blockchain.Zilliqa.is_pow_window():
@@ -100,32 +139,26 @@ def init_apis(config):
                 logging.warning(f"failed verify signature")
                 return False
 
-        node = zilnode.ZilNode.get_by_pub_key(pub_key=pub_key, authorized=True)
+        node = await zilnode.ZilNode.aio.get_by_pub_key(pub_key=pub_key, authorized=True)
         if not (node and node.authorized):
             logging.warning(f"unauthorized public key: {pub_key}")
             return False
 
-        count = pow.PowWork.count(pub_key=pub_key, block_num=block_num)
+        count = await pow.PowWork.aio.count(pub_key=pub_key, block_num=block_num)
         if count >= 2:
             logging.warning(f"too many PoW requests from {block_num} {pub_key}")
             return False
 
-        work = pow.PowWork.new_work(header, block_num, boundary,
-                                    pub_key=pub_key, signature=signature,
-                                    timeout=timeout, pow_fee=node.pow_fee)
+        work = await pow.PowWork.aio.new_work(header, block_num, boundary,
+                                              pub_key=pub_key, signature=signature,
+                                              timeout=timeout, pow_fee=node.pow_fee)
         # update pow window
         pow.PoWWindow.update_pow_window(work)
 
-        for stratumMiner in stratumMiners:
-            min_fee = config.site_settings.min_fee
-            max_dispatch = config.site_settings.max_dispatch
-            inc_expire = config.site_settings.inc_expire
-
-            dispatchWork = pow.PowWork.get_new_works(count=1, min_fee=min_fee,
-                                         max_dispatch=max_dispatch)
-            if dispatchWork is not None:
-                if dispatchWork.increase_dispatched(max_dispatch, inc_seconds=inc_expire):
-                    stratumMiner.notify_work(dispatchWork)
+        if cluster.hub is not None:
+            cluster.hub.publish_work()
+        else:
+            await broadcast_works(fetch_works, high_water)
 
         logging.critical(f"PoW work {block_num} {header} requested from {pub_key}")
 
@@ -149,7 +182,10 @@ def init_apis(config):
             logging.warning(f"failed verify signature")
             return False
 
-        pow_result = pow.PowResult.get_pow_result(header, boundary, pub_key=pub_key)
+        pow_result = await pow.PowResult.wait_pow_result(
+            header, boundary, pub_key=pub_key,
+            timeout=zil_config.get("long_poll", 0)
+        )
 
         if not pow_result:
             logging.info(f"result not found for pub_key: {pub_key}, "
@@ -177,7 +213,7 @@ def init_apis(config):
             logging.warning(f"failed verify signature")
             return False
 
-        pow_result = pow.PowResult.get_pow_result(header, boundary, pub_key=pub_key)
+        pow_result = await pow.PowResult.aio.get_pow_result(header, boundary, pub_key=pub_key)
 
         if not pow_result:
             logging.warning(f"result not found for pub_key: {pub_key}, "
@@ -185,17 +221,25 @@ def init_apis(config):
             return False
 
         verified = verified == "0x01"
-        if pow_result.update(verified=verified,
-                             verified_time=datetime.utcnow()):
-            worker = pow_result.get_worker()
+        prev = await pow_result.aio.set_verified(verified)
+        if prev is not None:
+            if verified and not prev.verified:
+                await pow.WorkCounter.aio.inc(pub_key, pow_result.block_num, verified=1)
+                await pow.RewardLedger.aio.add_verified(pow_result)
+            worker = await pow_result.aio.get_worker()
             if worker is None:
                 logging.warning(f"worker not found, {pow_result.worker_name}"
                                 f"@{pow_result.miner_wallet}")
             else:
-                worker.update_stat(inc_verified=1)
+                await worker.aio.update_stat(inc_verified=1)
 
-            logging.critical(f"PoW result verified by pub_key: {pub_key}, "
-                             f"header: {header}, boundary: {boundary}")
+            if verified:
+                logging.critical(f"PoW result verified by pub_key: {pub_key}, "
+                                 f"header: {header}, boundary: {boundary}")
+                pow.work_closed.emit(header, boundary)
+            else:
+                logging.warning(f"PoW result rejected by pub_key: {pub_key}, "
+                                f"header: {header}, boundary: {boundary}")
 
             return True
 
@@ -22,6 +22,7 @@ import logging
 
 import asyncio
 from zilpool.common import blockchain
+from zilpool.database import pow, miner, aio, archive
 from zilpool.pyzil.zilliqa_api import APIError
 
 
@@ -44,13 +45,76 @@ async def update_chain_info(config):
         pass
 
 
+async def sweep_expired_works(config):
+    """ count expired works in work counters """
+    interval = config.database.get("expire_sweep_interval", 30)
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                count = await pow.PowWork.aio.sweep_expired()
+                if count:
+                    logging.info(f"{count} works expired")
+            except Exception:
+                logging.exception("failed to sweep expired works")
+
+    except asyncio.CancelledError:
+        pass
+
+
+async def roll_hashrate_epochs(config):
+    """ roll up hashrate of closed epochs """
+    interval = config.database.get("hashrate_roll_interval", 60)
+    try:
+        while True:
+            try:
+                count = await miner.HashRateEpoch.aio.roll_closed_epochs()
+                if count:
+                    logging.info(f"hashrate of {count} epochs rolled up")
+            except Exception:
+                logging.exception("failed to roll up hashrate of epochs")
+
+            await asyncio.sleep(interval)
+
+    except asyncio.CancelledError:
+        pass
+
+
+async def archive_old_blocks(config):
+    """ move works and results of old blocks into archive collections """
+    archive_config = config.database.get("archive") or {}
+    keep_blocks = archive_config.get("keep_blocks", 0)
+    interval = archive_config.get("interval", 600)
+    batch_size = archive_config.get("batch_size", 1000)
+    try:
+        while True:
+            try:
+                moved = await aio.run(archive.archive_old_blocks, keep_blocks, batch_size)
+                for name, count in moved.items():
+                    if count:
+                        logging.critical(f"{count} documents of {name} archived")
+            except Exception:
+                logging.exception("failed to archive old blocks")
+
+            await asyncio.sleep(interval)
+
+    except asyncio.CancelledError:
+        pass
+
+
 async def start_background_tasks(app):
     config = app["config"]
     if config["zilliqa"]["enabled"]:
         app["zil_background"] = app.loop.create_task(update_chain_info(config))
+    app["sweep_background"] = app.loop.create_task(sweep_expired_works(config))
+    app["hashrate_background"] = app.loop.create_task(roll_hashrate_epochs(config))
+    if (config.database.get("archive") or {}).get("keep_blocks"):
+        app["archive_background"] = app.loop.create_task(archive_old_blocks(config))
 
 
 async def cleanup_background_tasks(app):
-    if "zil_background" in app:
-        app["zil_background"].cancel()
-        await app["zil_background"]
+    for name in ("zil_background", "sweep_background", "hashrate_background",
+                 "archive_background"):
+        if name in app:
+            app[name].cancel()
+            await app[name]
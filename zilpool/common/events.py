@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+# Zilliqa Mining Proxy
+# Copyright (C) 2019  Gully Chen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+in-process notification registry
+"""
+
+import asyncio
+import threading
+from collections import defaultdict
+
+
+def _set_result(fut, value):
+    if not fut.done():
+        fut.set_result(value)
+
+
+class Waiters:
+    """ Coroutines waiting for a key, woken up by notify().
+    notify() is thread safe, database writes running in executors can wake up
+    the handlers waiting in event loop.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters = defaultdict(set)
+
+    def add(self, key):
+        """ register a waiter before checking the condition,
+        so a notify between checking and waiting will not be lost
+        """
+        loop = asyncio.get_running_loop()
+        waiter = (loop, loop.create_future())
+        with self._lock:
+            self._waiters[key].add(waiter)
+        return waiter
+
+    def remove(self, key, waiter):
+        with self._lock:
+            waiters = self._waiters.get(key)
+            if waiters is None:
+                return
+            waiters.discard(waiter)
+            if not waiters:
+                del self._waiters[key]
+
+    @staticmethod
+    async def wait(waiter, timeout):
+        _, fut = waiter
+        try:
+            return await asyncio.wait_for(asyncio.shield(fut), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def notify(self, key, value=True):
+        with self._lock:
+            waiters = list(self._waiters.get(key, ()))
+        for loop, fut in waiters:
+            if loop.is_closed():
+                continue
+            loop.call_soon_threadsafe(_set_result, fut, value)
+        return len(waiters)
+
+    def count(self, key=None):
+        with self._lock:
+            if key is None:
+                return sum(len(w) for w in self._waiters.values())
+            return len(self._waiters.get(key, ()))
+
+
+class Listeners:
+    """ Callbacks called with the arguments of emit(), in the event loop they
+    were added from. emit() is thread safe.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def add(self, callback):
+        loop = asyncio.get_event_loop()
+        with self._lock:
+            self._listeners.append((loop, callback))
+
+    def remove(self, callback):
+        with self._lock:
+            self._listeners = [(loop, cb) for loop, cb in self._listeners if cb != callback]
+
+    def emit(self, *args):
+        with self._lock:
+            listeners = list(self._listeners)
+        for loop, callback in listeners:
+            if loop.is_closed():
+                continue
+            loop.call_soon_threadsafe(callback, *args)
+        return len(listeners)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._listeners)
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# Zilliqa Mining Proxy
+# Copyright (C) 2019  Gully Chen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+  awaitable database calls for handlers running in event loop
+
+    work = await pow.PowWork.aio.get_new_works(count=1)
+    ok = await work.aio.increase_dispatched(max_dispatch)
+    stats = await aio.run(summary)
+"""
+
+import asyncio
+import contextvars
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_WORKERS = 16
+
+_executor = None
+
+
+def init_executor(max_workers=DEFAULT_WORKERS):
+    """ threads running database calls, pymongo releases the GIL
+    while waiting for MongoDB, so queries of many requests overlap.
+    """
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+    _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db")
+    return _executor
+
+
+def get_executor():
+    if _executor is None:
+        init_executor()
+    return _executor
+
+
+async def run(func, *args, **kwargs):
+    """ run blocking database calls in executor,
+    with the context of caller, so round trips are counted for its request.
+    """
+    loop = asyncio.get_event_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(get_executor(), partial(ctx.run, func, *args, **kwargs))
+
+
+class AsyncProxy:
+    """ `await proxy.method(...)` runs `obj.method(...)` with run() """
+    __slots__ = ("_obj", )
+
+    def __init__(self, obj):
+        self._obj = obj
+
+    def __getattr__(self, name):
+        func = getattr(self._obj, name)
+        if not callable(func):
+            raise AttributeError(f"{name} of {self._obj} is not callable")
+        return partial(run, func)
+
+
+class AsyncAccessor:
+    """ `Model.aio` for classmethods, `doc.aio` for methods of a document """
+
+    def __get__(self, instance, owner):
+        return AsyncProxy(owner if instance is None else instance)
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+# Zilliqa Mining Proxy
+# Copyright (C) 2019  Gully Chen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+  archive of works and results of old DS blocks
+
+Documents of blocks older than `keep_blocks` are moved from the live
+collection into `<collection>_archive`, so the live one stays in RAM.
+Lookups by block number of ArchiveMixin models read the archive for
+blocks archived, so writes for blocks archived are refused.
+"""
+
+import time
+import logging
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError
+from mongoengine.queryset import QuerySet
+
+from . import routing
+
+ARCHIVE_SUFFIX = "_archive"
+COMPRESSORS = ("none", "snappy", "zlib", "zstd")
+DUPLICATE_KEY = 11000
+MARK_REFRESH_SECONDS = 60
+
+# model -> (last block archived, time loaded)
+_marks = {}
+# writes of blocks archived are checked only if archival is enabled
+_enabled = False
+
+
+def archived_models():
+    from .pow import PowWork, PowResult
+    return [PowWork, PowResult]
+
+
+def archive_name(model):
+    return model._get_collection_name() + ARCHIVE_SUFFIX
+
+
+def get_archive_collection(model):
+    return model._get_db()[archive_name(model)]
+
+
+def index_keys(fields):
+    return [(field.lstrip("-"), DESCENDING if field.startswith("-") else ASCENDING)
+            for field in fields]
+
+
+def archive_exists(model):
+    database = model._get_db()
+    name = archive_name(model)
+    return name in database.list_collection_names(filter={"name": name})
+
+
+def create_archive(model, compressor=None):
+    """ create archive collection with block compressor, and its indexes
+    :return: True if the collection is created
+    """
+    database = model._get_db()
+    name = archive_name(model)
+    created = False
+    if not archive_exists(model):
+        kwargs = {}
+        if compressor:
+            if compressor not in COMPRESSORS:
+                raise ValueError(f"invalid block compressor {compressor}")
+            kwargs["storageEngine"] = {
+                "wiredTiger": {"configString": f"block_compressor={compressor}"}
+            }
+        database.create_collection(name, **kwargs)
+        created = True
+
+    collection = database[name]
+    for fields in model.archive_indexes:
+        collection.create_index(index_keys(fields))
+    return created
+
+
+def archive_blocks(model, before_block, batch_size=1000):
+    """ move documents of blocks before `before_block` into archive,
+    inserted before deleted, so none is missing from both if interrupted.
+    :return: number of documents moved
+    """
+    live = model._get_collection()
+    archive = get_archive_collection(model)
+    query = {"block_num": {"$lt": before_block}}
+
+    moved = 0
+    while True:
+        docs = list(live.find(query).limit(batch_size))
+        if not docs:
+            break
+        try:
+            archive.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            # already archived by an interrupted run
+            if any(err["code"] != DUPLICATE_KEY for err in e.details["writeErrors"]):
+                raise
+        live.delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+        moved += len(docs)
+
+    _marks[model] = (before_block - 1, time.time())
+    return moved
+
+
+def archive_old_blocks(keep_blocks, batch_size=1000):
+    """ archive works and results, keep the latest `keep_blocks` blocks
+    :return: dict of collection name -> number of documents moved
+    """
+    from .pow import PowWork
+
+    if keep_blocks <= 0:
+        return {}
+    latest_block = PowWork.get_latest_block_num()
+    if latest_block < 0:
+        return {}
+    before_block = latest_block - keep_blocks + 1
+    return {
+        model._get_collection_name(): archive_blocks(model, before_block, batch_size)
+        for model in archived_models()
+    }
+
+
+def init_archive(config):
+    global _enabled
+
+    archive_config = config.database.get("archive") or {}
+    _enabled = bool(archive_config.get("keep_blocks"))
+    if not _enabled:
+        return
+
+    compressor = archive_config.get("compressor")
+    for model in archived_models():
+        if create_archive(model, compressor):
+            logging.critical(f"archive collection {archive_name(model)} created, "
+                             f"block compressor: {compressor or 'default'}")
+
+
+def reset_marks():
+    _marks.clear()
+
+
+class ArchiveMixin:
+    """ models with documents of old blocks moved to archive """
+    archive_indexes = [("block_num", )]
+
+    @classmethod
+    def archive_objects(cls, *q_objs, **query):
+        """ queryset on the archive collection, `Model.objects` alike """
+        queryset = QuerySet(cls, get_archive_collection(cls))
+        read_preference = routing.current_read_preference()
+        if read_preference is not None:
+            queryset = queryset.read_preference(read_preference)
+        return queryset(*q_objs, **query)
+
+    @classmethod
+    def archived_block(cls):
+        """ the last block archived, -1 if none, reloaded every minute """
+        mark = _marks.get(cls)
+        if mark is None or time.time() - mark[1] > MARK_REFRESH_SECONDS:
+            doc = get_archive_collection(cls).find_one(
+                {}, {"block_num": 1}, sort=[("block_num", DESCENDING)]
+            )
+            mark = _marks[cls] = (doc["block_num"] if doc else -1, time.time())
+        return mark[0]
+
+    @classmethod
+    def is_archived(cls, block_num):
+        """ check before writes of a block, False if archival is disabled """
+        return _enabled and block_num <= cls.archived_block()
+
+    @classmethod
+    def objects_of_block(cls, block_num):
+        """ queryset of the collection holding documents of a block """
+        if block_num <= cls.archived_block():
+            return cls.archive_objects()
+        return cls.objects()
+
+    @classmethod
+    def average_of_block(cls, block_num, field):
+        """ average of a field in documents of a block,
+        not QuerySet.average, which always reads the live collection
+        """
+        pipeline = [
+            {"$match": {"block_num": block_num}},
+            {"$group": {"_id": None, "total": {"$avg": f"${field}"}}},
+        ]
+        res = list(cls.objects_of_block(block_num).aggregate(*pipeline))
+        return res[0]["total"] if res else 0
+
+    @classmethod
+    def objects_of_blocks(cls, start=None, end=None):
+        """ querysets of the collections holding documents of blocks in [start, end] """
+        archived = cls.archived_block()
+        querysets = []
+        if archived >= 0 and (start is None or start <= archived):
+            querysets.append(cls.archive_objects())
+        if end is None or end > archived:
+            querysets.append(cls.objects())
+        return querysets
@@ -21,12 +21,15 @@
 import logging
 from functools import wraps
 from inspect import isclass
+from datetime import datetime
 from cachetools import cached, TTLCache
 
-from mongoengine import connect, Document, OperationError
+from mongoengine import connect, Document, OperationError, DateTimeField
 from mongoengine.connection import get_db, MongoEngineConnectionError
 
 from zilpool.common.local import LocalProxy
+from . import roundtrip, routing, archive
+from .aio import AsyncAccessor
 
 db = LocalProxy(get_db)
 
@@ -40,7 +43,8 @@ def connect_to_db(config=None):
 
     logging.critical(f"Connecting to {uri}")
     try:
-        connect(host=uri)
+        connect(host=uri, event_listeners=[roundtrip.listener])
+        routing.configure(config)
         logging.critical("Database connected!")
     except MongoEngineConnectionError:
         logging.fatal("Failed connect to MongoDB!")
@@ -60,14 +64,26 @@ def fail_safe(f):
 
 def drop_all():
     db.client.drop_database(db.name)
+    archive.reset_marks()
 
 
 class ModelMixin:
+    aio = AsyncAccessor()    # awaitable calls, see database.aio
+    objects = routing.RoutedQuerySetManager()
 
     @classmethod
     def count(cls, q_obj=None, **query):
         return cls.objects(q_obj=q_obj, **query).count()
 
+    @classmethod
+    def estimated_count(cls):
+        """ count of all documents from collection metadata, without scan """
+        collection = cls._get_collection()
+        read_preference = routing.current_read_preference()
+        if read_preference is not None:
+            collection = collection.with_options(read_preference=read_preference)
+        return collection.estimated_document_count()
+
     @classmethod
     def aggregate_count(cls, match, group):
         pipeline = [
@@ -125,18 +141,47 @@ class ModelMixin:
     @fail_safe
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
-        self.reload()
+        self._truncate_datetimes()
+        return self
+
+    @fail_safe
+    def insert_nowait(self):
+        """ insert a new document without waiting for acknowledgement """
+        super().save(force_insert=True, write_concern={"w": 0})
+        self._truncate_datetimes()
         return self
 
-    @wraps(Document.update)
+    def _truncate_datetimes(self):
+        """ MongoDB keeps milliseconds of datetime, truncate the values
+        in memory as a reload would get them, without the round trip.
+        """
+        for name, field in self._fields.items():
+            value = self._data.get(name)
+            if isinstance(field, DateTimeField) and isinstance(value, datetime):
+                self._data[name] = value.replace(microsecond=value.microsecond // 1000 * 1000)
+
     @fail_safe
-    def update(self, **kwargs):
-        res = super().update(**kwargs)
-        if not res:
+    def update(self, only=None, **kwargs):
+        """ update and get the updated fields with one find_one_and_update,
+        only the fields in `only` are returned and set if given.
+        """
+        cursor = self._qs.filter(pk=self.pk)
+        if only:
+            cursor = cursor.only(*only)
+        updated = cursor.modify(new=True, **kwargs)
+        if updated is None:
             return None
-        self.reload()
+        for name in (only or self._fields_ordered):
+            setattr(self, name, self._reload(name, updated[name]))
+        self._clear_changed_fields()
         return self
 
+    @classmethod
+    @fail_safe
+    def update_all(cls, query: dict, **kwargs):
+        """ update without reading documents back, :return: number of documents updated """
+        return cls.objects(**query).update(**kwargs)
+
 
 def get_all_models():
     from . import miner
@@ -148,17 +193,36 @@ def get_all_models():
     for module in [miner, pow, zilnode, ziladmin]:
         for name in dir(module):
             obj = getattr(module, name)
-            if isclass(obj) and issubclass(obj, Document):
+            if isclass(obj) and issubclass(obj, Document) and not obj._meta.get("abstract"):
                 db_models.append(obj)
 
     return list(set(db_models))
 
 
 def init_db(config):
+    from .retention import init_retention
+    from .archive import init_archive
+    from .pow import WorkCounter, RewardLedger, PoWWindowTracker
+    from .miner import Worker
+
+    Worker.merge_duplicates()
+    init_indexes()
+    init_archive(config)
+    init_retention(config)    # of archive collections too
+    WorkCounter.init()
+    RewardLedger.init()
+    PoWWindowTracker.load()
     init_admin(config)
     init_default_settings(config)
 
 
+def init_indexes():
+    """ create indexes declared in meta of all models """
+    for cls in get_all_models():
+        cls.ensure_indexes()
+        logging.info(f"indexes ensured: {cls._get_collection_name()}")
+
+
 def init_admin(config):
     from . import ziladmin
     from zilpool.pyzil import crypto
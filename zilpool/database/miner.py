@@ -16,13 +16,17 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import logging
 from collections import defaultdict
 from datetime import datetime, timedelta
 
 import mongoengine as mg
 from mongoengine import Q
+from mongoengine.errors import NotUniqueError
+from pymongo import UpdateOne
 
-from .basemodel import ModelMixin
+from . import routing
+from .basemodel import ModelMixin, fail_safe
 
 
 """
@@ -31,8 +35,34 @@ A Worker -> Time series of hashrate
 """
 
 
+STAT_FIELDS = ("work_submitted", "work_failed", "work_finished", "work_verified")
+
+
+def upsert(queryset, **kwargs):
+    """ modify with upsert, retried once if a concurrent upsert inserted first """
+    try:
+        return queryset.modify(upsert=True, new=True, **kwargs)
+    except NotUniqueError:
+        return queryset.modify(upsert=True, new=True, **kwargs)
+
+
+def stat_updates(inc_submitted=0, inc_failed=0, inc_finished=0, inc_verified=0):
+    update_kwargs = {
+        "inc__work_submitted": inc_submitted,
+        "inc__work_failed": inc_failed,
+        "inc__work_finished": inc_finished,
+        "inc__work_verified": inc_verified,
+    }
+    return {key: value for (key, value) in update_kwargs.items() if value > 0}
+
+
 class Miner(ModelMixin, mg.Document):
-    meta = {"collection": "zil_miners", "strict": False}
+    meta = {
+        "collection": "zil_miners", "strict": False,
+        "indexes": [
+            "-work_finished",
+        ],
+    }
 
     wallet_address = mg.StringField(max_length=128, required=True, unique=True)
     rewards = mg.FloatField(default=0.0)
@@ -59,20 +89,15 @@ class Miner(ModelMixin, mg.Document):
                       nick_name="", email="", authorized=True):
         worker = Worker.get_or_create(wallet_address, worker_name)
         if worker:
-            miner = cls.objects(
-                wallet_address=wallet_address
-            ).modify(
-                upsert=True, new=True,
+            return upsert(
+                cls.objects(wallet_address=wallet_address),
                 set__wallet_address=wallet_address,
                 set__authorized=authorized,
                 set__nick_name=nick_name,
-                set__email=email
+                set__email=email,
+                set_on_insert__join_date=datetime.utcnow(),
+                add_to_set__workers_name=worker_name
             )
-            if miner.join_date is None:
-                miner.join_date = datetime.utcnow()
-            if worker_name not in miner.workers_name:
-                miner.workers_name.append(worker_name)
-            return miner.save()
         return None
 
     @property
@@ -88,18 +113,17 @@ class Miner(ModelMixin, mg.Document):
         }
 
     def update_stat(self, inc_submitted=0, inc_failed=0, inc_finished=0, inc_verified=0):
-        update_kwargs = {
-            "inc__work_submitted": inc_submitted,
-            "inc__work_failed": inc_failed,
-            "inc__work_finished": inc_finished,
-            "inc__work_verified": inc_verified,
-        }
-        update_kwargs = {key: value for (key, value) in update_kwargs.items() if value > 0}
+        update_kwargs = stat_updates(inc_submitted, inc_failed, inc_finished, inc_verified)
         return self.update(**update_kwargs)
 
 
 class Worker(ModelMixin, mg.Document):
-    meta = {"collection": "zil_mine_workers", "strict": False}
+    meta = {
+        "collection": "zil_mine_workers", "strict": False,
+        "indexes": [
+            {"fields": ("wallet_address", "worker_name"), "unique": True},
+        ],
+    }
 
     wallet_address = mg.StringField(max_length=128, required=True)
     worker_name = mg.StringField(max_length=64, default="")
@@ -118,16 +142,44 @@ class Worker(ModelMixin, mg.Document):
 
     @classmethod
     def get_or_create(cls, wallet_address: str, worker_name: str):
-        worker = cls.objects(
-            wallet_address=wallet_address,
-            worker_name=worker_name
-        ).modify(
-            upsert=True, new=True,
+        worker = upsert(
+            cls.objects(wallet_address=wallet_address, worker_name=worker_name),
             set__wallet_address=wallet_address,
             set__worker_name=worker_name
         )
         return worker
 
+    @classmethod
+    def merge_duplicates(cls):
+        """ merge workers upserted twice before the index was unique, so it can be created,
+        skipped once the unique index is in place.
+        :return: number of documents removed
+        """
+        collection = cls._get_collection()
+        for name, index in collection.index_information().items():
+            if index["key"] == [("wallet_address", 1), ("worker_name", 1)]:
+                if index.get("unique"):
+                    return 0
+                collection.drop_index(name)
+
+        pipeline = [
+            {"$group": {
+                "_id": {"wallet_address": "$wallet_address", "worker_name": "$worker_name"},
+                "ids": {"$push": "$_id"},
+                **{name: {"$sum": f"${name}"} for name in STAT_FIELDS},
+            }},
+            {"$match": {"ids.1": {"$exists": True}}},
+        ]
+        removed = 0
+        for group in collection.aggregate(pipeline, allowDiskUse=True):
+            keep, *others = group["ids"]
+            collection.update_one({"_id": keep}, {"$set": {name: group[name] for name in STAT_FIELDS}})
+            collection.delete_many({"_id": {"$in": others}})
+            removed += len(others)
+        if removed:
+            logging.critical(f"{removed} duplicate workers merged")
+        return removed
+
     @classmethod
     def active_count(cls):
         three_hours = datetime.utcnow() - timedelta(hours=3)
@@ -142,24 +194,15 @@ class Worker(ModelMixin, mg.Document):
                     "worker_name": "$worker_name"},
         }
 
-        return HashRate.aggregate_count(match, group)
+        return HashRateHour.aggregate_count(match, group)
 
     def update_stat(self, inc_submitted=0, inc_failed=0, inc_finished=0, inc_verified=0):
-        update_kwargs = {
-            "inc__work_submitted": inc_submitted,
-            "inc__work_failed": inc_failed,
-            "inc__work_finished": inc_finished,
-            "inc__work_verified": inc_verified,
-        }
-        update_kwargs = {key: value for (key, value) in update_kwargs.items() if value > 0}
-        if self.update(**update_kwargs):
-            # update miner's stats
-            self.miner.update_stat(
-                inc_submitted=inc_submitted,
-                inc_failed=inc_failed,
-                inc_finished=inc_finished,
-                inc_verified=inc_verified
-            )
+        """ stats counters of worker and its miner, updated without reading them back """
+        update_kwargs = stat_updates(inc_submitted, inc_failed, inc_finished, inc_verified)
+        if not update_kwargs:
+            return
+        Worker.update_all({"pk": self.pk}, **update_kwargs)
+        Miner.update_all({"wallet_address": self.wallet_address}, **update_kwargs)
 
     def works_stats(self):
         return {
@@ -171,7 +214,10 @@ class Worker(ModelMixin, mg.Document):
 
 
 class HashRate(ModelMixin, mg.Document):
-    meta = {"collection": "zil_mine_hashrate", "strict": False}
+    meta = {
+        "collection": "zil_mine_hashrate", "strict": False,
+        # raw samples are not queried, TTL index by database.retention
+    }
 
     wallet_address = mg.StringField(max_length=128, required=True)
     worker_name = mg.StringField(max_length=64, default="")
@@ -190,54 +236,226 @@ class HashRate(ModelMixin, mg.Document):
         if not _worker:
             return False
 
+        now = datetime.utcnow()
         hr = cls(wallet_address=wallet_address, worker_name=worker_name,
-                 hashrate=hashrate, updated_time=datetime.utcnow())
-        return hr.save()
+                 hashrate=hashrate, updated_time=now)
+        for rollup in (HashRateMinute, HashRateHour):
+            rollup.add(hashrate, wallet_address, worker_name, now)
+        return hr.insert_nowait()
 
     @classmethod
     def epoch_hashrate(cls, block_num=None, wallet_address=None, worker_name=None):
+        """ sum of max hashrate of workers in PoW window,
+        from epoch rollups if the closed epoch is rolled up, or from minute rollups.
+        """
         from .pow import PoWWindow
 
+        if block_num is not None and block_num < PoWWindow.get_latest_block_num():
+            window = PoWWindow.get_one(block_num=block_num, order="-create_time")
+            if window is not None and window.hashrate_rolled:
+                return HashRateEpoch.total_hashrate(block_num, wallet_address, worker_name)
+
         pow_start, pow_end = PoWWindow.get_pow_window(block_num)
         if not pow_start or not pow_end:
             return 0
 
+        return HashRateMinute.total_hashrate(pow_start, pow_end, wallet_address, worker_name)
+
+
+def filter_worker(match, wallet_address=None, worker_name=None):
+    if wallet_address is not None:
+        match["wallet_address"] = {"$eq": wallet_address}
+    if worker_name is not None:
+        match["worker_name"] = {"$eq": worker_name}
+    return match
+
+
+def sum_max_hashrate(model, match):
+    """ sum the max hashrate of every worker in matched docs """
+    group = {
+        "_id": {"wallet_address": "$wallet_address",
+                "worker_name": "$worker_name", },
+        "hashrate": {"$max": "$max_hashrate"}
+    }
+    group_sum = {
+        "_id": None,
+        "hashrate": {"$sum": "$hashrate"}
+    }
+
+    pipeline = [
+        {"$match": match},
+        {"$group": group},
+        {"$group": group_sum}
+    ]
+
+    res = list(model.objects.aggregate(*pipeline))
+    return res[0]["hashrate"] if res else 0
+
+
+class HashRateRollup(ModelMixin, mg.Document):
+    """ hashrate samples of a worker in a period, updated on ingest,
+    subclasses define `period_of(time)`, the start of period of a time.
+    """
+    meta = {"abstract": True, "strict": False}
+
+    wallet_address = mg.StringField(max_length=128, required=True)
+    worker_name = mg.StringField(max_length=64, default="")
+    period = mg.DateTimeField(required=True)    # start of period
+
+    max_hashrate = mg.IntField(default=0)
+    sum_hashrate = mg.IntField(default=0)
+    samples = mg.IntField(default=0)
+    updated_time = mg.DateTimeField()           # time of the latest sample
+
+    @property
+    def avg_hashrate(self):
+        return self.sum_hashrate // self.samples if self.samples else 0
+
+    @classmethod
+    @fail_safe
+    def add(cls, hashrate: int, wallet_address: str, worker_name: str, now: datetime):
+        query = {
+            "wallet_address": wallet_address,
+            "worker_name": worker_name,
+            "period": cls.period_of(now),
+        }
+        updates = {
+            "max__max_hashrate": hashrate,
+            "inc__sum_hashrate": hashrate,
+            "inc__samples": 1,
+            "max__updated_time": now,
+        }
+        try:
+            cls.objects(**query).update(upsert=True, **updates)
+        except NotUniqueError:
+            # a concurrent upsert inserted the period first
+            cls.objects(**query).update(upsert=True, **updates)
+
+
+class HashRateMinute(HashRateRollup):
+    meta = {
+        "collection": "zil_hashrate_minute",
+        "indexes": [
+            ("period", "wallet_address", "worker_name"),
+            {"fields": ("wallet_address", "worker_name", "period"), "unique": True},
+        ],
+    }
+
+    @classmethod
+    def period_of(cls, time: datetime) -> datetime:
+        return time.replace(second=0, microsecond=0)
+
+    @classmethod
+    def total_hashrate(cls, start, end, wallet_address=None, worker_name=None):
         match = {
-            "updated_time": {
-                "$gte": pow_start,
-                "$lte": pow_end,
+            "period": {
+                "$gte": cls.period_of(start),
+                "$lte": end,
             }
         }
+        return sum_max_hashrate(cls, filter_worker(match, wallet_address, worker_name))
 
-        if wallet_address is not None:
-            match.update({
-                "wallet_address": {
-                    "$eq": wallet_address,
-                }
-            })
 
-        if worker_name is not None:
-            match.update({
-                "worker_name": {
-                    "$eq": worker_name,
-                }
-            })
+class HashRateHour(HashRateRollup):
+    meta = {
+        "collection": "zil_hashrate_hour",
+        "indexes": [
+            "updated_time",
+            {"fields": ("wallet_address", "worker_name", "period"), "unique": True},
+        ],
+    }
 
-        group = {
-            "_id": {"wallet_address": "$wallet_address",
-                    "worker_name": "$worker_name", },
-            "hashrate": {"$max": "$hashrate"}
-        }
-        group_sum = {
-            "_id": None,
-            "hashrate": {"$sum": "$hashrate"}
-        }
+    @classmethod
+    def period_of(cls, time: datetime) -> datetime:
+        return time.replace(minute=0, second=0, microsecond=0)
+
+
+class HashRateEpoch(ModelMixin, mg.Document):
+    """ hashrate of workers in a closed epoch, rolled up in background when the
+    window closes. Epochs before minute rollups began are rolled up from raw samples.
+    """
+    meta = {
+        "collection": "zil_hashrate_epoch", "strict": False,
+        "indexes": [
+            {"fields": ("block_num", "wallet_address", "worker_name"), "unique": True},
+        ],
+    }
+
+    block_num = mg.IntField(required=True)
+    wallet_address = mg.StringField(max_length=128, required=True)
+    worker_name = mg.StringField(max_length=64, default="")
+
+    max_hashrate = mg.IntField(default=0)
+    avg_hashrate = mg.IntField(default=0)
+
+    @classmethod
+    @routing.primary_reads()
+    def roll_epoch(cls, block_num):
+        """ roll up hashrate in PoW window of a closed epoch, upserts keep it idempotent
+        :return: True if the epoch is rolled up
+        """
+        from .pow import PoWWindow
+
+        window = PoWWindow.get_one(block_num=block_num, order="-create_time")
+        if window is None:
+            return False
+        if window.hashrate_rolled:
+            return True
+
+        pow_start, pow_end = PoWWindow.get_pow_window(block_num)
+        if not pow_start or not pow_end:
+            return False
+
+        first_minute = HashRateMinute.objects.order_by("period").only("period").first()
+        if first_minute is not None and first_minute.period <= pow_start:
+            source, time_field = HashRateMinute, "period"
+            pow_start = HashRateMinute.period_of(pow_start)
+            group = {"max_hashrate": {"$max": "$max_hashrate"},
+                     "sum_hashrate": {"$sum": "$sum_hashrate"},
+                     "samples": {"$sum": "$samples"}}
+        else:
+            # migrate epochs before minute rollups from raw samples
+            source, time_field = HashRate, "updated_time"
+            group = {"max_hashrate": {"$max": "$hashrate"},
+                     "sum_hashrate": {"$sum": "$hashrate"},
+                     "samples": {"$sum": 1}}
 
         pipeline = [
-            {"$match": match},
-            {"$group": group},
-            {"$group": group_sum}
+            {"$match": {time_field: {"$gte": pow_start, "$lte": pow_end}}},
+            {"$group": {"_id": {"wallet_address": "$wallet_address",
+                                "worker_name": "$worker_name"}, **group}},
+        ]
+        updates = [
+            UpdateOne({"block_num": block_num, **res["_id"]},
+                      {"$set": {"max_hashrate": res["max_hashrate"],
+                                "avg_hashrate": res["sum_hashrate"] // max(res["samples"], 1)}},
+                      upsert=True)
+            for res in source.objects.aggregate(*pipeline)
         ]
+        if updates:
+            cls._get_collection().bulk_write(updates, ordered=False)
+        PoWWindow.objects(block_num=block_num).update(set__hashrate_rolled=True)
+        return True
 
-        res = list(cls.objects.aggregate(*pipeline))
-        return res[0]["hashrate"] if res else 0
+    @classmethod
+    @routing.primary_reads()
+    def roll_closed_epochs(cls, grace=60, limit=100):
+        """ roll up epochs closed `grace` seconds ago, oldest first, in background,
+        reads stay on primary, a lagging secondary would freeze incomplete rollups.
+        :return: number of epochs rolled up
+        """
+        from .pow import PoWWindow
+
+        closed_before = datetime.utcnow() - timedelta(seconds=grace)
+        windows = PoWWindow.objects(
+            hashrate_rolled__in=[False, None],
+            block_num__lt=PoWWindow.get_latest_block_num(),
+            pow_end__lt=closed_before,
+        ).order_by("block_num").only("block_num").limit(limit)
+        block_nums = sorted({window.block_num for window in windows})
+        return sum(1 for block_num in block_nums if cls.roll_epoch(block_num))
+
+    @classmethod
+    def total_hashrate(cls, block_num, wallet_address=None, worker_name=None):
+        match = filter_worker({"block_num": block_num}, wallet_address, worker_name)
+        return sum_max_hashrate(cls, match)
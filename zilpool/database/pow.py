@@ -16,19 +16,39 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+import threading
+from collections import deque, defaultdict
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 
 import mongoengine as mg
-from mongoengine import Q
+from mongoengine import Q, OperationError
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
 
 from zilpool.pyzil import crypto, ethash
+from zilpool.common import events
 
 from . import miner
-from .basemodel import ModelMixin
+from .basemodel import ModelMixin, fail_safe
+from .archive import ArchiveMixin
 from zilpool.stratum.stratum_server import *
 
+# handlers waiting for pow results, keyed by (header, boundary)
+result_waiters = events.Waiters()
+# called with (header, boundary) when a work is finished or its result verified
+work_closed = events.Listeners()
+
+
 class PoWWindow(ModelMixin, mg.Document):
-    meta = {"collection": "zil_pow_windows", "strict": False}
+    meta = {
+        "collection": "zil_pow_windows", "strict": False,
+        "indexes": [
+            "-create_time",
+            ("block_num", "-create_time"),
+            ("hashrate_rolled", "block_num"),
+        ],
+    }
 
     create_time = mg.DateTimeField()
     block_num = mg.IntField(required=True)
@@ -38,6 +58,7 @@ class PoWWindow(ModelMixin, mg.Document):
     pow_end = mg.DateTimeField(default=datetime.utcnow)
     pow_window = mg.FloatField(default=0)
     epoch_window = mg.FloatField(default=0)
+    hashrate_rolled = mg.BooleanField(default=False)    # see HashRateEpoch
 
     @classmethod
     def get_latest_record(cls):
@@ -45,13 +66,14 @@ class PoWWindow(ModelMixin, mg.Document):
 
     @classmethod
     def get_latest_block_num(cls):
-        latest_record = cls.get_latest_record()
-        if not latest_record:
-            return -1
-        return latest_record.block_num
+        PoWWindowTracker.load()
+        return PoWWindowTracker.block_num
 
     @classmethod
     def get_pow_window(cls, block_num=None):
+        window = PoWWindowTracker.get_pow_window(block_num)
+        if window:
+            return window
         record = cls.objects(block_num=block_num).order_by("-create_time").first()
         if not record:
             return PowWork.calc_pow_window(block_num)
@@ -89,72 +111,197 @@ class PoWWindow(ModelMixin, mg.Document):
 
     @classmethod
     def seconds_to_next_pow(cls):
-        last_record = cls.get_latest_record()
-        if not last_record or not last_record.estimated_next_pow:
-            return 0
+        return PoWWindowTracker.seconds_to_next_pow()
 
-        now = datetime.utcnow()
-        next_pow_time = last_record.estimated_next_pow
-        if now > next_pow_time:
-            logging.warning("we are missing some pow_window records")
-            return 0
+    @classmethod
+    def update_pow_window(cls, work):
+        return PoWWindowTracker.on_new_work(work)
 
-        if now < last_record.pow_start + timedelta(seconds=last_record.pow_window):
-            # we are in current pow window
+
+class PoWWindowTracker:
+    """ in-memory PoW window, updated from work events and
+        persisted into zil_pow_windows in background,
+        loaded in init_db, the lock guards it against stats in executor threads
+    """
+    number_blocks = 10
+
+    loaded = False
+    block_num = -1
+    pow_start = None
+    pow_end = None
+    pow_window = 0            # estimated pow window of current epoch
+    estimated_next_pow = None
+
+    pow_windows = deque(maxlen=number_blocks)
+    epoch_windows = deque(maxlen=number_blocks)
+    avg_pow = 0
+    avg_epoch = 0
+
+    # single worker to keep the records saved in order
+    executor = ThreadPoolExecutor(max_workers=1)
+    lock = threading.RLock()
+
+    @classmethod
+    def reset(cls):
+        with cls.lock:
+            cls.loaded = False
+            cls.block_num = -1
+            cls.pow_start = cls.pow_end = None
+            cls.pow_window = 0
+            cls.estimated_next_pow = None
+            cls.pow_windows.clear()
+            cls.epoch_windows.clear()
+            cls.avg_pow = cls.avg_epoch = 0
+
+    @classmethod
+    def load(cls):
+        """ load the latest records from database once,
+        callers wait until the state is filled in.
+        """
+        if cls.loaded:
+            return
+        with cls.lock:
+            if cls.loaded:
+                return
+            cls._load_records()
+            cls.loaded = True
+
+    @classmethod
+    def _load_records(cls):
+        query = PoWWindow.objects().order_by("-create_time")
+        records = list(query.limit(cls.number_blocks + 1))
+        if not records:
+            return
+
+        latest, finished = records[0], records[1:]
+        for record in reversed(finished):
+            cls.pow_windows.append(record.pow_window)
+            cls.epoch_windows.append(record.epoch_window)
+        cls.calc_avg()
+
+        _, pow_end = PowWork.calc_pow_window(latest.block_num)
+        cls.block_num = latest.block_num
+        cls.pow_start = latest.pow_start
+        cls.pow_end = pow_end or latest.pow_end
+        cls.pow_window = latest.pow_window
+        cls.estimated_next_pow = latest.estimated_next_pow
+
+    @staticmethod
+    def trimmed_avg(windows):
+        windows = sorted(w for w in windows if w > 0)
+        if len(windows) > 4:
+            windows = windows[1:-1]
+        if not windows:
             return 0
+        return sum(windows) / len(windows)
 
-        return (next_pow_time - now).total_seconds()
+    @classmethod
+    def calc_avg(cls):
+        cls.avg_pow = cls.trimmed_avg(cls.pow_windows)
+        cls.avg_epoch = cls.trimmed_avg(cls.epoch_windows)
 
     @classmethod
-    def update_pow_window(cls, work):
+    def on_new_work(cls, work):
         if not work:
             return
+        cls.load()
+        with cls.lock:
+            return cls._on_new_work(work)
 
-        last_record_num = -1
-        last_record = cls.get_latest_record()
-        if last_record:
-            last_record_num = last_record.block_num
-
-        if work.block_num < last_record_num:
+    @classmethod
+    def _on_new_work(cls, work):
+        if work.block_num < cls.block_num:
             logging.critical("old record found in zil_pow_windows, "
                              "pls clean the database")
             return
 
-        if work.block_num == last_record_num:
-            # pow is ongoing, do nothing
+        if work.block_num == cls.block_num:
+            # pow is ongoing, extend the window
+            if cls.pow_end is None or work.expire_time > cls.pow_end:
+                cls.pow_end = work.expire_time
             return
 
-        if work.block_num == last_record_num + 1:
-            # new epoch start
-            # 1. update prev record
-            if last_record:
-                pow_start, pow_end = PowWork.calc_pow_window(last_record_num)
-                if pow_start and pow_end:
-                    pow_window = (pow_end - pow_start).total_seconds()
-                    epoch_window = (work.start_time - pow_start).total_seconds()
-
-                    last_record.update(
-                        pow_start=pow_start,
-                        pow_end=pow_end,
-                        pow_window=pow_window,
-                        epoch_window=epoch_window
-                    )
-
-        # 2. create new record and estimate next pow
-        epoch_delta = timedelta(seconds=cls.avg_epoch_time())
-        pow_window = last_record.pow_window if last_record else cls.avg_pow_time()
-        estimated_next_pow = work.start_time + epoch_delta
-        new_record = cls.create(
-            block_num=work.block_num,
-            create_time=datetime.utcnow(),
-            pow_start=work.start_time,
-            pow_window=pow_window,
-            estimated_next_pow=estimated_next_pow,
-        )
-        return new_record
+        # new epoch start
+        # 1. close prev window
+        prev_block, prev_window = cls.block_num, None
+        if work.block_num == prev_block + 1 and cls.pow_start and cls.pow_end:
+            pow_window = (cls.pow_end - cls.pow_start).total_seconds()
+            epoch_window = (work.start_time - cls.pow_start).total_seconds()
+            cls.pow_windows.append(pow_window)
+            cls.epoch_windows.append(epoch_window)
+            cls.calc_avg()
+
+            prev_window = {
+                "pow_start": cls.pow_start,
+                "pow_end": cls.pow_end,
+                "pow_window": pow_window,
+                "epoch_window": epoch_window,
+            }
+            cls.pow_window = pow_window
+        elif prev_block < 0:
+            cls.pow_window = cls.avg_pow
+
+        # 2. start new window and estimate next pow
+        cls.block_num = work.block_num
+        cls.pow_start = work.start_time
+        cls.pow_end = work.expire_time
+        cls.estimated_next_pow = work.start_time + timedelta(seconds=cls.avg_epoch)
+
+        new_record = {
+            "block_num": cls.block_num,
+            "create_time": datetime.utcnow(),
+            "pow_start": cls.pow_start,
+            "pow_window": cls.pow_window,
+            "estimated_next_pow": cls.estimated_next_pow,
+        }
+        return cls.executor.submit(cls.save_records, prev_block, prev_window, new_record)
 
+    @staticmethod
+    def save_records(prev_block, prev_window, new_record):
+        try:
+            if prev_window is not None:
+                PoWWindow.objects(block_num=prev_block).update(**prev_window)
+            return PoWWindow.create(**new_record)
+        except Exception:
+            logging.exception("failed to save pow window")
+
+    @classmethod
+    def flush(cls):
+        """ wait for pending records saved """
+        cls.executor.submit(lambda: None).result()
+
+    @classmethod
+    def get_pow_window(cls, block_num=None):
+        cls.load()
+        with cls.lock:
+            if cls.block_num < 0:
+                return None
+            if block_num is not None and block_num != cls.block_num:
+                return None
+            return cls.pow_start, cls.pow_end
+
+    @classmethod
+    def seconds_to_next_pow(cls):
+        cls.load()
+        with cls.lock:
+            pow_start, pow_window = cls.pow_start, cls.pow_window
+            estimated_next_pow = cls.estimated_next_pow
+        if not estimated_next_pow:
+            return 0
 
-class PowWork(ModelMixin, mg.Document):
+        now = datetime.utcnow()
+        if now > estimated_next_pow:
+            logging.warning("we are missing some pow_window records")
+            return 0
+
+        if now < pow_start + timedelta(seconds=pow_window):
+            # we are in current pow window
+            return 0
+
+        return (estimated_next_pow - now).total_seconds()
+
+
+class PowWork(ModelMixin, ArchiveMixin, mg.Document):
     header = mg.StringField(max_length=128, required=True)
     seed = mg.StringField(max_length=128, required=True)
     boundary = mg.StringField(max_length=128, required=True)
@@ -170,8 +317,22 @@ class PowWork(ModelMixin, mg.Document):
     miner_wallet = mg.StringField(max_length=128)
     pow_fee = mg.FloatField(default=0.0)
     dispatched = mg.IntField(default=0)
-
-    meta = {"collection": "zil_pow_works", "strict": False}
+    expired = mg.BooleanField(default=False)    # counted as expired in WorkCounter
+
+    meta = {
+        "collection": "zil_pow_works", "strict": False,
+        "indexes": [
+            ("finished", "expire_time"),
+            # get_new_works: equality, sort, then range fields
+            ("finished", "-boundary", "-pow_fee", "start_time", "dispatched", "expire_time"),
+            ("header", "start_time"),
+            ("block_num", "start_time"),
+            ("pub_key", "block_num"),
+            ("pub_key", "-expire_time"),
+            "start_time",
+        ],
+    }
+    archive_indexes = [("block_num", "start_time")]
 
     def __str__(self):
         return f"[PowWork: {self.header}, {self.finished}, {self.start_time}]"
@@ -179,15 +340,47 @@ class PowWork(ModelMixin, mg.Document):
     @classmethod
     def new_work(cls, header: str, block_num: int, boundary: str,
                  pub_key="", signature="", timeout=120, pow_fee=0.0):
+        if cls.is_archived(block_num):
+            logging.warning(f"block {block_num} is archived, work refused")
+            return None
         start_time = datetime.utcnow()
         expire_time = start_time + timedelta(seconds=timeout)
         seed = ethash.block_num_to_seed(block_num)
         seed = crypto.bytes_to_hex_str_0x(seed)
-        return cls.create(
+        work = cls.create(
             header=header, seed=seed, boundary=boundary, pow_fee=pow_fee,
             pub_key=pub_key, signature=signature, block_num=block_num,
             start_time=start_time, expire_time=expire_time
         )
+        if work:
+            WorkCounter.inc(pub_key, block_num, start_time=work.start_time, works=1)
+        return work
+
+    @classmethod
+    def sweep_expired(cls, now=None):
+        """ count works expired before finished
+        :return: number of works expired
+        """
+        if now is None:
+            now = datetime.utcnow()
+        query = Q(finished=False) & Q(expire_time__lt=now) & Q(expired__ne=True)
+        works = list(cls.objects(query).only("pub_key", "block_num"))
+        if not works:
+            return 0
+
+        blocks = defaultdict(list)
+        for work in works:
+            blocks[(work.pub_key, work.block_num)].append(work.pk)
+
+        # works finished or swept since selected are not counted
+        expired = 0
+        for (pub_key, block_num), pks in blocks.items():
+            count = cls.objects(pk__in=pks, finished=False, expired__ne=True).update(
+                set__expired=True)
+            if count:
+                WorkCounter.inc(pub_key, block_num, expired=count)
+                expired += count
+        return expired
 
     @classmethod
     def get_new_works(cls, count=1, min_fee=0.0, max_dispatch=None):
@@ -212,6 +405,24 @@ class PowWork(ModelMixin, mg.Document):
         cursor = cls.objects(query).order_by(order)    # default to get the oldest one
         return cursor.first()
 
+    @classmethod
+    def find_works_by_header(cls, header: str, check_expired=True):
+        """ all works of a header, the same header is requested
+            at both shard and DS difficulty
+        """
+        query = Q(header=header)
+        if check_expired:
+            query = query & Q(expire_time__gte=datetime.utcnow())
+        return list(cls.objects(query).order_by("start_time"))
+
+    @staticmethod
+    def pick_work(works, boundary=""):
+        """ pick the work miner asked for, default to the oldest one """
+        for work in works:
+            if not boundary or work.boundary == boundary:
+                return work
+        return None
+
     @classmethod
     def find_work_by_id(cls, id: object, check_expired=True):
         query = Q(pk=id)
@@ -232,12 +443,22 @@ class PowWork(ModelMixin, mg.Document):
 
     @classmethod
     def get_latest_work(cls, block_num=None, order="-start_time"):
-        if block_num is None:
-            cursor = cls.objects()
-        else:
-            cursor = cls.objects(block_num=block_num)
-
-        return cursor.order_by(order).first()
+        if block_num is not None:
+            cursor = cls.objects_of_block(block_num).filter(block_num=block_num)
+            return cursor.order_by(order).first()
+
+        live = cls.objects().order_by(order)
+        if cls.archived_block() < 0:
+            return live.first()
+
+        # latest works in live collection, first ones in archive
+        descending = order.startswith("-")
+        archive = cls.archive_objects().order_by("-block_num" if descending else "block_num", order)
+        for cursor in ((live, archive) if descending else (archive, live)):
+            work = cursor.first()
+            if work:
+                return work
+        return None
 
     @classmethod
     def get_node_works(cls, pub_key, count=1, order="-expire_time"):
@@ -245,7 +466,7 @@ class PowWork(ModelMixin, mg.Document):
 
     @classmethod
     def avg_pow_fee(cls, block_num):
-        return cls.query(block_num=block_num).average("pow_fee")
+        return cls.average_of_block(block_num, "pow_fee")
 
     @classmethod
     def calc_pow_window(cls, block_num=None):
@@ -266,16 +487,19 @@ class PowWork(ModelMixin, mg.Document):
 
         return [
             ethash.boundary_to_hashpower(boundary)
-            for boundary in cls.query(block_num=block_num).distinct("boundary")
+            for boundary in cls.objects_of_block(block_num).filter(
+                block_num=block_num).distinct("boundary")
         ]
 
     def increase_dispatched(self, max_dispatch, count=1, inc_seconds=0):
-        work = self.update(inc__dispatched=count)
+        work = self.update(only=("dispatched", "start_time", "expire_time"),
+                           inc__dispatched=count)
         if not work:
             return None
 
         if work.dispatched == 1:
             # the first dispatch
+            WorkCounter.inc(self.pub_key, self.block_num, dispatched=1)
             logging.warning(f"Work dispatched, {work.header} - {work.boundary}")
             return work
 
@@ -285,15 +509,70 @@ class PowWork(ModelMixin, mg.Document):
                 logging.error(f"reset start_time to retry,  {work.header} - {work.boundary}")
                 now = datetime.utcnow()
                 if now < work.expire_time:
-                    work = work.update(dispatched=1, start_time=now)
+                    work = work.update(only=("dispatched", "start_time"),
+                                       dispatched=1, start_time=now)
             else:
                 logging.warning(f"reset dispatched to retry, {self.header} - {self.boundary}")
-                work = work.update(dispatched=1, start_time=new_start_time)
+                work = work.update(only=("dispatched", "start_time"),
+                                   dispatched=1, start_time=new_start_time)
 
         return work
 
+    def check_result(self, hash_result) -> bool:
+        """ check the result if lesser than old one """
+        if not self.finished:
+            return True
+
+        prev_result = PowResult.get_pow_result(self.header, self.boundary)
+        if prev_result:
+            if prev_result.verified:
+                logging.info(f"submitted too late, work is verified. {self.header} {self.boundary}")
+                return False
+
+            if ethash.is_less_or_equal(prev_result.hash_result, hash_result):
+                logging.info(f"submitted result > old result, ignored. {self.header} {self.boundary}")
+                return False
+        return True
+
+    @classmethod
+    def save_result_to_works(cls, works, nonce: str, mix_digest: str, hash_result: bytes,
+                             miner_wallet: str, worker_name: str):
+        """ record one verified hash against every work it satisfies
+        :param works: works of the same header, the first one is the dispatched work
+        :return: list of works saved
+        """
+        hash_result_str = crypto.bytes_to_hex_str_0x(hash_result)
+
+        saved = []
+        for work in works:
+            if not ethash.is_less_or_equal(hash_result, work.boundary):
+                continue
+            if not work.check_result(hash_result):
+                continue
+            if not work.save_result(nonce, mix_digest, hash_result_str,
+                                    miner_wallet, worker_name):
+                logging.warning(f"failed to save result for miner "
+                                f"{miner_wallet}-{worker_name}, {work}")
+                continue
+            logging.critical(f"Work submitted, {work.header} {work.boundary}")
+            saved.append(work)
+        return saved
+
+    @fail_safe
+    def finish(self, miner_wallet):
+        """ set finished and miner, :return: the work before updated """
+        prev = self._qs.filter(pk=self.pk).only("finished").modify(
+            set__finished=True, set__miner_wallet=miner_wallet)
+        if prev is not None:
+            self.finished, self.miner_wallet = True, miner_wallet
+            self._clear_changed_fields()
+        return prev
+
     def save_result(self, nonce: str, mix_digest: str, hash_result: str,
                     miner_wallet: str, worker_name: str):
+        if PowResult.is_archived(self.block_num):
+            logging.warning(f"block {self.block_num} is archived, result refused")
+            return None
         now = datetime.utcnow()
         pow_result = PowResult(header=self.header, seed=self.seed,
                                finished_date=now.date(), finished_time=now,
@@ -303,14 +582,34 @@ class PowWork(ModelMixin, mg.Document):
                                mix_digest=mix_digest, nonce=nonce, verified=False,
                                miner_wallet=miner_wallet, worker_name=worker_name)
         if pow_result.save():
-            res = self.update(set__finished=True, set__miner_wallet=miner_wallet)
-            if res:
+            # the work before updated, a better result of a finished work is not counted
+            prev = self.finish(miner_wallet)
+            if prev:
+                if not prev.finished:
+                    WorkCounter.inc(self.pub_key, self.block_num, finished=1)
+                RewardLedger.add_result(pow_result)
+                result_waiters.notify((self.header, self.boundary), pow_result)
+                work_closed.emit(self.header, self.boundary)
                 return pow_result
         return None
 
 
-class PowResult(ModelMixin, mg.Document):
-    meta = {"collection": "zil_pow_results", "strict": False}
+def merge_time(pick, *times):
+    """ min or max of times not None, None if all are """
+    times = [time for time in times if time is not None]
+    return pick(times) if times else None
+
+
+class PowResult(ModelMixin, ArchiveMixin, mg.Document):
+    meta = {
+        "collection": "zil_pow_results", "strict": False,
+        "indexes": [
+            ("header", "boundary", "pub_key", "-finished_time"),
+            ("miner_wallet", "worker_name", "-finished_time"),
+            ("block_num", "miner_wallet"),
+        ],
+    }
+    archive_indexes = [("block_num", "miner_wallet")]
 
     header = mg.StringField(max_length=128, required=True)
     seed = mg.StringField(max_length=128, required=True)
@@ -336,7 +635,7 @@ class PowResult(ModelMixin, mg.Document):
 
     @classmethod
     def avg_pow_fee(cls, block_num):
-        return cls.query(block_num=block_num).average("pow_fee")
+        return cls.average_of_block(block_num, "pow_fee")
 
     @classmethod
     def get_pow_result(cls, header, boundary, pub_key=None, order="-finished_time"):
@@ -346,11 +645,31 @@ class PowResult(ModelMixin, mg.Document):
         cursor = cls.objects(query).order_by(order)    # default to get latest one
         return cursor.first()
 
+    @classmethod
+    async def wait_pow_result(cls, header, boundary, pub_key=None, timeout=0):
+        """ get pow result, wait up to timeout seconds if not found """
+        if timeout <= 0:
+            return await cls.aio.get_pow_result(header, boundary, pub_key=pub_key)
+
+        key = (header, boundary)
+        waiter = result_waiters.add(key)
+        try:
+            pow_result = await cls.aio.get_pow_result(header, boundary, pub_key=pub_key)
+            if pow_result:
+                return pow_result
+            if await result_waiters.wait(waiter, timeout) is None:
+                return None
+            return await cls.aio.get_pow_result(header, boundary, pub_key=pub_key)
+        finally:
+            result_waiters.remove(key, waiter)
+
     @classmethod
     def epoch_rewards(cls, block_num=None, miner_wallet=None, worker_name=None):
         match = {}
+        start = end = None
         if block_num is not None:
             if isinstance(block_num, int):
+                start = end = block_num
                 match = {
                     "block_num": {
                         "$eq": block_num,
@@ -393,10 +712,23 @@ class PowResult(ModelMixin, mg.Document):
             {"$group": group},
         ]
 
-        res = list(cls.objects.aggregate(*pipeline))
+        res = [
+            rewards
+            for queryset in cls.objects_of_blocks(start, end)
+            for rewards in queryset.aggregate(*pipeline)
+        ]
         if res:
             rewards = res[0]
             rewards.pop("_id", None)
+            for more in res[1:]:
+                # archive and live collection
+                rewards["rewards"] += more["rewards"]
+                rewards["count"] += more["count"]
+                rewards["verified"] += more["verified"]
+                rewards["first_work_at"] = merge_time(min, rewards["first_work_at"],
+                                                      more["first_work_at"])
+                rewards["last_work_at"] = merge_time(max, rewards["last_work_at"],
+                                                     more["last_work_at"])
             return rewards
 
         return {"rewards": None, "count": 0, "verified": 0,
@@ -440,7 +772,279 @@ class PowResult(ModelMixin, mg.Document):
             {"$project": project}
         ]
 
-        return list(cls.objects.aggregate(*pipeline))
+        return list(cls.objects_of_block(block_num).aggregate(*pipeline))
 
     def get_worker(self):
         return miner.Worker.get_or_create(self.miner_wallet, self.worker_name)
+
+    @fail_safe
+    def set_verified(self, verified: bool):
+        """ set verified by node, :return: the result before updated,
+        so concurrent verifications see it turned verified only once
+        """
+        now = datetime.utcnow()
+        prev = self._qs.filter(pk=self.pk).only("verified").modify(
+            set__verified=verified, set__verified_time=now)
+        if prev is not None:
+            self.verified, self.verified_time = verified, now
+            self._clear_changed_fields()
+        return prev
+
+
+class WorkCounter(ModelMixin, mg.Document):
+    """ counters of works updated on work creation, dispatch, solve,
+    verify and expiry, for all works, each node and each block.
+    """
+    meta = {
+        "collection": "zil_counters", "strict": False,
+        "indexes": [
+            {"fields": ["key"], "unique": True},
+        ],
+    }
+
+    GLOBAL = "global"
+
+    key = mg.StringField(max_length=160, required=True)    # GLOBAL, node:<pub_key>, block:<num>
+    works = mg.IntField(default=0)
+    dispatched = mg.IntField(default=0)
+    finished = mg.IntField(default=0)
+    verified = mg.IntField(default=0)
+    expired = mg.IntField(default=0)
+    start_time = mg.DateTimeField()    # start time of the first work, for blocks
+
+    @staticmethod
+    def node_key(pub_key):
+        return f"node:{pub_key}"
+
+    @staticmethod
+    def block_key(block_num):
+        return f"block:{block_num}"
+
+    @classmethod
+    @fail_safe
+    def inc(cls, pub_key, block_num=None, start_time=None, **counts):
+        """ increase counters in one bulk write, failures never fail the work updated """
+        keys = [cls.GLOBAL, cls.node_key(pub_key)]
+        updates = [UpdateOne({"key": key}, {"$inc": counts}, upsert=True) for key in keys]
+        if block_num is not None:
+            update = {"$inc": counts}
+            if start_time is not None:
+                update["$min"] = {"start_time": start_time}
+            updates.append(UpdateOne({"key": cls.block_key(block_num)}, update, upsert=True))
+
+        try:
+            cls._get_collection().bulk_write(updates, ordered=False)
+        except PyMongoError as e:
+            raise OperationError(f"failed to increase counters, {e}")
+
+    def works_stats(self):
+        return {
+            "all": self.works,
+            "working": max(self.works - self.finished - self.expired, 0),
+            "finished": self.finished,
+            "verified": self.verified,
+        }
+
+    @classmethod
+    def global_stats(cls):
+        counter = cls.get_one(key=cls.GLOBAL) or cls(key=cls.GLOBAL)
+        return counter.works_stats()
+
+    @classmethod
+    def node_stats(cls, pub_keys):
+        """ :return: dict of pub_key -> works stats, in one query """
+        keys = {cls.node_key(pub_key): pub_key for pub_key in pub_keys}
+        counters = {c.key: c for c in cls.objects(key__in=list(keys))}
+        return {
+            pub_key: counters.get(key, cls(key=key)).works_stats()
+            for key, pub_key in keys.items()
+        }
+
+    @classmethod
+    def block_counters(cls, block_nums):
+        """ :return: dict of block_num -> counter, in one query """
+        keys = {cls.block_key(block_num): block_num for block_num in block_nums}
+        counters = {c.key: c for c in cls.objects(key__in=list(keys))}
+        return {
+            block_num: counters.get(key, cls(key=key))
+            for key, block_num in keys.items()
+        }
+
+    @classmethod
+    def init(cls):
+        """ rebuild the counters from works and results if never counted """
+        if cls.get_one(key=cls.GLOBAL) is None:
+            logging.critical("No work counters in database, rebuild them")
+            cls.rebuild()
+
+    @classmethod
+    def rebuild(cls):
+        PowWork.objects(finished=False, expire_time__lt=datetime.utcnow()).update(set__expired=True)
+
+        counters = {}
+
+        def add(key, counts, start_time=None):
+            counter = counters.setdefault(key, {"key": key})
+            for name, count in counts.items():
+                counter[name] = counter.get(name, 0) + count
+            if start_time is not None:
+                counter["start_time"] = min(counter.get("start_time", start_time), start_time)
+
+        def add_all(_id, counts, start_time=None):
+            add(cls.GLOBAL, counts)
+            add(cls.node_key(_id["pub_key"]), counts)
+            add(cls.block_key(_id["block_num"]), counts, start_time)
+
+        works_group = {
+            "_id": {"pub_key": "$pub_key", "block_num": "$block_num"},
+            "works": {"$sum": 1},
+            "dispatched": {"$sum": {"$cond": [{"$gt": ["$dispatched", 0]}, 1, 0]}},
+            "finished": {"$sum": {"$cond": ["$finished", 1, 0]}},
+            "expired": {"$sum": {"$cond": ["$expired", 1, 0]}},
+            "start_time": {"$min": "$start_time"},
+        }
+        for queryset in PowWork.objects_of_blocks():
+            for res in queryset.aggregate({"$group": works_group}):
+                _id, start_time = res.pop("_id"), res.pop("start_time")
+                add_all(_id, res, start_time)
+
+        results_group = {
+            "_id": {"pub_key": "$pub_key", "block_num": "$block_num"},
+            "verified": {"$sum": {"$cond": ["$verified", 1, 0]}},
+        }
+        for queryset in PowResult.objects_of_blocks():
+            for res in queryset.aggregate({"$group": results_group}):
+                add_all(res.pop("_id"), res)
+
+        add(cls.GLOBAL, {})
+        cls.objects.delete()
+        cls.objects.insert([cls(**counter) for counter in counters.values()], load_bulk=False)
+
+
+class RewardLedger(ModelMixin, mg.Document):
+    """ rewards of miners in a block, updated when results are saved and verified """
+    meta = {
+        "collection": "zil_reward_ledger", "strict": False,
+        "indexes": [
+            {"fields": ("block_num", "miner_wallet"), "unique": True},
+            ("miner_wallet", "block_num"),
+        ],
+    }
+
+    block_num = mg.IntField(required=True)
+    miner_wallet = mg.StringField(max_length=128, required=True)
+
+    rewards = mg.FloatField(default=0.0)
+    finished = mg.IntField(default=0)
+    verified = mg.IntField(default=0)
+    first_work_at = mg.DateTimeField()
+    last_work_at = mg.DateTimeField()
+
+    @classmethod
+    @fail_safe
+    def add_result(cls, pow_result):
+        cls.objects(block_num=pow_result.block_num,
+                    miner_wallet=pow_result.miner_wallet).update_one(
+            upsert=True,
+            inc__rewards=pow_result.pow_fee,
+            inc__finished=1,
+            min__first_work_at=pow_result.finished_time,
+            max__last_work_at=pow_result.finished_time,
+        )
+
+    @classmethod
+    @fail_safe
+    def add_verified(cls, pow_result):
+        cls.objects(block_num=pow_result.block_num,
+                    miner_wallet=pow_result.miner_wallet).update_one(
+            upsert=True, inc__verified=1
+        )
+
+    def to_rewards(self):
+        """ same as a row of PowResult.rewards_by_miners """
+        return {
+            "miner_wallet": self.miner_wallet,
+            "block_num": self.block_num,
+            "date": self.first_work_at,
+            "date_time": self.first_work_at,
+            "rewards": self.rewards,
+            "finished": self.finished,
+            "verified": self.verified,
+        }
+
+    @classmethod
+    def rewards_by_blocks(cls, block_nums):
+        """ rewards of miners in blocks, in one range scan
+        :return: dict of block_num -> list of rewards by miners
+        """
+        block_nums = set(block_nums)
+        rewards = {block_num: [] for block_num in block_nums}
+        if not block_nums:
+            return rewards
+
+        query = cls.objects(block_num__gte=min(block_nums), block_num__lte=max(block_nums))
+        for ledger in query.order_by("block_num", "miner_wallet"):
+            if ledger.block_num in rewards:
+                rewards[ledger.block_num].append(ledger.to_rewards())
+        return rewards
+
+    @classmethod
+    def epoch_rewards(cls, block_num=None, miner_wallet=None):
+        """ same as PowResult.epoch_rewards, without worker_name """
+        match = {}
+        if block_num is not None:
+            if isinstance(block_num, int):
+                match["block_num"] = {"$eq": block_num}
+            else:
+                start, end = block_num
+                match["block_num"] = {"$gte": start, "$lte": end}
+        if miner_wallet is not None:
+            match["miner_wallet"] = {"$eq": miner_wallet}
+
+        group = {
+            "_id": None,
+            "rewards": {"$sum": "$rewards"},
+            "count": {"$sum": "$finished"},
+            "verified": {"$sum": "$verified"},
+            "first_work_at": {"$min": "$first_work_at"},
+            "last_work_at": {"$max": "$last_work_at"}
+        }
+
+        res = list(cls.objects.aggregate({"$match": match}, {"$group": group}))
+        if res:
+            rewards = res[0]
+            rewards.pop("_id", None)
+            return rewards
+
+        return {"rewards": None, "count": 0, "verified": 0,
+                "first_work_at": None, "last_work_at": None}
+
+    @classmethod
+    def init(cls):
+        """ rebuild the ledger from results if never built """
+        if cls.estimated_count() == 0 and PowResult.estimated_count() > 0:
+            logging.critical("No reward ledger in database, rebuild it")
+            cls.rebuild()
+
+    @classmethod
+    def rebuild(cls):
+        group = {
+            "_id": {"block_num": "$block_num", "miner_wallet": "$miner_wallet"},
+            "rewards": {"$sum": "$pow_fee"},
+            "finished": {"$sum": 1},
+            "verified": {"$sum": {"$cond": ["$verified", 1, 0]}},
+            "first_work_at": {"$min": "$finished_time"},
+            "last_work_at": {"$max": "$finished_time"},
+        }
+        ledgers = []
+        for queryset in PowResult.objects_of_blocks():
+            for res in queryset.aggregate({"$group": group}):
+                _id = res.pop("_id")
+                if _id.get("miner_wallet") is None:
+                    continue
+                ledgers.append(cls(block_num=_id.get("block_num", 0),
+                                   miner_wallet=_id["miner_wallet"], **res))
+
+        cls.objects.delete()
+        if ledgers:
+            cls.objects.insert(ledgers, load_bulk=False)
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# Zilliqa Mining Proxy
+# Copyright (C) 2019  Gully Chen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+  retention of high volume collections with TTL indexes
+"""
+
+import logging
+
+from pymongo import ASCENDING
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def retention_policies():
+    """ retention key in config -> (model, time field, partial filter) """
+    from .miner import HashRate, HashRateMinute
+    from .pow import PowWork, PowResult
+    from .ziladmin import ZilAdminToken
+
+    return {
+        "hashrate": (HashRate, "updated_time", None),
+        "hashrate_minute": (HashRateMinute, "updated_time", None),
+        "unfinished_works": (PowWork, "expire_time", {"finished": False}),
+        "results": (PowResult, "finished_time", None),
+        "admin_token": (ZilAdminToken, "expire_time", None),
+    }
+
+
+def retained_collections(model):
+    """ collection of a model, and its archive if created """
+    from .archive import ArchiveMixin, archive_exists, get_archive_collection
+
+    collections = [model._get_collection()]
+    if issubclass(model, ArchiveMixin) and archive_exists(model):
+        collections.append(get_archive_collection(model))
+    return collections
+
+
+def ttl_index_name(field):
+    return f"ttl_{field}"
+
+
+def apply_ttl(collection, field, days, partial=None):
+    """ create, change or drop the TTL index of a collection,
+    MongoDB removes documents `days` after the time in `field`.
+    :return: action taken, None if the index is up to date
+    """
+    name = ttl_index_name(field)
+    index = collection.index_information().get(name)
+
+    if not days:
+        if index is None:
+            return None
+        collection.drop_index(name)
+        return "dropped"
+
+    seconds = int(days * SECONDS_PER_DAY)
+    if index is None:
+        kwargs = {"name": name, "expireAfterSeconds": seconds}
+        if partial:
+            kwargs["partialFilterExpression"] = partial
+        collection.create_index([(field, ASCENDING)], **kwargs)
+        return "created"
+
+    if index.get("expireAfterSeconds") != seconds:
+        collection.database.command("collMod", collection.name,
+                                    index={"name": name, "expireAfterSeconds": seconds})
+        return "changed"
+    return None
+
+
+def init_retention(config):
+    retention = config.database.get("retention") or {}
+
+    for key, (model, field, partial) in retention_policies().items():
+        days = retention.get(key, 0)
+        for collection in retained_collections(model):
+            action = apply_ttl(collection, field, days, partial)
+            if action:
+                logging.critical(f"retention of {collection.name}: "
+                                 f"{days} days after {field}, index {action}")
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# Zilliqa Mining Proxy
+# Copyright (C) 2019  Gully Chen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+  count database round trips of a request
+"""
+
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from pymongo import monitoring
+
+UNACKNOWLEDGED = "unacknowledged"
+
+_current = ContextVar("db_round_trips", default=None)
+
+
+def is_unacknowledged(command) -> bool:
+    write_concern = command.get("writeConcern") or {}
+    return write_concern.get("w", 1) == 0
+
+
+class RoundTripListener(monitoring.CommandListener):
+    """ count commands sent to MongoDB while a counter is active,
+    unacknowledged writes are counted apart as nothing is waited for them.
+    """
+
+    def started(self, event):
+        counter = _current.get()
+        if counter is None:
+            return
+        if is_unacknowledged(event.command):
+            counter[UNACKNOWLEDGED] += 1
+        else:
+            counter[event.command_name] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+listener = RoundTripListener()
+
+
+@contextmanager
+def counting():
+    """ count commands in current context,
+    the command listener runs in the thread which sends the command,
+    calls in executors are counted if run by aio.run, which copies the context.
+    """
+    counter = Counter()
+    token = _current.set(counter)
+    try:
+        yield counter
+    finally:
+        _current.reset(token)
+
+
+def total(counter) -> int:
+    """ round trips waited, unacknowledged writes excluded """
+    return sum(n for name, n in counter.items() if name != UNACKNOWLEDGED)
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+# Zilliqa Mining Proxy
+# Copyright (C) 2019  Gully Chen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+  route read-only stats queries to MongoDB secondaries
+
+    @method
+    @routing.stats_reads
+    async def stats(request): ...
+
+    with routing.secondary_reads():
+        nodes = list(ZilNode.paginate(...))
+
+Queries from `Model.objects` in these contexts use the configured read
+preference, mining path and writes stay on the primary. Reads followed
+by writes depending on them run in `primary_reads()`.
+"""
+
+import logging
+from functools import wraps
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from pymongo import read_preferences
+from mongoengine.queryset import QuerySet, QuerySetManager
+
+MIN_MAX_STALENESS = 90    # required by MongoDB, in seconds
+
+READ_PREFERENCES = {
+    "primaryPreferred": read_preferences.PrimaryPreferred,
+    "secondary": read_preferences.Secondary,
+    "secondaryPreferred": read_preferences.SecondaryPreferred,
+    "nearest": read_preferences.Nearest,
+}
+
+_route = ContextVar("db_secondary_reads", default=False)
+_read_preference = None    # of routed reads, None to read from primary
+
+
+def make_read_preference(mode="primary", max_staleness=-1):
+    """ :return: pymongo read preference, None for primary """
+    if mode == "primary":
+        return None
+    if mode not in READ_PREFERENCES:
+        raise ValueError(f"invalid read preference {mode}")
+    if max_staleness != -1 and max_staleness < MIN_MAX_STALENESS:
+        raise ValueError(f"max_staleness should be -1 or >= {MIN_MAX_STALENESS} seconds")
+    return READ_PREFERENCES[mode](max_staleness=max_staleness)
+
+
+def configure(config):
+    global _read_preference
+    db_config = config.database
+    _read_preference = make_read_preference(
+        db_config.get("stats_read_preference", "primary"),
+        db_config.get("max_staleness", -1),
+    )
+    if _read_preference is not None:
+        logging.critical(f"stats reads routed to {_read_preference}")
+
+
+def current_read_preference():
+    return _read_preference if _route.get() else None
+
+
+@contextmanager
+def secondary_reads():
+    token = _route.set(True)
+    try:
+        yield
+    finally:
+        _route.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    """ read from primary even in a stats context, for reads before writes """
+    token = _route.set(False)
+    try:
+        yield
+    finally:
+        _route.reset(token)
+
+
+def stats_reads(handler):
+    """ decorator of async handlers reading stats only """
+    @wraps(handler)
+    async def wrapper(*args, **kwargs):
+        with secondary_reads():
+            return await handler(*args, **kwargs)
+    return wrapper
+
+
+class RoutedQuerySetManager(QuerySetManager):
+    """ `Model.objects` with the read preference of current context """
+
+    def __get__(self, instance, owner):
+        queryset = super().__get__(instance, owner)
+        read_preference = current_read_preference()
+        if read_preference is not None and isinstance(queryset, QuerySet):
+            queryset = queryset.read_preference(read_preference)
+        return queryset
@@ -39,7 +39,12 @@ AdminActions = [
 
 
 class ZilAdminToken(ModelMixin, mg.Document):
-    meta = {"collection": "zil_admin_token", "strict": False}
+    meta = {
+        "collection": "zil_admin_token", "strict": False,
+        "indexes": [
+            ("token", "action"),
+        ],
+    }
 
     token = mg.StringField(max_length=128)
     expire_time = mg.DateTimeField()
@@ -183,7 +188,12 @@ class ZilAdminToken(ModelMixin, mg.Document):
 class ZilAdmin(ModelMixin, mg.Document):
     VISA_LENGTH = 16
 
-    meta = {"collection": "zil_admin", "strict": False}
+    meta = {
+        "collection": "zil_admin", "strict": False,
+        "indexes": [
+            "visa",
+        ],
+    }
     email = mg.StringField(max_length=128, required=True, unique=True)
     password_hash = mg.StringField(max_length=128, required=True)
     visa = mg.StringField(max_length=128)    # for login api
@@ -253,7 +263,12 @@ class ZilAdmin(ModelMixin, mg.Document):
 
 
 class SiteSettings(ModelMixin, mg.Document):
-    meta = {"collection": "zil_site_settings", "strict": False}
+    meta = {
+        "collection": "zil_site_settings", "strict": False,
+        "indexes": [
+            "-created",
+        ],
+    }
 
     admin = mg.StringField()    # the email of admin who create this setting
     created = mg.DateTimeField()
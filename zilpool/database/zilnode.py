@@ -20,7 +20,6 @@ import logging
 from datetime import datetime, timedelta
 
 import mongoengine as mg
-from mongoengine import Q
 
 from .basemodel import ModelMixin
 
@@ -68,7 +67,12 @@ class ZilNodeOwner(ModelMixin, mg.Document):
 
 
 class ZilNode(ModelMixin, mg.Document):
-    meta = {"collection": "zil_nodes", "strict": False}
+    meta = {
+        "collection": "zil_nodes", "strict": False,
+        "indexes": [
+            ("authorized", "email"),
+        ],
+    }
 
     pub_key = mg.StringField(max_length=128, required=True, unique=True)
     pow_fee = mg.FloatField(default=0.0)
@@ -101,13 +105,6 @@ class ZilNode(ModelMixin, mg.Document):
         return pow.PowWork.aggregate_count(match, group)
 
     def works_stats(self):
-        from .pow import PowWork, PowResult
+        from .pow import WorkCounter
 
-        working_q = Q(expire_time__gte=datetime.utcnow()) & Q(finished=False)
-
-        return {
-            "all": PowWork.count(pub_key=self.pub_key),
-            "working": PowWork.count(working_q, pub_key=self.pub_key),
-            "finished": PowWork.count(pub_key=self.pub_key, finished=True),
-            "verified": PowResult.count(pub_key=self.pub_key, verified=True),
-        }
+        return WorkCounter.node_stats([self.pub_key])[self.pub_key]
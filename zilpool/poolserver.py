@@ -29,7 +29,10 @@ from jsonrpcserver import async_dispatch
 from jsonrpcserver.response import ExceptionResponse
 
 from zilpool import backgound
+from zilpool.database import roundtrip, aio
 from zilpool.stratum.stratum_server import *
+from zilpool.stratum.ratelimit import StratumLimits
+from zilpool.stratum.dedup import ShareFilter
 
 # setup root logger
 FORMATTER = logging.Formatter(
@@ -59,23 +62,37 @@ def setup_logging(log_config):
 
 def create_api_handler(config=None):
     compat_dumps = partial(dumps, separators=(",", ":"))
+    count_round_trips = config.database.get("count_round_trips", False)
+
+    async def dispatch(request_text, request):
+        return await async_dispatch(request_text,
+                                    context=request,
+                                    debug=config.debug,
+                                    basic_logging=False,
+                                    trim_log_values=True)
 
     async def api_handle(request: web.Request) -> web.Response:
         request_text = await request.text()
-        response = await async_dispatch(request_text,
-                                        context=request,
-                                        debug=config.debug,
-                                        basic_logging=False,
-                                        trim_log_values=True)
+        headers = None
+        if count_round_trips:
+            with roundtrip.counting() as counter:
+                response = await dispatch(request_text, request)
+            round_trips = roundtrip.total(counter)
+            headers = {"X-DB-Round-Trips": str(round_trips)}
+            logging.info(f"db round trips: {round_trips}, {dict(counter)}, "
+                         f"request: {request_text[:120]}")
+        else:
+            response = await dispatch(request_text, request)
 
         if isinstance(response, ExceptionResponse):
             logging.error("Server Error", exc_info=response.exc)
         if response.wanted:
             return web.json_response(response.deserialized(),
                                      status=response.http_status,
+                                     headers=headers,
                                      dumps=compat_dumps)
         else:
-            return web.Response()
+            return web.Response(headers=headers)
     return api_handle
 
 
@@ -121,17 +138,30 @@ def update_config(site, config):
             # set auto generated website url
             website_config["url"] = web_url
 
-def add_stratum_protocol():
-    proto = lambda: StratumServerProtocol()
+def add_stratum_protocol(config):
+    stratum_config = config["stratum_server"]
+    limits = StratumLimits.from_config(stratum_config.get("rate_limit"))
+    shares = ShareFilter.from_config(stratum_config)
+    proto = lambda: StratumServerProtocol(stratum_config, limits, shares)
     return proto
 
-async def start_stratum(config):
+async def start_stratum(config, conf_file=None):
+    if config["stratum_server"].get("workers", 0) > 0:
+        # run stratum server in worker processes
+        from zilpool.stratum.cluster import start_cluster
+        await start_cluster(config, conf_file)
+        return
+
     # run stratum server
     port = config["stratum_server"].get("port", "33456")
     host = config["stratum_server"].get("host", "0.0.0.0")
 
     loop = asyncio.get_running_loop()
-    server = await loop.create_server(add_stratum_protocol(), host, port)
+    server = await loop.create_server(add_stratum_protocol(config), host, port)
+    loop.create_task(evict_sessions(config["stratum_server"]))
+    vardiff_config = config["stratum_server"].get("vardiff")
+    if vardiff_config and vardiff_config.get("enabled"):
+        loop.create_task(retarget_sessions(vardiff_config))
 
     logging.info(f"Stratum server running at: {host}:{port}")
 
@@ -154,6 +184,7 @@ async def start_servers(conf_file=None, host=None, port=None):
     # init database
     connect_to_db(config)
     init_db(config)
+    aio.init_executor(config.database.get("executor_workers", aio.DEFAULT_WORKERS))
 
     # init Zilliqa network APIs
     blockchain.Zilliqa.init(config)
@@ -187,4 +218,4 @@ async def start_servers(conf_file=None, host=None, port=None):
     update_config(site, config)
 
     # start stratum server
-    await start_stratum(config)
+    await start_stratum(config, conf_file)
@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*-
+# Zilliqa Mining Proxy
+# Copyright (C) 2019  Gully Chen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+  multi-process stratum front end
+
+  Stratum worker processes share the stratum port with SO_REUSEPORT,
+  and connect to the hub in API process with a unix socket in a private
+  directory. Workers never connect to database, the hub persists for them.
+  Messages are newline delimited json:
+    hub -> worker:  {"method": "work"}    new works to dispatch
+                    {"method": "closed", "params": [header, boundary]}
+                    {"id": n, "result": bool or [work]}
+    worker -> hub:  {"id": n, "method": "worker", "params": {worker}}
+                    {"id": n, "method": "submit", "params": {submit}}
+                    {"id": n, "method": "works", "params": {"count": n}}
+                    {"method": "failed", "params": {worker}}
+                    {"method": "hashrate", "params": {hashrate}}
+                    {"method": "counters", "params": {counters}}
+
+  Workers pull one dispatched work per session, so max_dispatch holds
+  across all workers. On "closed", only sessions released pull new works.
+"""
+
+import os
+import stat
+import asyncio
+import logging
+import itertools
+import multiprocessing
+from collections import namedtuple, Counter, OrderedDict
+
+from zilpool.common import utils
+from zilpool.database import aio
+from zilpool.pyzil.crypto import hex_str_to_bytes as h2b
+from zilpool.pyzil.crypto import bytes_to_hex_str as b2h
+from zilpool.stratum import stratum_server
+from zilpool.stratum.stratum_server import (
+    stratumSessions, encode_message, broadcast_works, release_closed_work, save_submit,
+    evict_sessions, retarget_sessions, StratumServerProtocol, DatabaseStore,
+    BROADCAST_HIGH_WATER,
+)
+from zilpool.stratum.ratelimit import StratumLimits
+from zilpool.stratum.dedup import ShareFilter
+from zilpool.stratum.framing import LineFramer, LineTooLong
+from zilpool.stratum.extranonce import ExtranonceAllocator
+from zilpool.stratum.jobs import to_timestamp
+
+IPC_DIR = "/tmp/zilpool-stratum"
+IPC_SOCKET = "stratum.sock"
+IPC_MAX_LINE = 64 * 1024
+SUBMIT_TIMEOUT = 30
+MAX_HUB_WORKERS = 65536    # Worker documents cached by hub
+
+# set in API process if stratum workers are running
+hub = None
+
+# coroutine function, count -> list of works dispatched, set in API process
+work_fetcher = None
+
+WorkRecord = namedtuple("WorkRecord", ["pk", "header", "seed", "boundary", "block_num",
+                                       "expire_time"])
+# worker of stratum worker sessions, the Worker document is kept by hub
+WorkerKey = namedtuple("WorkerKey", ["wallet_address", "worker_name"])
+
+
+def ipc_path(stratum_config) -> str:
+    """ path of hub socket, in a directory only the user running pool can access """
+    ipc_dir = stratum_config.get("ipc_dir", IPC_DIR)
+    os.makedirs(ipc_dir, mode=0o700, exist_ok=True)
+    st = os.lstat(ipc_dir)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise PermissionError(f"{ipc_dir} should be a directory of uid {os.getuid()} "
+                              f"with mode 0700")
+    return os.path.join(ipc_dir, IPC_SOCKET)
+
+
+def work_to_dict(work) -> dict:
+    return {
+        "pk": str(work.pk),
+        "header": work.header,
+        "seed": work.seed,
+        "boundary": work.boundary,
+        "block_num": work.block_num,
+        "expire_time": to_timestamp(work.expire_time),
+    }
+
+
+def session_counters() -> dict:
+    if hub is not None:
+        return hub.counters()
+    return stratumSessions.counters()
+
+
+async def read_messages(reader, framer):
+    """ yield messages until EOF """
+    while True:
+        data = await reader.read(IPC_MAX_LINE)
+        if not data:
+            return
+        for msg in framer.feed(data):
+            yield msg
+
+
+class ClusterHub:
+    """ runs in API process, publishes works and persists for stratum workers """
+    def __init__(self, path):
+        self.path = path
+        self.server = None
+        self.workers = {}    # writer -> last reported counters
+        self.store = DatabaseStore()
+        self._worker_docs = OrderedDict()    # WorkerKey -> Worker, least recent first
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.server = await asyncio.start_unix_server(self.handle_worker, path=self.path)
+        os.chmod(self.path, 0o600)
+
+    async def handle_worker(self, reader, writer):
+        self.workers[writer] = {}
+        logging.info(f"stratum worker connected, {len(self.workers)} workers")
+        try:
+            async for msg in read_messages(reader, LineFramer(IPC_MAX_LINE)):
+                method = msg.get("method")
+                if method == "submit":
+                    asyncio.ensure_future(self.handle_submit(writer, msg["id"], msg["params"]))
+                elif method == "worker":
+                    asyncio.ensure_future(self.handle_get_worker(writer, msg["id"],
+                                                                 msg["params"]))
+                elif method == "works":
+                    asyncio.ensure_future(self.handle_works(writer, msg["id"], msg["params"]))
+                elif method == "failed":
+                    asyncio.ensure_future(self.handle_failed(msg["params"]))
+                elif method == "hashrate":
+                    asyncio.ensure_future(self.handle_hashrate(msg["params"]))
+                elif method == "counters":
+                    self.workers[writer] = msg["params"]
+        except (ConnectionError, LineTooLong):
+            logging.exception("stratum worker connection error")
+        finally:
+            self.workers.pop(writer, None)
+            writer.close()
+            logging.warning(f"stratum worker disconnected, {len(self.workers)} workers")
+
+    @staticmethod
+    def reply(writer, id, result):
+        if not writer.is_closing():
+            writer.write(encode_message({"id": id, "result": result}))
+
+    async def get_worker(self, params):
+        """ Worker of a stratum worker session, cached by hub
+        :return: Worker or None
+        """
+        key = WorkerKey(params["wallet_address"], params["worker_name"])
+        _worker = self._worker_docs.get(key)
+        if _worker is not None:
+            self._worker_docs.move_to_end(key)
+            return _worker
+        _worker = await self.store.get_worker(*key)
+        if _worker is not None:
+            self._worker_docs[key] = _worker
+            if len(self._worker_docs) > MAX_HUB_WORKERS:
+                self._worker_docs.popitem(last=False)
+        return _worker
+
+    async def handle_get_worker(self, writer, id, params):
+        try:
+            ok = await self.get_worker(params) is not None
+        except Exception:
+            logging.exception("Failed to get worker for stratum worker")
+            ok = False
+        self.reply(writer, id, ok)
+
+    async def handle_submit(self, writer, id, params):
+        """ save a submit verified by stratum worker """
+        try:
+            _worker = await self.get_worker(params)
+            ok = _worker is not None and await aio.run(
+                save_submit, params["work_id"], params["header"], params["nonce"],
+                params["mix_digest"], h2b(params["hash_result"]), _worker
+            )
+        except Exception:
+            logging.exception("Failed to save forwarded submit")
+            ok = False
+        self.reply(writer, id, bool(ok))
+
+    async def handle_failed(self, params):
+        try:
+            _worker = await self.get_worker(params)
+            if _worker is not None:
+                await self.store.fail_submit(_worker)
+        except Exception:
+            logging.exception("Failed to count failed submit")
+
+    async def handle_hashrate(self, params):
+        try:
+            await self.store.log_hashrate(params["hashrate"], params["wallet_address"],
+                                          params["worker_name"])
+        except Exception:
+            logging.exception("Failed to log hashrate of stratum worker")
+
+    async def handle_works(self, writer, id, params):
+        """ dispatch works to the sessions of a worker """
+        works = []
+        if work_fetcher is not None:
+            try:
+                works = await work_fetcher(params.get("count", 1))
+            except Exception:
+                logging.exception("Failed to dispatch works to stratum worker")
+        self.reply(writer, id, [work_to_dict(w) for w in works])
+
+    def publish(self, message):
+        data = encode_message(message)
+        sent = 0
+        for writer in list(self.workers):
+            if not writer.is_closing():
+                writer.write(data)
+                sent += 1
+        return sent
+
+    def publish_work(self):
+        """ tell workers to pull works for their sessions """
+        return self.publish({"method": "work"})
+
+    def publish_closed(self, header, boundary):
+        """ tell workers a work is closed, they pull new works """
+        return self.publish({"method": "closed", "params": [header, boundary]})
+
+    def counters(self) -> dict:
+        total = Counter()
+        for counters in self.workers.values():
+            total.update(counters)
+        total["workers"] = len(self.workers)
+        return dict(total)
+
+
+class ClusterClient:
+    """ runs in stratum worker, receives works, and is the submit store of
+    its sessions, forwarding all persistence to hub.
+    """
+    def __init__(self, path, high_water=BROADCAST_HIGH_WATER):
+        self.path = path
+        self.high_water = high_water
+        self.reader = self.writer = None
+        self._ids = itertools.count(1)
+        self._pending = {}
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_unix_connection(self.path)
+
+    async def run(self):
+        """ process messages from hub, return when hub is gone """
+        try:
+            async for msg in read_messages(self.reader, LineFramer(IPC_MAX_LINE)):
+                if msg.get("method") == "work":
+                    asyncio.ensure_future(self.pull_works())
+                elif msg.get("method") == "closed":
+                    # only sessions mining the closed work need new works
+                    sessions = release_closed_work(*msg["params"])
+                    if sessions:
+                        asyncio.ensure_future(self.pull_works(sessions))
+                elif "id" in msg:
+                    fut = self._pending.pop(msg["id"], None)
+                    if fut is not None and not fut.done():
+                        fut.set_result(msg["result"])
+        finally:
+            for fut in self._pending.values():
+                if not fut.done():
+                    fut.set_result(False)
+            self._pending.clear()
+
+    def notify(self, method, params):
+        """ send a message to hub without reply """
+        if self.writer is not None and not self.writer.is_closing():
+            self.writer.write(encode_message({"method": method, "params": params}))
+
+    async def request(self, method, params, timeout=SUBMIT_TIMEOUT):
+        """ send a request to hub, :return: result, False if failed """
+        if self.writer is None or self.writer.is_closing():
+            return False
+        id = next(self._ids)
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[id] = fut
+        self.writer.write(encode_message({"id": id, "method": method, "params": params}))
+        try:
+            return await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"{method} {id} not replied in {timeout} seconds")
+            return False
+        finally:
+            self._pending.pop(id, None)
+
+    async def fetch_works(self, count):
+        works = await self.request("works", {"count": count})
+        return [WorkRecord(**work) for work in works or []]
+
+    async def pull_works(self, sessions=None):
+        try:
+            await broadcast_works(self.fetch_works, self.high_water, sessions)
+        except Exception:
+            logging.exception("Failed to pull works from hub")
+
+    async def get_worker(self, miner_wallet, worker_name):
+        _worker = WorkerKey(miner_wallet, worker_name)
+        ok = await self.request("worker", _worker._asdict())
+        return _worker if ok else None
+
+    async def fail_submit(self, _worker):
+        self.notify("failed", _worker._asdict())
+
+    async def save_submit(self, _worker, job, nonce, mix_digest, hash_result: bytes) -> bool:
+        return bool(await self.request("submit", {
+            "work_id": job.work_id,
+            "header": job.header,
+            "nonce": nonce,
+            "mix_digest": mix_digest,
+            "hash_result": b2h(hash_result),
+            **_worker._asdict(),
+        }))
+
+    async def log_hashrate(self, hashrate, wallet_address, worker_name):
+        self.notify("hashrate", {"hashrate": hashrate, "wallet_address": wallet_address,
+                                 "worker_name": worker_name})
+
+    async def report_counters(self, interval):
+        while not self.writer.is_closing():
+            self.notify("counters", stratumSessions.counters())
+            await asyncio.sleep(interval)
+
+
+async def serve_worker(conf_file, index):
+    from zilpool.poolserver import setup_logging
+
+    config = utils.merge_config(conf_file)
+    setup_logging(config["logging"])
+
+    stratum_config = config["stratum_server"]
+    port = stratum_config.get("port", "33456")
+    host = stratum_config.get("host", "0.0.0.0")
+
+    client = ClusterClient(ipc_path(stratum_config),
+                           stratum_config.get("broadcast_high_water", BROADCAST_HIGH_WATER))
+    await client.connect()
+    stratum_server.submit_store = client
+    # prefixes of workers start with the worker index, never collide
+    stratum_server.extranonces = ExtranonceAllocator(root=f"{index:02x}", max_bytes=2)
+
+    loop = asyncio.get_running_loop()
+    limits = StratumLimits.from_config(stratum_config.get("rate_limit"))
+    shares = ShareFilter.from_config(stratum_config)
+    server = await loop.create_server(
+        lambda: StratumServerProtocol(stratum_config, limits, shares),
+        host, port, reuse_port=True
+    )
+    loop.create_task(evict_sessions(stratum_config))
+    vardiff_config = stratum_config.get("vardiff")
+    if vardiff_config and vardiff_config.get("enabled"):
+        loop.create_task(retarget_sessions(vardiff_config))
+    loop.create_task(client.report_counters(stratum_config.get("evict_interval", 30)))
+
+    logging.info(f"Stratum worker {index} pid {os.getpid()} running at: {host}:{port}")
+    async with server:
+        await client.run()
+    logging.critical(f"Stratum worker {index} lost connection to hub, exit")
+
+
+def run_worker(conf_file, index):
+    asyncio.run(serve_worker(conf_file, index))
+
+
+async def start_cluster(config, conf_file=None):
+    """ start hub and stratum worker processes, restart workers exited """
+    global hub
+    stratum_config = config["stratum_server"]
+    n_workers = stratum_config.get("workers", 0)
+
+    hub = ClusterHub(ipc_path(stratum_config))
+    await hub.start()
+
+    # spawn, pymongo clients are not fork safe
+    ctx = multiprocessing.get_context("spawn")
+
+    def start_process(index):
+        process = ctx.Process(target=run_worker, args=(conf_file, index), daemon=True)
+        process.start()
+        return process
+
+    processes = [start_process(i) for i in range(n_workers)]
+    logging.info(f"{n_workers} stratum workers started")
+
+    while True:
+        await asyncio.sleep(5)
+        for i, process in enumerate(processes):
+            if not process.is_alive():
+                logging.warning(f"stratum worker {i} exited with {process.exitcode}, restart")
+                processes[i] = start_process(i)
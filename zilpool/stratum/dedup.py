@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# Zilliqa Mining Proxy
+# Copyright (C) 2019  Gully Chen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+  duplicate share detection for stratum jobs
+"""
+
+import time
+from collections import OrderedDict
+
+JOB_TTL = 600
+MAX_SHARES_PER_JOB = 65536
+MAX_DUPLICATE_WORKERS = 4096
+
+
+class ShareFilter:
+    """ Nonces submitted per job, jobs are dropped `job_ttl` seconds after
+    the first share. A job keeps at most `max_shares_per_job` nonces,
+    the oldest ones are forgotten first. Duplicates are counted for the
+    latest `max_duplicate_workers` workers submitting them.
+    """
+    def __init__(self, job_ttl=JOB_TTL, max_shares_per_job=MAX_SHARES_PER_JOB,
+                 max_duplicate_workers=MAX_DUPLICATE_WORKERS):
+        self.job_ttl = job_ttl
+        self.max_shares_per_job = max_shares_per_job
+        self.max_duplicate_workers = max_duplicate_workers
+        self._jobs = OrderedDict()       # job -> (expire_at, {nonce: None}), in expire order
+        self.duplicates = OrderedDict()  # (wallet, worker) -> duplicate shares, least recent first
+        self.total_duplicates = 0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(job_ttl=config.get("duplicate_job_ttl", JOB_TTL),
+                   max_shares_per_job=config.get("max_shares_per_job", MAX_SHARES_PER_JOB),
+                   max_duplicate_workers=config.get("max_duplicate_workers",
+                                                    MAX_DUPLICATE_WORKERS))
+
+    def __len__(self):
+        return len(self._jobs)
+
+    @staticmethod
+    def normalize(nonce: str) -> str:
+        nonce = nonce.lower()
+        if nonce.startswith("0x"):
+            nonce = nonce[2:]
+        return nonce.lstrip("0")
+
+    def is_duplicate(self, job, nonce: str, worker=None, now=None) -> bool:
+        """ check and remember a share """
+        if now is None:
+            now = time.monotonic()
+        self.expire(now)
+
+        entry = self._jobs.get(job)
+        if entry is None:
+            entry = self._jobs[job] = (now + self.job_ttl, {})
+        nonces = entry[1]
+
+        nonce = self.normalize(nonce)
+        if nonce in nonces:
+            self.count_duplicate(worker)
+            return True
+
+        if len(nonces) >= self.max_shares_per_job:
+            del nonces[next(iter(nonces))]
+        nonces[nonce] = None
+        return False
+
+    def count_duplicate(self, worker):
+        self.total_duplicates += 1
+        duplicates = self.duplicates
+        duplicates[worker] = duplicates.pop(worker, 0) + 1
+        if len(duplicates) > self.max_duplicate_workers:
+            duplicates.popitem(last=False)
+
+    def expire(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        jobs = self._jobs
+        while jobs:
+            job, (expire_at, _) = next(iter(jobs.items()))
+            if expire_at > now:
+                break
+            del jobs[job]
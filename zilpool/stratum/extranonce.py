@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# Zilliqa Mining Proxy
+# Copyright (C) 2019  Gully Chen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+  extranonce prefixes for NiceHash stratum sessions
+"""
+
+from collections import deque
+
+MAX_EXTRANONCE_BYTES = 3
+
+
+class ExtranonceExhausted(Exception):
+    pass
+
+
+class PrefixLevel:
+    """ prefixes of `width` bytes in [start, end) """
+    __slots__ = ("width", "start", "end", "next", "released")
+
+    def __init__(self, width, start, end):
+        self.width = width
+        self.start = start
+        self.end = end
+        self.next = start
+        self.released = deque()
+
+    @property
+    def capacity(self):
+        return self.end - self.start
+
+
+class ExtranonceAllocator:
+    """ Unique fixed width extranonce prefixes, no prefix is a prefix of another one.
+    Prefixes get longer as sessions grow, with the default 3 bytes:
+        128 prefixes of 1 byte      00 - 7f
+        16384 prefixes of 2 bytes   8000 - bfff
+        4194304 prefixes of 3 bytes c00000 - ffffff
+    the shortest free prefix is allocated, so miners get more nonce space.
+    Released prefixes are reused in FIFO order.
+    """
+    def __init__(self, root="", max_bytes=MAX_EXTRANONCE_BYTES):
+        self.root = root
+        self.levels = []
+        self._used = set()
+
+        reserved = 0    # first prefix left for longer levels
+        for width in range(1, max_bytes + 1):
+            start = reserved << 8 if width > 1 else 0
+            end = 1 << (8 * width)
+            if width < max_bytes:
+                # half of the prefixes for this width, the other half for longer ones
+                end = start + (end - start) // 2
+            self.levels.append(PrefixLevel(width, start, end))
+            reserved = end
+
+    def __len__(self):
+        return len(self._used)
+
+    @property
+    def capacity(self):
+        return sum(level.capacity for level in self.levels)
+
+    def allocate(self) -> str:
+        for level in self.levels:
+            if level.released:
+                prefix = level.released.popleft()
+            elif level.next < level.end:
+                prefix = f"{self.root}{level.next:0{level.width * 2}x}"
+                level.next += 1
+            else:
+                continue
+            self._used.add(prefix)
+            return prefix
+
+        raise ExtranonceExhausted(f"all {len(self._used)} extranonce prefixes in use")
+
+    def release(self, prefix):
+        if prefix not in self._used:
+            return
+        self._used.remove(prefix)
+        width = (len(prefix) - len(self.root)) // 2
+        self.levels[width - 1].released.append(prefix)
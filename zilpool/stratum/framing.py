@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# Zilliqa Mining Proxy
+# Copyright (C) 2019  Gully Chen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+  newline delimited json framing for stratum streams
+"""
+
+import json
+import logging
+
+MAX_LINE_LENGTH = 8 * 1024
+
+
+class LineTooLong(ValueError):
+    pass
+
+
+class LineFramer:
+    """ Split a TCP stream into json messages.
+    Bytes are kept in a per-connection buffer until a newline arrives,
+    so messages split across segments are joined, and every complete
+    message in a chunk is returned at once.
+    """
+    def __init__(self, max_line_length=MAX_LINE_LENGTH):
+        self.max_line_length = max_line_length
+        self.invalid_lines = 0
+        self._buffer = bytearray()
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def feed(self, data) -> list:
+        """ append data to buffer, return the decoded complete messages
+        :raise LineTooLong: if a line exceeds max_line_length
+        """
+        buf = self._buffer
+        search_from = len(buf)    # old bytes have no newline
+        buf += data
+
+        messages = []
+        pos = 0
+        with memoryview(buf) as view:
+            while True:
+                end = buf.find(b"\n", search_from)
+                if end < 0:
+                    break
+                if end - pos > self.max_line_length:
+                    raise LineTooLong(f"line length {end - pos} > {self.max_line_length}")
+
+                with view[pos:end] as line:
+                    msg = self.decode(line)
+                if msg is not None:
+                    messages.append(msg)
+                pos = search_from = end + 1
+
+        if pos:
+            del buf[:pos]
+        if len(buf) > self.max_line_length:
+            raise LineTooLong(f"incomplete line length {len(buf)} > {self.max_line_length}")
+        return messages
+
+    def decode(self, line: memoryview):
+        if not line.nbytes:
+            return None
+        try:
+            text = str(line, "utf-8")    # decode from the buffer without a bytes copy
+            if text.isspace():
+                return None
+            return json.loads(text)
+        except ValueError:    # UnicodeDecodeError included
+            self.invalid_lines += 1
+            logging.warning(f"Failed to parse json message {line[:128].tobytes()!r}")
+            return None
+
+    def clear(self):
+        self._buffer.clear()
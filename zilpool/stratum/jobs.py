@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# Zilliqa Mining Proxy
+# Copyright (C) 2019  Gully Chen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+  stratum jobs of notified works
+"""
+
+import time
+import itertools
+from datetime import datetime, timezone
+from collections import namedtuple
+
+from zilpool.pyzil import ethash
+from zilpool.pyzil.crypto import hex_str_to_bytes as h2b
+from zilpool.pyzil.crypto import hex_str_to_int as h2i
+
+JobRecord = namedtuple("JobRecord", [
+    "job_id",           # short hex id sent to miners
+    "work_id",          # str of PowWork pk
+    "header",           # hex str of header, as saved in database
+    "header_bytes",
+    "seed_bytes",
+    "block_num",        # block num of work
+    "ethash_block",     # block num to get ethash cache, from seed
+    "boundary",         # hex str of boundary
+    "boundary_int",
+    "expire_at",        # unix timestamp
+])
+
+
+def to_timestamp(expire_time) -> float:
+    if isinstance(expire_time, datetime):
+        # datetimes in database are utc without tzinfo
+        return expire_time.replace(tzinfo=timezone.utc).timestamp()
+    return float(expire_time)
+
+
+def normalize_hex(hex_str: str) -> str:
+    hex_str = hex_str.lower()
+    return hex_str if hex_str.startswith("0x") else "0x" + hex_str
+
+
+class JobTable:
+    """ jobs keyed by short ids, added when works are notified,
+    so submits are resolved without reading database.
+    """
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self._jobs = {}
+        self._by_work = {}
+        self._by_header = {}    # (header, boundary) -> job
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def add(self, work) -> JobRecord:
+        """ add job of a work, same work gets same job """
+        work_id = str(work.pk)
+        job = self._by_work.get(work_id)
+        expire_at = to_timestamp(work.expire_time)
+        if job is not None:
+            if job.expire_at == expire_at:
+                return job
+            # work expire time increased when dispatched again
+            job = job._replace(expire_at=expire_at)
+        else:
+            seed_bytes = h2b(work.seed)
+            job = JobRecord(
+                job_id=f"{next(self._ids) & 0xffffffff:08x}",
+                work_id=work_id,
+                header=normalize_hex(work.header),
+                header_bytes=h2b(work.header),
+                seed_bytes=seed_bytes,
+                block_num=work.block_num,
+                ethash_block=ethash.seed_to_block_num(seed_bytes),
+                boundary=normalize_hex(work.boundary),
+                boundary_int=h2i(work.boundary),
+                expire_at=expire_at,
+            )
+        self._jobs[job.job_id] = job
+        self._by_work[work_id] = job
+        self._by_header[(job.header, job.boundary)] = job
+        return job
+
+    def get(self, job_id, now=None):
+        """ get job not expired """
+        job = self._jobs.get(job_id)
+        return self._valid(job, now)
+
+    def get_by_work(self, work_id, now=None):
+        """ get job of a work not expired """
+        job = self._by_work.get(str(work_id))
+        return self._valid(job, now)
+
+    def find(self, header, boundary, now=None):
+        job = self._by_header.get((normalize_hex(header), normalize_hex(boundary)))
+        return self._valid(job, now)
+
+    @staticmethod
+    def _valid(job, now=None):
+        if job is None:
+            return None
+        if now is None:
+            now = time.time()
+        return job if job.expire_at >= now else None
+
+    def expire(self, now=None):
+        if now is None:
+            now = time.time()
+        expired = [job for job in self._jobs.values() if job.expire_at < now]
+        for job in expired:
+            del self._jobs[job.job_id]
+            self._by_work.pop(job.work_id, None)
+            self._by_header.pop((job.header, job.boundary), None)
+        return len(expired)
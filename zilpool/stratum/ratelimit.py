@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+# Zilliqa Mining Proxy
+# Copyright (C) 2019  Gully Chen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+  rate limits and temporary bans for stratum clients
+"""
+
+import time
+import logging
+
+PRUNE_INTERVAL = 60
+
+
+class TokenBucket:
+    """ allow `rate` events per second with bursts up to `burst` """
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst, now=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic() if now is None else now
+
+    def consume(self, n=1, now=None) -> bool:
+        if now is None:
+            now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < n:
+            return False
+        self.tokens -= n
+        return True
+
+    def is_full(self, now) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+class KeyedLimiter:
+    """ one token bucket per key, full buckets are dropped periodically """
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._pruned_at = time.monotonic()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def allow(self, key, n=1, now=None) -> bool:
+        if now is None:
+            now = time.monotonic()
+        if now - self._pruned_at > PRUNE_INTERVAL:
+            self.prune(now)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst, now)
+        return bucket.consume(n, now)
+
+    def prune(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        self._buckets = {key: bucket for key, bucket in self._buckets.items()
+                         if not bucket.is_full(now)}
+        self._pruned_at = now
+
+
+class BanList:
+    """ ban keys with too many invalid shares in a window for `ban_time` seconds """
+    def __init__(self, min_shares=20, invalid_ratio=0.8, window=600, ban_time=600):
+        self.min_shares = min_shares
+        self.invalid_ratio = invalid_ratio
+        self.window = window
+        self.ban_time = ban_time
+        self._shares = {}    # key -> [window_start, shares, invalid]
+        self._banned = {}    # key -> banned until
+        self._pruned_at = time.monotonic()
+        self.banned = 0
+
+    def record(self, key, valid, now=None) -> bool:
+        """ record a share, return True if the key is banned """
+        if now is None:
+            now = time.monotonic()
+        if now - self._pruned_at > PRUNE_INTERVAL:
+            self.prune(now)
+        stat = self._shares.get(key)
+        if stat is None or now - stat[0] > self.window:
+            stat = self._shares[key] = [now, 0, 0]
+        stat[1] += 1
+        if not valid:
+            stat[2] += 1
+
+        if stat[1] >= self.min_shares and stat[2] / stat[1] >= self.invalid_ratio:
+            logging.warning(f"ban {key} for {self.ban_time} seconds, "
+                            f"{stat[2]} of {stat[1]} shares invalid")
+            del self._shares[key]
+            self._banned[key] = now + self.ban_time
+            self.banned += 1
+            return True
+        return False
+
+    def is_banned(self, key, now=None) -> bool:
+        until = self._banned.get(key)
+        if until is None:
+            return False
+        if now is None:
+            now = time.monotonic()
+        if now >= until:
+            del self._banned[key]
+            return False
+        return True
+
+    def prune(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        self._shares = {key: stat for key, stat in self._shares.items()
+                        if now - stat[0] <= self.window}
+        self._banned = {key: until for key, until in self._banned.items() if until > now}
+        self._pruned_at = now
+
+
+class StratumLimits:
+    """ limits shared by all connections of a stratum server """
+    def __init__(self, conn_rate=20, conn_burst=100,
+                 ip_submit_rate=50, ip_submit_burst=200,
+                 wallet_submit_rate=100, wallet_submit_burst=500,
+                 ban_min_shares=20, ban_invalid_ratio=0.8, ban_window=600, ban_time=600):
+        self.conn_rate = conn_rate
+        self.conn_burst = conn_burst
+        self.by_ip = KeyedLimiter(ip_submit_rate, ip_submit_burst)
+        self.by_wallet = KeyedLimiter(wallet_submit_rate, wallet_submit_burst)
+        self.bans = BanList(ban_min_shares, ban_invalid_ratio, ban_window, ban_time)
+
+    @classmethod
+    def from_config(cls, config):
+        if not config or not config.get("enabled"):
+            return None
+        return cls(
+            conn_rate=config.get("conn_rate", 20),
+            conn_burst=config.get("conn_burst", 100),
+            ip_submit_rate=config.get("ip_submit_rate", 50),
+            ip_submit_burst=config.get("ip_submit_burst", 200),
+            wallet_submit_rate=config.get("wallet_submit_rate", 100),
+            wallet_submit_burst=config.get("wallet_submit_burst", 500),
+            ban_min_shares=config.get("ban_min_shares", 20),
+            ban_invalid_ratio=config.get("ban_invalid_ratio", 0.8),
+            ban_window=config.get("ban_window", 600),
+            ban_time=config.get("ban_time", 600),
+        )
+
+    def connection_bucket(self):
+        return TokenBucket(self.conn_rate, self.conn_burst)
+
+    def allow_submit(self, ip, wallet) -> bool:
+        now = time.monotonic()
+        if not self.by_ip.allow(ip, now=now):
+            return False
+        return wallet is None or self.by_wallet.allow(wallet, now=now)
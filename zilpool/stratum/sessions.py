@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+# Zilliqa Mining Proxy
+# Copyright (C) 2019  Gully Chen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+  registry of stratum sessions
+"""
+
+import time
+import logging
+from collections import OrderedDict, defaultdict, Counter
+
+
+class SessionRegistry:
+    """ Sessions keyed by connection, ordered by last activity.
+    Session objects need the attributes:
+        transport, connected_at, last_active, subscribed, authorized, wallet, worker
+    """
+    def __init__(self):
+        self._sessions = OrderedDict()
+        self._handshaking = OrderedDict()    # not subscribed, ordered by connected time
+        self._by_wallet = defaultdict(set)
+        self._by_worker = defaultdict(set)
+        self.subscribed = 0
+        self.authorized = 0
+        self.evicted = 0
+        self.flow = Counter()    # write flow control events
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, conn):
+        return conn in self._sessions
+
+    def get(self, conn):
+        return self._sessions.get(conn)
+
+    def add(self, conn, session):
+        session.connected_at = session.last_active = time.monotonic()
+        self._sessions[conn] = session
+        self._handshaking[conn] = session
+
+    def remove(self, conn):
+        session = self._sessions.pop(conn, None)
+        if session is None:
+            return None
+        self._handshaking.pop(conn, None)
+        if session.subscribed:
+            self.subscribed -= 1
+        if session.authorized:
+            self.authorized -= 1
+            self._unindex(session)
+        return session
+
+    def touch(self, conn):
+        session = self._sessions.get(conn)
+        if session is not None:
+            session.last_active = time.monotonic()
+            self._sessions.move_to_end(conn)
+
+    def set_subscribed(self, conn):
+        session = self._sessions[conn]
+        if not session.subscribed:
+            session.subscribed = True
+            self.subscribed += 1
+            self._handshaking.pop(conn, None)
+
+    def set_authorized(self, conn, wallet, worker=""):
+        session = self._sessions[conn]
+        if session.authorized:
+            self._unindex(session)
+        else:
+            session.authorized = True
+            self.authorized += 1
+        session.wallet, session.worker = wallet, worker
+        self._by_wallet[wallet].add(session)
+        self._by_worker[(wallet, worker)].add(session)
+
+    def set_worker(self, conn, worker):
+        session = self._sessions[conn]
+        if not session.authorized or session.worker == worker:
+            return
+        self.set_authorized(conn, session.wallet, worker)
+
+    def _unindex(self, session):
+        for index, key in ((self._by_wallet, session.wallet),
+                           (self._by_worker, (session.wallet, session.worker))):
+            sessions = index.get(key)
+            if sessions is None:
+                continue
+            sessions.discard(session)
+            if not sessions:
+                del index[key]
+
+    def sessions(self):
+        return list(self._sessions.values())
+
+    def subscribed_sessions(self):
+        return [s for s in self._sessions.values() if s.subscribed]
+
+    def by_wallet(self, wallet):
+        return list(self._by_wallet.get(wallet, ()))
+
+    def by_worker(self, wallet, worker):
+        return list(self._by_worker.get((wallet, worker), ()))
+
+    def evict(self, idle_timeout, handshake_timeout):
+        """ close sessions without data in idle_timeout seconds,
+            and sessions not subscribed in handshake_timeout seconds
+        """
+        now = time.monotonic()
+        to_close = []
+
+        # sessions are ordered by last activity, stop at the first active one
+        for conn, session in self._sessions.items():
+            if now - session.last_active < idle_timeout:
+                break
+            to_close.append(conn)
+
+        if handshake_timeout:
+            for conn, session in self._handshaking.items():
+                if now - session.connected_at < handshake_timeout:
+                    break
+                to_close.append(conn)
+
+        evicted = 0
+        for conn in set(to_close):
+            session = self.remove(conn)
+            if session is None:
+                continue
+            evicted += 1
+            logging.info(f"evict idle stratum session {session.wallet}.{session.worker}")
+            session.transport.close()
+
+        self.evicted += evicted
+        return evicted
+
+    def counters(self):
+        return {
+            "connected": len(self._sessions),
+            "subscribed": self.subscribed,
+            "authorized": self.authorized,
+            "evicted": self.evicted,
+            **self.flow,
+        }
@@ -1,124 +1,396 @@
+import time
 import asyncio
 import json
+import socket
 import logging
-import random
-from bson import ObjectId
+from functools import partial
 
 from zilpool.common import utils, blockchain
-from zilpool.database import pow, miner
-from zilpool.pyzil import ethash
+from zilpool.database import pow, miner, aio
+from zilpool.pyzil import crypto, ethash
 from zilpool.pyzil.crypto import hex_str_to_bytes as h2b
 from zilpool.pyzil.crypto import hex_str_to_int as h2i
 from zilpool.pyzil.crypto import bytes_to_hex_str as b2h
+from zilpool.stratum.framing import LineFramer, LineTooLong, MAX_LINE_LENGTH
+from zilpool.stratum.sessions import SessionRegistry
+from zilpool.stratum.vardiff import VarDiff
+from zilpool.stratum.extranonce import ExtranonceAllocator, ExtranonceExhausted
+from zilpool.stratum.jobs import JobTable
 
 
-stratumMiners = []
+stratumSessions = SessionRegistry()
+stratumJobs = JobTable()
+
+# unique extranonce prefixes, stratum workers use their own root
+extranonces = ExtranonceAllocator()
+
 
 STRATUM_BASIC = 0
 STRATUM_NICEHASH = 2
 
+DIFF_BASE = 0x00000000ffff0000000000000000000000000000000000000000000000000000
+BROADCAST_HIGH_WATER = 256 * 1024
+WRITE_BUFFER_HIGH = 64 * 1024
+MAX_WRITE_BUFFER = 1024 * 1024
+# seconds shares in flight are still checked against the target before retarget
+SHARE_TARGET_GRACE = 30
+
+# results of submits, only invalid shares count toward banning the source ip,
+# rejects of stale jobs or results not saved are normal for honest miners
+SUBMIT_ACCEPTED = "accepted"
+SUBMIT_REJECTED = "rejected"
+SUBMIT_INVALID = "invalid"
+
+
+class DatabaseStore:
+    """ persists workers, submits and hashrates of sessions in this process,
+    stratum workers use a ClusterClient, so only the hub writes to database.
+    """
+    async def get_worker(self, miner_wallet, worker_name):
+        return await miner.Worker.aio.get_or_create(miner_wallet, worker_name)
+
+    async def fail_submit(self, _worker):
+        await _worker.aio.update_stat(inc_failed=1)
+
+    async def save_submit(self, _worker, job, nonce, mix_digest, hash_result: bytes):
+        return await aio.run(save_submit, job.work_id, job.header,
+                             nonce, mix_digest, hash_result, _worker)
+
+    async def log_hashrate(self, hashrate, wallet_address, worker_name):
+        return await miner.HashRate.aio.log(hashrate, wallet_address, worker_name)
+
+
+# replaced by ClusterClient in stratum workers
+submit_store = DatabaseStore()
+
+
+def encode_message(message: dict) -> bytes:
+    return (json.dumps(message) + "\n").encode()
+
+
+def encode_difficulty(target) -> bytes:
+    return encode_message({
+        "id": None,
+        "method": "mining.set_difficulty",
+        "params": [target],
+    })
+
+
+def encode_notify(work, job_id, version, share_boundary: int) -> bytes:
+    seed = work.seed
+    if seed[0:2] == '0x' or seed[0:2] == '0X':
+        seed = seed[2:]
+
+    header = work.header
+    if header[0:2] == '0x' or header[0:2] == '0X':
+        header = header[2:]
+    if version == STRATUM_BASIC:
+        boundary = work.boundary
+        if share_boundary != h2i(boundary):
+            boundary = crypto.int_to_hex_str_0x(share_boundary, n_bytes=32)
+        params = [job_id, header, seed, boundary]
+    else:
+        params = [job_id, seed, header, True]
+    return encode_message({
+        "id": None,
+        "method": "mining.notify",
+        "params": params,
+    })
+
+
+def cached_encode(cache, key, encode, *args) -> bytes:
+    """ encode a message once per broadcast, cache is None for single sends """
+    if cache is None:
+        return encode(*args)
+    data = cache.get(key)
+    if data is None:
+        data = cache[key] = encode(*args)
+    return data
+
+
 class StratumMiner:
-    def __init__(self, transport, stratumVersion = STRATUM_BASIC):
-        self._transport = transport
+    """ per-connection session state """
+    __slots__ = ("transport", "_stratusVersion", "_boundary", "_miningAtBlock",
+                 "_targetDifficulty", "_shareBoundary", "_prevShareBoundary",
+                 "_prevShareUntil", "_work", "vardiff", "_workerKey", "_workerRecord",
+                 "_pendingWork", "paused_at", "max_write_buffer",
+                 "connected_at", "last_active",
+                 "subscribed", "authorized", "wallet", "worker")
+
+    def __init__(self, transport, stratumVersion = STRATUM_BASIC, vardiff=None,
+                 max_write_buffer=MAX_WRITE_BUFFER):
+        self.transport = transport
         self._stratusVersion = stratumVersion
         self._boundary = None
         self._miningAtBlock = dict()
         self._targetDifficulty = 0
-
-    def notify_difficulty(self, diff):
+        self._shareBoundary = None
+        self._prevShareBoundary = None
+        self._prevShareUntil = 0
+        self._work = None
+        self.vardiff = vardiff
+        self._pendingWork = None
+        self._workerKey = None      # (wallet, worker name) of _workerRecord
+        self._workerRecord = None   # future of Worker, resolved once per worker
+        self.paused_at = None
+        self.max_write_buffer = max_write_buffer
+        self.connected_at = self.last_active = 0
+        self.subscribed = self.authorized = False
+        self.wallet = self.worker = None
+
+    def notify_difficulty(self, diff, cache=None):
         self._boundary = diff
+        share_boundary = h2i(diff)
+        if self.vardiff is not None:
+            share_boundary = self.vardiff.share_target(share_boundary)
+        if self._shareBoundary is not None and share_boundary != self._shareBoundary:
+            self._prevShareBoundary = self._shareBoundary
+            self._prevShareUntil = time.monotonic() + SHARE_TARGET_GRACE
+        self._shareBoundary = share_boundary
+
         if self._stratusVersion == STRATUM_BASIC:
             return
-        DIFF_BASE = 0x00000000ffff0000000000000000000000000000000000000000000000000000
-        target = DIFF_BASE / int(diff, 16)
+        target = DIFF_BASE / share_boundary
         if self._targetDifficulty == target:
-            logging.info("The difficulty is the same, no need send again")
+            logging.debug("The difficulty is the same, no need send again")
             return
-        dictOfReply = dict()
-        dictOfReply["id"] = None
-        dictOfReply["method"] = "mining.set_difficulty"
-        dictOfReply["params"] = [target]
-        strReply = json.dumps(dictOfReply)
-        strReply += '\n'
-        logging.info(f"Server Reply {strReply}")
-        self._transport.write(strReply.encode())
+        data = cached_encode(cache, ("set_difficulty", target), encode_difficulty, target)
+        if cache is None:
+            logging.info(f"Server Reply {data}")
+        self.write(data)
         self._targetDifficulty = target
 
-    def notify_work(self, work):
+    def notify_work(self, work, cache=None):
         if work.block_num in self._miningAtBlock and self._miningAtBlock[work.block_num]:
-            logging.info(f"Miner still mining at block {work.block_num}, no need send new work")
+            logging.debug(f"Miner still mining at block {work.block_num}, no need send new work")
             return False
-        self.notify_difficulty(work.boundary)
-
-        dictOfReply = dict()
-        dictOfReply["id"] = None
-        dictOfReply["method"] = "mining.notify"
-        seed = work.seed
-        if seed[0:2] == '0x' or seed[0:2] == '0X':
-            seed = seed[2:]
-
-        header = work.header
-        if header[0:2] == '0x' or header[0:2] == '0X':
-            header = header[2:]
-        if self._stratusVersion == STRATUM_BASIC:            
-            dictOfReply["params"] = [str(work.pk), header, seed, work.boundary]
-        elif self._stratusVersion == STRATUM_NICEHASH:
-            dictOfReply["params"] = [str(work.pk), seed, header, True]
-        strReply = json.dumps(dictOfReply)
-        strReply += '\n'
-        logging.info(f"Server Reply {strReply}")
+        return self.send_work(work, cache)
+
+    def send_work(self, work, cache=None):
+        if self.paused_at is not None:
+            # client is lagging, only the latest work is sent after resumed
+            if self._pendingWork is not None:
+                stratumSessions.flow["coalesced"] += 1
+            self._pendingWork = work
+            self._miningAtBlock[work.block_num] = True
+            return True
+
+        self.notify_difficulty(work.boundary, cache)
+
+        version = self._stratusVersion
+        if version != STRATUM_BASIC:
+            version = STRATUM_NICEHASH
+        job = stratumJobs.add(work)
+        data = cached_encode(cache, ("notify", job.job_id, version, self._shareBoundary),
+                             encode_notify, work, job.job_id, version, self._shareBoundary)
+        if cache is None:
+            logging.info(f"Server Reply {data}")
         self._miningAtBlock[work.block_num] = True
-        self._transport.write(strReply.encode())
+        self._work = work
+        if self.vardiff is not None:
+            self.vardiff.set_mining(True)
+        self.write(data)
+        return True
+
+    def write(self, data: bytes) -> bool:
+        transport = self.transport
+        if transport.is_closing():
+            return False
+        transport.write(data)
+        if transport.get_write_buffer_size() > self.max_write_buffer:
+            logging.warning(f"write buffer overflow, close session {self.wallet}.{self.worker}")
+            stratumSessions.flow["overflow_closed"] += 1
+            transport.abort()
+            return False
         return True
 
+    def pause_writing(self):
+        self.paused_at = time.monotonic()
+        stratumSessions.flow["paused"] += 1
+
+    def resume_writing(self):
+        self.paused_at = None
+        work, self._pendingWork = self._pendingWork, None
+        if work is not None:
+            self.send_work(work)
+
     def set_workDone(self, work):
         self._miningAtBlock[work.block_num] = False
 
+    def live_work(self):
+        """ the work mined, cleared once its job expired """
+        work = self._work
+        if work is not None and stratumJobs.get_by_work(work.pk) is None:
+            self.set_workDone(work)
+            self._work = work = None
+        return work
+
+    def share_target(self, now=None):
+        """ target of shares submitted now, the easier one in the grace
+        period after changed, for shares found before the miner got the new one
+        """
+        target = self._shareBoundary or 0
+        if self._prevShareBoundary is not None:
+            if now is None:
+                now = time.monotonic()
+            if now < self._prevShareUntil:
+                return max(target, self._prevShareBoundary)
+            self._prevShareBoundary = None
+        return target
+
+    def share_accepted(self, share_boundary):
+        if self.vardiff is not None:
+            self.vardiff.record_share(share_boundary)
+
+    def retarget(self):
+        """ retarget share difficulty
+        :return: hashrate measured from shares, None if not retargeted
+        """
+        if self.vardiff is None:
+            return None
+        work = self.live_work()
+        if work is None:
+            self.vardiff.set_mining(False)
+        elapsed_window = self.vardiff.window_start
+        changed = self.vardiff.retarget()
+        if self.vardiff.window_start == elapsed_window:
+            return None
+        # only a live job is sent again with the new target
+        if changed and work is not None and not self.transport.is_closing():
+            self.send_work(work)
+        return self.vardiff.hashrate
+
 class StratumServerProtocol(asyncio.Protocol):
-    def __init__(self):
+    def __init__(self, config=None, limits=None, shares=None):
+        if config is None:
+            config = {}
+        self.config = config
+        self.limits = limits
+        self.shares = shares
+        self.bucket = limits.connection_bucket() if limits is not None else None
+        self.peer_ip = None
         self._server = None
         self.transport = None
         self.stratumMiner = None
         self.subscribed = False
         self.miner_wallet = None
         self.strExtraNonceHex = None
+        self.framer = LineFramer(config.get("max_line_length", MAX_LINE_LENGTH))
+        self.submit_queue = asyncio.Queue()
+        self.max_pending_submits = config.get("max_pending_submits", 16)
+        self.pending_submits = 0    # queued and the one waited by reply task
+        self.reply_task = None
     
     def connection_made(self, transport):
         peername = transport.get_extra_info('peername')
         logging.critical(f'Connection from {peername}')
         self.transport = transport
+        self.peer_ip = peername[0] if peername else None
+        self.stratumMiner = StratumMiner(
+            transport, vardiff=VarDiff.from_config(self.config.get("vardiff")),
+            max_write_buffer=self.config.get("max_write_buffer", MAX_WRITE_BUFFER)
+        )
+        stratumSessions.add(self, self.stratumMiner)
+        set_keepalive(transport, self.config.get("keepalive", 0))
+        # pause_writing is called when buffered bytes over high water mark
+        transport.set_write_buffer_limits(
+            high=self.config.get("write_buffer_high", WRITE_BUFFER_HIGH)
+        )
+        if self.is_banned():
+            transport.close()
+
+    def is_banned(self):
+        if self.limits is None or not self.limits.bans.is_banned(self.peer_ip):
+            return False
+        logging.warning(f"reject banned client {self.peer_ip}")
+        stratumSessions.flow["banned_rejected"] += 1
+        return True
+
+    def record_share(self, valid):
+        """ ban the client ip if too many invalid shares """
+        if self.limits is None:
+            return
+        if self.limits.bans.record(self.peer_ip, valid):
+            stratumSessions.flow["banned"] += 1
+            self.transport.close()
 
     def connection_lost(self, exc):
         logging.critical("Connection lost")
+        stratumSessions.remove(self)
+        self.framer.clear()
+        if self.strExtraNonceHex is not None:
+            extranonces.release(self.strExtraNonceHex)
+            self.strExtraNonceHex = None
+        # pending submits are still saved, only stop writing replies
+        if self.reply_task is not None:
+            self.reply_task.cancel()
+            self.reply_task = None
+        while not self.submit_queue.empty():
+            _, task = self.submit_queue.get_nowait()
+            task.add_done_callback(log_submit_error)
+
+    def pause_writing(self):
+        self.stratumMiner.pause_writing()
+
+    def resume_writing(self):
+        self.stratumMiner.resume_writing()
+
+    def write(self, data: bytes):
+        self.stratumMiner.write(data)
 
     def data_received(self, data):
-        message = data.decode()
-        logging.critical('Data received: {!r}'.format(message))
-        for subMessage in message.split('\n'):
-            if (len(subMessage) <= 0):
-                break
-            try:
-                jsonMsg = json.loads(subMessage)
-                if jsonMsg["method"] == "mining.subscribe":
-                    self.process_subscribe(jsonMsg)
-                elif jsonMsg["method"] == "mining.authorize":
-                    self.process_authorize(jsonMsg)
-                elif jsonMsg["method"] == "mining.extranonce.subscribe":
-                    self.send_extranonce_reply()
-                elif jsonMsg["method"] == "mining.submit":
-                    self.process_submit(jsonMsg)
-            except ValueError:
-                logging.critical(f"Failed to parse json message {subMessage}")
+        logging.debug('Data received: {!r}'.format(data))
+        stratumSessions.touch(self)
+        try:
+            messages = self.framer.feed(data)
+        except LineTooLong as e:
+            logging.warning(f"{e}, close connection")
+            self.transport.close()
+            return
+
+        for jsonMsg in messages:
+            self.dispatch(jsonMsg)
+
+    def dispatch(self, jsonMsg):
+        if not isinstance(jsonMsg, dict):
+            logging.warning(f"Invalid stratum message {jsonMsg!r}")
+            return
+        if self.bucket is not None and not self.bucket.consume():
+            stratumSessions.flow["rate_limited"] += 1
+            if jsonMsg.get("id") is not None:
+                self.send_error_reply(jsonMsg["id"], "rate limited")
+            return
+        try:
+            method = jsonMsg.get("method")
+            if method == "mining.subscribe":
+                self.process_subscribe(jsonMsg)
+            elif method == "mining.authorize":
+                self.process_authorize(jsonMsg)
+            elif method == "mining.extranonce.subscribe":
+                self.send_extranonce_reply()
+            elif method == "mining.submit":
+                self.process_submit(jsonMsg)
+        except ExtranonceExhausted as e:
+            logging.error(f"{e}, close connection")
+            self.transport.close()
+        except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+            logging.exception(f"Failed to process message {jsonMsg!r}")
 
     def process_subscribe(self, jsonMsg):
         stratumVersion = STRATUM_BASIC
         if jsonMsg["params"] is not None and len(jsonMsg["params"]) >= 2 and jsonMsg["params"][1] == "EthereumStratum/1.0.0":
             stratumVersion = STRATUM_NICEHASH
-        self.stratumMiner = StratumMiner(self.transport, stratumVersion)
-        stratumMiners.append(self.stratumMiner)
+        self.stratumMiner._stratusVersion = stratumVersion
         logging.info("Subcribed with stratum version " + str(stratumVersion))
         self.send_subscribe_reply()
         self.subscribed = True
+        stratumSessions.set_subscribed(self)
+
+    def allocate_extranonce(self):
+        """ one prefix per session, kept until connection lost """
+        if self.strExtraNonceHex is None:
+            self.strExtraNonceHex = extranonces.allocate()
+        return self.strExtraNonceHex
 
     def send_subscribe_reply(self):
         dictOfReply = dict()
@@ -127,15 +399,14 @@ class StratumServerProtocol(asyncio.Protocol):
         replyArray1 = ["mining.notify", "ae6812eb4cd7735a302a8a9dd95cf71f", "EthereumStratum/1.0.0"]
         dictOfReply["result"].append(replyArray1)
 
-        self.strExtraNonceHex = hex(random.randrange(0xffff))[2:]
-        dictOfReply["result"].append(self.strExtraNonceHex)
+        dictOfReply["result"].append(self.allocate_extranonce())
 
         dictOfReply["error"] = None
 
         strReply = json.dumps(dictOfReply)
         strReply += '\n'
         logging.info("Server Reply >" + strReply)
-        self.transport.write(strReply.encode())
+        self.write(strReply.encode())
 
     def send_success_reply(self, id):
         dictOfReply = dict()
@@ -145,132 +416,397 @@ class StratumServerProtocol(asyncio.Protocol):
         strReply = json.dumps(dictOfReply)
         strReply += '\n'
         logging.info("Server Reply > " + strReply)
-        self.transport.write(strReply.encode())
+        self.write(strReply.encode())
 
     def process_authorize(self, jsonMsg):
         # Need to check the user and password if it valid, skipped for now
         id = jsonMsg["id"]
         minerInfos = jsonMsg["params"][0].split('.')
         self.miner_wallet = minerInfos[0]
+        worker_name = minerInfos[1] if len(minerInfos) > 1 else ""
         logging.info(f"miner wallet {self.miner_wallet}")
+        stratumSessions.set_authorized(self, self.miner_wallet, worker_name)
+        self.resolve_worker(worker_name)
         self.send_success_reply(id)
 
+    def resolve_worker(self, worker_name):
+        """ get or create the worker once, cached in session for its submits
+        :return: future of Worker or None
+        """
+        stratumMiner = self.stratumMiner
+        key = (self.miner_wallet, worker_name)
+        if stratumMiner._workerRecord is None or stratumMiner._workerKey != key:
+            stratumMiner._workerKey = key
+            stratumMiner._workerRecord = asyncio.ensure_future(self.fetch_worker(*key))
+        return stratumMiner._workerRecord
+
+    @staticmethod
+    async def fetch_worker(miner_wallet, worker_name):
+        try:
+            return await submit_store.get_worker(miner_wallet, worker_name)
+        except Exception:
+            logging.exception(f"Failed to get worker {miner_wallet}.{worker_name}")
+            return None
+
+    async def get_worker(self, worker_name):
+        """ worker of a submit, resolved again later if failed """
+        record = self.resolve_worker(worker_name)
+        _worker = await asyncio.shield(record)
+        if _worker is None and self.stratumMiner._workerRecord is record:
+            self.stratumMiner._workerRecord = None
+        return _worker
+
     def send_extranonce_reply(self):
         dictOfReply = dict()
         dictOfReply["id"] = None
         dictOfReply["method"] = "mining.set_extranonce"
-        self.strExtraNonceHex = hex(random.randrange(0xffff))[2:]
-        dictOfReply["params"] = [self.strExtraNonceHex]
+        dictOfReply["params"] = [self.allocate_extranonce()]
+        strReply = json.dumps(dictOfReply)
+        strReply += '\n'
+        logging.info("Server Reply > " + strReply)
+        self.write(strReply.encode())
+
+    def send_error_reply(self, id, error):
+        dictOfReply = dict()
+        dictOfReply["id"] = id
+        dictOfReply["result"] = False
+        dictOfReply["error"] = error
         strReply = json.dumps(dictOfReply)
         strReply += '\n'
         logging.info("Server Reply > " + strReply)
-        self.transport.write(strReply.encode())
+        self.write(strReply.encode())
 
     def process_submit(self, jsonMsg):
-        work = None
-        mix_digest = None
-        miner_wallet = self.miner_wallet
-        worker_name = None
-        hash_result = None
-        _worker = None
+        """ queue the submit, replies are written in the order of requests """
         if jsonMsg["id"] is None:
             logging.warning("Submitted result message without id")
             return
 
         id = jsonMsg["id"]
+        if not self.subscribed:
+            self.send_error_reply(id, "not subscribed")
+            return
+        if self.is_banned():
+            self.transport.close()
+            return
+        if self.limits is not None and not self.limits.allow_submit(self.peer_ip,
+                                                                    self.miner_wallet):
+            stratumSessions.flow["rate_limited"] += 1
+            self.send_error_reply(id, "rate limited")
+            return
+        # a share rejected for capacity is not remembered, so it can be retried
+        if self.pending_submits >= self.max_pending_submits:
+            logging.warning(f"too many pending submits from {self.miner_wallet}")
+            self.send_error_reply(id, "too many pending submits")
+            return
+        # shares of unknown or expired jobs are rejected as stale, never remembered
+        job = self.find_job(jsonMsg)
+        if job is not None and self.is_duplicate(job, jsonMsg):
+            stratumSessions.flow["duplicate_shares"] += 1
+            self.record_share(False)
+            self.send_error_reply(id, "duplicate share")
+            return
+
+        task = asyncio.ensure_future(self.handle_submit(jsonMsg, job))
+        self.pending_submits += 1
+        self.submit_queue.put_nowait((id, task))
+        if self.reply_task is None:
+            self.reply_task = asyncio.ensure_future(self.reply_submits())
+
+    def find_job(self, jsonMsg):
+        """ resolve the job of a submit without database
+        :return: JobRecord or None if unknown or expired
+        """
+        params = jsonMsg["params"]
+        job = stratumJobs.get(params[1])
+        if job is None and self.stratumMiner._stratusVersion == STRATUM_BASIC:
+            job = stratumJobs.find(params[3], self.stratumMiner._boundary)
+        return job
+
+    def is_duplicate(self, job, jsonMsg):
+        """ check (job, nonce) of a submit before any verification """
+        if self.shares is None:
+            return False
+        params = jsonMsg["params"]
+        nonce = params[2]
         if self.stratumMiner._stratusVersion == STRATUM_BASIC:
-            nonce = jsonMsg["params"][2]
-            nonce_int = h2i(nonce)            
-            header = jsonMsg["params"][3]
-            mix_digest = jsonMsg["params"][4]
-            boundary = self.stratumMiner._boundary
-            mix_digest_bytes = h2b(mix_digest)
-            worker_name = jsonMsg["worker"]
-            _worker = miner.Worker.get_or_create(miner_wallet, worker_name)
-
-            # 3. check work existing
-            work = pow.PowWork.find_work_by_header_boundary(header=header, boundary=boundary,
-                                                            check_expired=True)
-            if not work:
-                logging.warning(f"work not found or expired, {header} {boundary}")
-                _worker.update_stat(inc_failed=1)
-                return False
-
-            # 4. verify result
-            seed, header = h2b(work.seed), h2b(work.header)
-            boundary_bytes = h2b(work.boundary)
-            block_num = ethash.seed_to_block_num(seed)
-            hash_result = ethash.verify_pow_work(block_num, header, mix_digest_bytes,
-                                                nonce_int, boundary_bytes)
-            if not hash_result:
-                logging.warning(f"wrong result from miner {miner_wallet}-{worker_name}, {work}")
-                _worker.update_stat(inc_failed=1)
-                return False
-
-        elif self.stratumMiner._stratusVersion == STRATUM_NICEHASH:
-            if jsonMsg["params"] is None:
-                logging.critical("The message is without params section")
-                return False
-
-            worker_name = jsonMsg["params"][0]
-            strJobId = jsonMsg["params"][1]
-            joibId = ObjectId(strJobId)
-            nonce = jsonMsg["params"][2]
+            worker_name = jsonMsg.get("worker")
+        else:
+            worker_name = params[0]
             if self.strExtraNonceHex is not None:
                 nonce = self.strExtraNonceHex + nonce
-            nonce_int = h2i(nonce)
-            logging.info(f"worker_name {worker_name}")
-            _worker = miner.Worker.get_or_create(miner_wallet, worker_name)
-
-            # 3. check work existing
-            work = pow.PowWork.find_work_by_id(joibId, check_expired=True)
-            if not work:
-                logging.warning(f"work not found or expired, {strJobId}")
-                _worker.update_stat(inc_failed=1)
-                return False
-
-            # 4. verify result
-            seed, header = h2b(work.seed), h2b(work.header)
-            calc_mix_digest, calc_result = ethash.pow_hash(work.block_num, header, nonce_int)
-            boundary_bytes = h2b(work.boundary)
-            block_num = ethash.seed_to_block_num(seed)
-            hash_result = ethash.verify_pow_work(block_num, header, calc_mix_digest,
-                                                nonce_int, boundary_bytes)
-            if not hash_result:
-                logging.warning(f"wrong result from miner {miner_wallet}-{worker_name}, {work}")
-                _worker.update_stat(inc_failed=1)
-                return False
-
-            mix_digest = b2h(calc_mix_digest)
-
-        # 5. check the result if lesser than old one
-        if work.finished:
-            prev_result = pow.PowResult.get_pow_result(work.header, work.boundary)
-            if prev_result:
-                if prev_result.verified:
-                    logging.info(f"submitted too late, work is verified. {work.header} {work.boundary}")
-                    _worker.update_stat(inc_failed=1)
-                    return False
-
-                if ethash.is_less_or_equal(prev_result.hash_result, hash_result):
-                    logging.info(f"submitted result > old result, ignored. {work.header} {work.boundary}")
-                    _worker.update_stat(inc_failed=1)
-                    return False
-
-        # 6. save to database
-        hash_result_str = b2h(hash_result, prefix="0x")
-        if not work.save_result(nonce, mix_digest, hash_result_str, miner_wallet, worker_name):
-            logging.warning(f"failed to save result for miner "
-                            f"{miner_wallet}-{worker_name}, {work}")
-            return False
-
-        logging.critical(f"Work submitted, {work.header} {work.boundary}")
-
-        self.send_success_reply(id)
-
-        _worker.update_stat(inc_finished=1)
-        self.stratumMiner.set_workDone(work)
-        # 6. todo: miner reward
-        return True
-
+        return self.shares.is_duplicate(job.job_id, nonce,
+                                        worker=(self.miner_wallet, worker_name))
 
+    async def reply_submits(self):
+        while True:
+            id, task = await self.submit_queue.get()
+            try:
+                result = await asyncio.shield(task)
+            except asyncio.CancelledError:
+                # the submit is still saved, nobody waits for it now
+                task.add_done_callback(log_submit_error)
+                raise
+            except Exception:
+                logging.exception("Failed to process submit")
+                result = SUBMIT_REJECTED
+            finally:
+                self.pending_submits -= 1
+
+            if result != SUBMIT_REJECTED:
+                self.record_share(result == SUBMIT_ACCEPTED)
+            if self.transport.is_closing():
+                continue
+            if result == SUBMIT_ACCEPTED:
+                self.send_success_reply(id)
+            else:
+                self.send_error_reply(id, "rejected")
+
+    async def handle_submit(self, jsonMsg, job):
+        """ :param job: JobRecord of the submit, None if not found or expired
+        :return: SUBMIT_ACCEPTED, SUBMIT_REJECTED or SUBMIT_INVALID
+        """
+        loop = asyncio.get_running_loop()
+        thread_pool = utils.get_thread_pool()
+
+        # take a snapshot of session state, the stages below run in executor
+        miner_wallet = self.miner_wallet
+        stratumMiner = self.stratumMiner
+        version = stratumMiner._stratusVersion
+        params = jsonMsg["params"]
+        if not params:
+            logging.critical("The message is without params section")
+            return SUBMIT_REJECTED
+
+        if version == STRATUM_BASIC:
+            worker_name = jsonMsg["worker"]
+            submit = {
+                "nonce": params[2],
+                "header": params[3],
+                "mix_digest": params[4],
+            }
+        elif version == STRATUM_NICEHASH:
+            worker_name = params[0]
+            nonce = params[2]
+            if self.strExtraNonceHex is not None:
+                nonce = self.strExtraNonceHex + nonce
+            submit = {
+                "nonce": nonce,
+            }
+        else:
+            return SUBMIT_REJECTED
+        stratumSessions.set_worker(self, worker_name)
+        share_boundary = stratumMiner.share_target()
+
+        # 1. worker cached in session, resolved at authorize
+        _worker = await self.get_worker(worker_name)
+        if _worker is None:
+            return SUBMIT_REJECTED
+        if job is None:
+            logging.warning(f"job not found or expired, {params[1]}")
+            stratumSessions.flow["stale_shares"] += 1
+            await submit_store.fail_submit(_worker)
+            return SUBMIT_REJECTED
+        submit["share_boundary"] = max(share_boundary, job.boundary_int)
+
+        # 2. verify result, without database
+        verified = await loop.run_in_executor(
+            thread_pool, verify_submit, version, job, submit, miner_wallet, worker_name
+        )
+        if not verified:
+            await submit_store.fail_submit(_worker)
+            return SUBMIT_INVALID
+
+        # 3. shares below the work boundary only count for vardiff
+        job, nonce, mix_digest, hash_result = verified
+        stratumMiner.share_accepted(submit["share_boundary"])
+        if int.from_bytes(hash_result, "big") > job.boundary_int:
+            return SUBMIT_ACCEPTED
+
+        # 4. save to database, by hub if in stratum worker
+        saved = await submit_store.save_submit(_worker, job, nonce, mix_digest, hash_result)
+        if not saved:
+            return SUBMIT_REJECTED
+
+        stratumMiner.set_workDone(job)
+        # todo: miner reward
+        return SUBMIT_ACCEPTED
+
+
+def set_keepalive(transport, keepalive):
+    """ let the kernel detect dead peers, connection_lost removes the session """
+    sock = transport.get_extra_info("socket")
+    if not keepalive or sock is None:
+        return
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, keepalive)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, keepalive)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+    except OSError:
+        logging.warning("failed to set tcp keepalive")
+
+
+def close_slow_sessions(slow_timeout):
+    """ close sessions that stay paused for writing over slow_timeout seconds """
+    now = time.monotonic()
+    closed = 0
+    for session in stratumSessions.sessions():
+        if session.paused_at is None or now - session.paused_at < slow_timeout:
+            continue
+        logging.warning(f"close slow stratum session {session.wallet}.{session.worker}")
+        session.transport.abort()
+        closed += 1
+    stratumSessions.flow["slow_closed"] += closed
+    return closed
+
+
+async def evict_sessions(config):
+    idle_timeout = config.get("idle_timeout", 1800)
+    handshake_timeout = config.get("handshake_timeout", 60)
+    slow_timeout = config.get("slow_client_timeout", 60)
+    interval = config.get("evict_interval", 30)
+    while True:
+        await asyncio.sleep(interval)
+        evicted = stratumSessions.evict(idle_timeout, handshake_timeout)
+        evicted += close_slow_sessions(slow_timeout)
+        stratumJobs.expire()
+        if evicted:
+            logging.info(f"{evicted} stratum sessions evicted, {stratumSessions.counters()}")
+
+
+def is_writable(transport, high_water):
+    return not transport.is_closing() and transport.get_write_buffer_size() <= high_water
+
+
+def broadcast_work(get_work, high_water=BROADCAST_HIGH_WATER, sessions=None):
+    """ notify subscribed sessions, every distinct message is encoded once
+    and the same bytes are written to all sessions using it.
+    :param get_work: callable returns the work dispatched to next session or None
+    :param sessions: sessions to notify, default all subscribed sessions
+    :return: (sent, skipped)
+    """
+    if sessions is None:
+        sessions = stratumSessions.subscribed_sessions()
+    cache = {}
+    sent = skipped = 0
+    for session in sessions:
+        if not is_writable(session.transport, high_water):
+            stratumSessions.flow["broadcast_skipped"] += 1
+            skipped += 1
+            continue
+        work = get_work()
+        if work is None:
+            break
+        if session.notify_work(work, cache):
+            sent += 1
+
+    if sent or skipped:
+        logging.info(f"broadcast work to {sent} sessions, {skipped} slow sessions skipped, "
+                     f"{len(cache)} messages encoded")
+    return sent, skipped
+
+
+async def broadcast_works(fetch_works, high_water=BROADCAST_HIGH_WATER, sessions=None):
+    """ get works for all writable sessions with one call, then broadcast them,
+    so each session gets its own dispatched work.
+    :param fetch_works: coroutine function, count -> list of works dispatched
+    :return: (sent, skipped)
+    """
+    if sessions is None:
+        sessions = stratumSessions.subscribed_sessions()
+    count = sum(1 for session in sessions if is_writable(session.transport, high_water))
+    works = await fetch_works(count) if count else []
+    return broadcast_work(partial(next, iter(works), None), high_water, sessions)
+
+
+def release_closed_work(header, boundary):
+    """ stop waiting for sessions mining a closed work, so they accept a new work
+    :return: sessions released
+    """
+    released = []
+    for session in stratumSessions.subscribed_sessions():
+        work = session._work
+        if work is None or work.header != header or work.boundary != boundary:
+            continue
+        session.set_workDone(work)
+        session._work = session._pendingWork = None
+        released.append(session)
+
+    if released:
+        stratumSessions.flow["closed_work_released"] += len(released)
+        logging.info(f"work closed, {len(released)} sessions released, {header} {boundary}")
+    return released
+
+
+async def retarget_sessions(config):
+    """ retarget vardiff sessions, log the hashrates measured from shares """
+    interval = config.get("retarget_interval", 60) / 4
+    while True:
+        await asyncio.sleep(interval)
+        for session in stratumSessions.subscribed_sessions():
+            hashrate = session.retarget()
+            if hashrate is None or not session.authorized:
+                continue
+            asyncio.ensure_future(submit_store.log_hashrate(
+                int(hashrate), session.wallet, session.worker or ""
+            ))
+
+
+def log_submit_error(task):
+    """ done callback of submits no reply task waits for """
+    if not task.cancelled() and task.exception() is not None:
+        logging.error("Failed to process submit", exc_info=task.exception())
+
+
+def verify_submit(version, job, submit, miner_wallet, worker_name):
+    """ blocking part of submit: ethash verification, no database calls
+    :return: (job, nonce, mix_digest, hash_result) or None,
+             hash_result meets the share boundary, may not meet the work boundary
+    """
+    nonce = submit["nonce"]
+    nonce_int = h2i(nonce)
+
+    if version == STRATUM_BASIC and h2b(submit["header"]) != job.header_bytes:
+        logging.warning(f"header mismatch from miner {miner_wallet}-{worker_name}, {job.job_id}")
+        return None
+
+    # verify result, against the share boundary if vardiff enabled
+    calc_mix_digest, calc_result = ethash.pow_hash(job.ethash_block, job.header_bytes, nonce_int)
+    if version == STRATUM_BASIC:
+        mix_digest = submit["mix_digest"]
+        if h2b(mix_digest) != calc_mix_digest:
+            logging.warning(f"mix_digest mismatch from miner {miner_wallet}-{worker_name}")
+            return None
+    else:
+        mix_digest = b2h(calc_mix_digest)
+
+    if int.from_bytes(calc_result, "big") > submit["share_boundary"]:
+        logging.warning(f"wrong result from miner {miner_wallet}-{worker_name}, {job.header}")
+        return None
+
+    return job, nonce, mix_digest, calc_result
+
+
+def save_submit(work_id, header, nonce, mix_digest, hash_result, _worker):
+    """ blocking part of submit: save result to database """
+    miner_wallet, worker_name = _worker.wallet_address, _worker.worker_name
+    # 5. save to the dispatched work and other boundaries of the header it meets,
+    #    results not lesser than old ones are ignored
+    works = pow.PowWork.find_works_by_header(header=header, check_expired=True)
+    work = next((w for w in works if str(w.pk) == work_id), None)
+    if work is None:
+        logging.warning(f"work not found or expired, {work_id}")
+        _worker.update_stat(inc_failed=1)
+        return False
+
+    works = [work] + [w for w in works if w != work]
+    saved = pow.PowWork.save_result_to_works(works, nonce, mix_digest, hash_result,
+                                             miner_wallet, worker_name)
+    if not saved:
+        _worker.update_stat(inc_failed=1)
+        return False
+
+    _worker.update_stat(inc_finished=len(saved))
+    return True
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+# Zilliqa Mining Proxy
+# Copyright (C) 2019  Gully Chen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+  variable difficulty share targets for stratum sessions
+"""
+
+import time
+
+MAX_BOUNDARY = 2 ** 256 - 1
+
+
+def difficulty_to_boundary_int(difficulty: int) -> int:
+    """ boundary with `difficulty` leading zero bits """
+    return MAX_BOUNDARY >> difficulty
+
+
+def hashes_per_share(boundary: int) -> int:
+    """ expected hashes to find a result <= boundary """
+    return (MAX_BOUNDARY + 1) // (boundary + 1)
+
+
+class VarDiff:
+    """ Per-session share target, retargeted to one share per `share_time` seconds.
+    Shares are counted by the expected hashes of the target they met,
+    which gives the hashrate of a miner without trusting reported values.
+    Windows without shares only make it easier if a live job was mined all along.
+    """
+    __slots__ = ("share_time", "retarget_interval", "min_boundary", "max_boundary",
+                 "boundary", "hashes", "shares", "window_start", "hashrate",
+                 "mining_since")
+
+    def __init__(self, share_time=10, retarget_interval=60,
+                 initial_difficulty=28, min_difficulty=16, max_difficulty=64):
+        self.share_time = share_time
+        self.retarget_interval = retarget_interval
+        # min difficulty -> max (easiest) boundary
+        self.max_boundary = difficulty_to_boundary_int(min_difficulty)
+        self.min_boundary = difficulty_to_boundary_int(max_difficulty)
+        self.boundary = difficulty_to_boundary_int(initial_difficulty)
+        self.hashes = 0
+        self.shares = 0
+        self.window_start = time.monotonic()
+        self.hashrate = 0
+        self.mining_since = None    # start of mining live jobs, None if idle
+
+    @classmethod
+    def from_config(cls, config):
+        if not config or not config.get("enabled"):
+            return None
+        return cls(
+            share_time=config.get("share_time", 10),
+            retarget_interval=config.get("retarget_interval", 60),
+            initial_difficulty=config.get("initial_difficulty", 28),
+            min_difficulty=config.get("min_difficulty", 16),
+            max_difficulty=config.get("max_difficulty", 64),
+        )
+
+    def share_target(self, work_boundary: int) -> int:
+        """ share target for a work, never harder than the work boundary """
+        return max(self.boundary, work_boundary)
+
+    def set_mining(self, mining: bool, now=None):
+        """ called when a live job is sent, or no job is live """
+        if not mining:
+            self.mining_since = None
+        elif self.mining_since is None:
+            self.mining_since = time.monotonic() if now is None else now
+
+    def record_share(self, share_target: int):
+        self.shares += 1
+        self.hashes += hashes_per_share(share_target)
+
+    def retarget(self, now=None) -> bool:
+        """ update hashrate and boundary after retarget_interval
+        :return: True if the boundary was changed
+        """
+        if now is None:
+            now = time.monotonic()
+        elapsed = now - self.window_start
+        if elapsed < self.retarget_interval:
+            return False
+
+        self.hashrate = self.hashes / elapsed
+        if self.shares:
+            expected_hashes = max(int(self.hashrate * self.share_time), 1)
+            new_boundary = MAX_BOUNDARY // expected_hashes
+            # change at most 4 times per retarget to damp the noise of few shares
+            new_boundary = min(max(new_boundary, self.boundary // 4), self.boundary * 4)
+        elif self.mining_since is not None and self.mining_since <= self.window_start:
+            # no share found in window, make it easier
+            new_boundary = self.boundary * 4
+        else:
+            # idle in window, nothing to find shares for
+            new_boundary = self.boundary
+
+        new_boundary = min(max(new_boundary, self.min_boundary), self.max_boundary)
+
+        self.hashes = self.shares = 0
+        self.window_start = now
+
+        changed = new_boundary != self.boundary
+        self.boundary = new_boundary
+        return changed
@@ -23,11 +23,15 @@ import sys
 import time
 import random
 import argparse
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+
+from pymongo import monitoring
 
 from zilpool.common import utils
 from zilpool.pyzil import crypto, ethash
-from zilpool.database.basemodel import db, connect_to_db, get_all_models, drop_all
-from zilpool.database import zilnode, miner, pow
+from zilpool.database.basemodel import db, connect_to_db, get_all_models, drop_all, init_indexes
+from zilpool.database import zilnode, miner, pow, ziladmin, archive
 import zilpool.tests.database.db_debug_data as debug_data
 
 cur_dir = os.path.dirname(os.path.abspath(__file__))
@@ -250,9 +254,185 @@ def keypairs(params=None):
         gen_keys(_file, _nodes)
 
 
+class CommandRecorder(monitoring.CommandListener):
+    """ record commands sent to MongoDB, registered before connecting """
+    def __init__(self):
+        self.commands = []
+
+    def started(self, event):
+        if event.command_name in EXPLAINABLE:
+            self.commands.append((event.database_name, event.command_name, event.command))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+EXPLAINABLE = ("find", "aggregate", "count", "distinct", "update", "delete", "findAndModify")
+SESSION_FIELDS = ("lsid", "txnNumber", "autocommit", "startTransaction")
+
+recorder = CommandRecorder()
+
+
+def api_queries():
+    """ model methods used by apis, (name, call) """
+    now = datetime.utcnow()
+    header, boundary = "0x" + "0" * 64, "0x" + "f" * 64
+    pub_key, wallet, worker = "0x" + "0" * 66, "0x" + "0" * 40, "worker"
+
+    PowWork, PowResult, PoWWindow = pow.PowWork, pow.PowResult, pow.PoWWindow
+    WorkCounter, RewardLedger = pow.WorkCounter, pow.RewardLedger
+    HashRate, HashRateMinute = miner.HashRate, miner.HashRateMinute
+    HashRateEpoch = miner.HashRateEpoch
+    Worker, Miner = miner.Worker, miner.Miner
+    ZilNode, ZilAdmin = zilnode.ZilNode, ziladmin.ZilAdmin
+
+    return [
+        ("PowWork.get_new_works", lambda: PowWork.get_new_works(count=1, max_dispatch=10)),
+        ("PowWork.find_work_by_header_boundary",
+         lambda: PowWork.find_work_by_header_boundary(header, boundary)),
+        ("PowWork.find_works_by_header", lambda: PowWork.find_works_by_header(header)),
+        ("PowWork.get_latest_work", lambda: PowWork.get_latest_work()),
+        ("PowWork.get_latest_work(block_num)", lambda: PowWork.get_latest_work(block_num=1)),
+        ("PowWork.avg_pow_fee", lambda: PowWork.avg_pow_fee(1)),
+        ("PowWork.epoch_difficulty", lambda: PowWork.epoch_difficulty(1)),
+        ("PowWork.get_node_works", lambda: PowWork.get_node_works(pub_key, count=5)),
+        ("PowWork.count(pub_key, block_num)", lambda: PowWork.count(pub_key=pub_key, block_num=1)),
+        ("PowWork.sweep_expired", lambda: PowWork.sweep_expired(now=datetime(2000, 1, 1))),
+        ("PowWork.archived_block", lambda: (archive.reset_marks(), PowWork.archived_block())),
+        ("WorkCounter.global_stats", lambda: WorkCounter.global_stats()),
+        ("WorkCounter.node_stats", lambda: WorkCounter.node_stats([pub_key])),
+        ("WorkCounter.block_counters", lambda: WorkCounter.block_counters([1])),
+        ("ZilNode.active_count", lambda: ZilNode.active_count()),
+        ("ZilNode.get_by_pub_key", lambda: ZilNode.get_by_pub_key(pub_key)),
+        ("ZilNode.paginate", lambda: list(ZilNode.paginate(order_by="authorized,email"))),
+        ("PowResult.get_pow_result", lambda: PowResult.get_pow_result(header, boundary, pub_key)),
+        ("PowResult.get(miner_wallet)",
+         lambda: PowResult.get(miner_wallet=wallet, order="-finished_time")),
+        ("PowResult.get(miner_wallet, worker_name)",
+         lambda: PowResult.get(miner_wallet=wallet, worker_name=worker, order="-finished_time")),
+        ("PowResult.epoch_rewards", lambda: PowResult.epoch_rewards(block_num=1)),
+        ("PowResult.epoch_rewards(worker)",
+         lambda: PowResult.epoch_rewards(block_num=1, miner_wallet=wallet, worker_name=worker)),
+        ("PowResult.rewards_by_miners", lambda: PowResult.rewards_by_miners(1)),
+        ("RewardLedger.epoch_rewards", lambda: RewardLedger.epoch_rewards(block_num=1)),
+        ("RewardLedger.epoch_rewards(miner)",
+         lambda: RewardLedger.epoch_rewards(block_num=1, miner_wallet=wallet)),
+        ("RewardLedger.rewards_by_blocks", lambda: RewardLedger.rewards_by_blocks([1, 2])),
+        ("PoWWindow.get_latest_record", lambda: PoWWindow.get_latest_record()),
+        ("PoWWindow.get_pow_window", lambda: PoWWindow.get_pow_window(1)),
+        ("HashRateMinute.total_hashrate", lambda: HashRateMinute.total_hashrate(
+            now - timedelta(minutes=5), now)),
+        ("HashRateMinute.total_hashrate(worker)", lambda: HashRateMinute.total_hashrate(
+            now - timedelta(minutes=5), now, wallet_address=wallet, worker_name=worker)),
+        ("HashRateEpoch.total_hashrate",
+         lambda: HashRateEpoch.total_hashrate(1, wallet_address=wallet)),
+        ("HashRateEpoch.roll_closed_epochs", lambda: HashRateEpoch.roll_closed_epochs()),
+        ("HashRate.epoch_hashrate", lambda: HashRate.epoch_hashrate(wallet_address=wallet)),
+        ("Worker.active_count", lambda: Worker.active_count()),
+        ("Worker.get(wallet, worker)",
+         lambda: Worker.get(wallet_address=wallet, worker_name=worker)),
+        ("Miner.get", lambda: Miner.get(wallet_address=wallet)),
+        ("Miner.paginate", lambda: list(Miner.paginate(order_by="-work_finished"))),
+        ("ZilAdmin.check_visa", lambda: ZilAdmin.check_visa("visa")),
+        ("ZilAdminToken.verify_token",
+         lambda: ziladmin.ZilAdminToken.verify_token("token", "action")),
+        ("SiteSettings.get_setting", lambda: ziladmin.SiteSettings.get_setting()),
+    ]
+
+
+# queries reading the archive for archived blocks
+ARCHIVE_QUERIES = (
+    "PowWork.get_latest_work", "PowWork.get_latest_work(block_num)",
+    "PowWork.avg_pow_fee", "PowWork.epoch_difficulty",
+    "PowResult.epoch_rewards", "PowResult.epoch_rewards(worker)", "PowResult.rewards_by_miners",
+)
+
+
+@contextmanager
+def all_blocks_archived():
+    """ lookups by block number of archived models read the archive """
+    for model in archive.archived_models():
+        archive._marks[model] = (2 ** 62, time.time() + 3600)
+    try:
+        yield
+    finally:
+        archive.reset_marks()
+
+
+def winning_plans(explain):
+    """ winning plans in the output of explain, nested in stages of aggregations """
+    if isinstance(explain, dict):
+        for key, value in explain.items():
+            if key == "winningPlan":
+                yield value
+            else:
+                yield from winning_plans(value)
+    elif isinstance(explain, list):
+        for value in explain:
+            yield from winning_plans(value)
+
+
+def plan_stages(plan):
+    """ all stage names in a query plan """
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from plan_stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from plan_stages(value)
+
+
+def explain_command(database_name, command):
+    """ explain a recorded command without running it """
+    command = {key: value for key, value in command.items()
+               if not key.startswith("$") and key not in SESSION_FIELDS}
+    return db.client[database_name].command({"explain": command, "verbosity": "queryPlanner"})
+
+
+def record_queries(name, call):
+    """ run a model method, :return: [(name, database, command)] it sent """
+    recorder.commands.clear()
+    call()
+    return [(f"{name} {command_name}", database_name, command)
+            for database_name, command_name, command in recorder.commands]
+
+
+def explain_queries(params=None):
+    print("ensure indexes")
+    init_indexes()
+    for model in archive.archived_models():
+        archive.create_archive(model)
+
+    commands = []
+    for name, call in api_queries():
+        commands.extend(record_queries(name, call))
+    with all_blocks_archived():
+        for name, call in api_queries():
+            if name in ARCHIVE_QUERIES:
+                commands.extend(record_queries(f"{name}(archive)", call))
+
+    scans = []
+    for name, database_name, command in commands:
+        explain = explain_command(database_name, command)
+        stages = [" <- ".join(plan_stages(plan)) for plan in winning_plans(explain)]
+        print(f"    {name:55} {' | '.join(stages)}")
+        if any("COLLSCAN" in stage for stage in stages):
+            scans.append(name)
+
+    if scans:
+        print(f"{len(scans)} queries perform a collection scan: {scans}")
+        exit(1)
+    print("no collection scan")
+
+
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("command", help="sub command: drop, build, work, miner")
+    parser.add_argument("command", help="sub command: drop, build, work, miner, keys, explain")
     parser.add_argument("--conf", help="conf file", default="debug.conf")
     parser.add_argument("params", nargs=argparse.REMAINDER)
 
@@ -262,6 +442,9 @@ def main():
     print(f"config file: {args.conf}")
     config = utils.merge_config(args.conf)
     print(f"database: {config.database['uri']}")
+    if args.command == "explain":
+        # listeners are taken by clients created after registered
+        monitoring.register(recorder)
     connect_to_db(config)
 
     if args.command == "drop":
@@ -274,6 +457,8 @@ def main():
         show_miners(args.params)
     elif args.command == "keys":
         keypairs(args.params)
+    elif args.command == "explain":
+        explain_queries(args.params)
     else:
         parser.print_help()
 
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+# Zilliqa Mining Proxy
+# Copyright (C) 2019  Gully Chen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Open many stratum sessions to proxy, measure notify fan-out and submit throughput
+python stratum_bench.py --sessions=20000 --pid=<proxy pid>
+
+The proxy should run with rate_limit disabled, submits are random nonces
+and will be rejected, which still goes through the full submit path.
+"""
+
+import sys
+import time
+import json
+import random
+import asyncio
+import argparse
+from aiohttp import ClientSession
+from jsonrpcclient.clients.aiohttp_client import AiohttpClient
+
+from zil_simulator import Node, load_keys, default_config
+from zilpool.pyzil import crypto
+from zilpool.stratum.framing import LineFramer
+
+NICEHASH_PROTOCOL = "EthereumStratum/1.0.0"
+
+
+class BenchClient:
+    def __init__(self, client_id, args, nicehash):
+        self.client_id = client_id
+        self.args = args
+        self.nicehash = nicehash
+        self.reader = self.writer = None
+        self.job = None
+        self.notify_event = asyncio.Event()
+        self.notified_at = None
+        self.pending = {}    # request id -> future
+        self.next_id = 100
+        self.worker = f"bench{client_id}"
+
+    async def connect(self, host, port):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        asyncio.ensure_future(self.read_loop())
+
+        params = ["bench/1.0", NICEHASH_PROTOCOL] if self.nicehash else ["bench/1.0"]
+        await self.request("mining.subscribe", params, id=1)
+        await self.request("mining.authorize", [f"{self.args.wallet}.{self.worker}", "x"], id=2)
+
+    def send(self, msg):
+        self.writer.write((json.dumps(msg) + "\n").encode())
+
+    async def request(self, method, params, id=None, **kwargs):
+        if id is None:
+            id = self.next_id
+            self.next_id += 1
+        fut = asyncio.get_running_loop().create_future()
+        self.pending[id] = fut
+        self.send({"id": id, "method": method, "params": params, **kwargs})
+        return await asyncio.wait_for(fut, self.args.timeout)
+
+    async def read_loop(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                return
+            msg = json.loads(line)
+            if msg.get("method") == "mining.notify":
+                if self.notified_at is None:
+                    self.notified_at = time.perf_counter()
+                self.job = msg["params"]
+                self.notify_event.set()
+            elif msg.get("id") in self.pending:
+                fut = self.pending.pop(msg["id"])
+                if not fut.done():
+                    fut.set_result(msg.get("result"))
+
+    async def submit(self):
+        job = self.job
+        if self.nicehash:
+            nonce = crypto.bytes_to_hex_str(crypto.rand_bytes(6))
+            params = [self.worker, job[0], nonce]
+            return await self.request("mining.submit", params)
+
+        nonce = crypto.bytes_to_hex_str_0x(crypto.rand_bytes(8))
+        mix_digest = crypto.bytes_to_hex_str_0x(crypto.rand_bytes(32))
+        params = [f"{self.args.wallet}.{self.worker}", job[0], nonce,
+                  "0x" + job[1], mix_digest]
+        return await self.request("mining.submit", params, worker=self.worker)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def rss_kb(pid):
+    """ resident memory of process in KB, None if not available """
+    if not pid:
+        return None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return float("nan")
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))
+    return sorted_values[index]
+
+
+def raise_fd_limit(n):
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    want = min(hard, max(soft, n + 1024))
+    if want > soft:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (want, hard))
+
+
+async def open_sessions(args, host, port):
+    clients = [BenchClient(i, args, nicehash=random.random() < args.nicehash)
+               for i in range(args.sessions)]
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def connect(client):
+        async with semaphore:
+            try:
+                await client.connect(host, port)
+                return True
+            except (OSError, asyncio.TimeoutError) as e:
+                print(f"[Bench] client {client.client_id} failed to connect: {e!r}")
+                return False
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*[connect(c) for c in clients])
+    seconds = time.perf_counter() - start
+    connected = [c for c, ok in zip(clients, results) if ok]
+    print(f"[Bench] {len(connected)}/{len(clients)} sessions subscribed and authorized "
+          f"in {seconds:.2f}s")
+    return connected
+
+
+async def request_work(args):
+    keys = load_keys(args)
+    node = Node(0, random.choice(keys), args)
+    node.block = args.block
+    node.pow_end_time = time.time() + args.pow
+    async with ClientSession() as session:
+        node.rpc_client = AiohttpClient(session, args.proxy, basic_logging=False)
+        sent_at = time.perf_counter()
+        ok = await node.request_work(node.create_work(), args.diff, retry=1)
+    return ok, sent_at
+
+
+async def measure_fan_out(args, clients):
+    ok, sent_at = await request_work(args)
+    if not ok:
+        print("[Bench] zil_requestWork failed")
+        return False
+
+    waiting = [c.notify_event.wait() for c in clients]
+    await asyncio.wait([asyncio.ensure_future(w) for w in waiting], timeout=args.timeout)
+    latencies = sorted((c.notified_at - sent_at) * 1000
+                       for c in clients if c.notified_at is not None)
+
+    print(f"[Bench] {len(latencies)}/{len(clients)} sessions notified")
+    if latencies:
+        print("[Bench] notify latency ms: " + ", ".join(
+            f"p{p} {percentile(latencies, p):.1f}" for p in (50, 90, 99)
+        ) + f", max {latencies[-1]:.1f}")
+    return bool(latencies)
+
+
+async def measure_submits(args, clients):
+    clients = [c for c in clients if c.job is not None]
+    if not clients or not args.submits:
+        return
+
+    async def submit_all(client):
+        replies = 0
+        for _ in range(args.submits):
+            try:
+                await client.submit()
+                replies += 1
+            except asyncio.TimeoutError:
+                pass
+        return replies
+
+    start = time.perf_counter()
+    replies = await asyncio.gather(*[submit_all(c) for c in clients])
+    seconds = time.perf_counter() - start
+    total = sum(replies)
+    print(f"[Bench] {total}/{len(clients) * args.submits} submits replied in {seconds:.2f}s, "
+          f"{total / seconds:.1f} submits/s")
+
+
+def measure_framing(n_messages):
+    """ frame submits arriving in segments of about one MTU """
+    lines = [
+        json.dumps({"id": i, "method": "mining.submit",
+                    "params": ["worker", f"{i:08x}", f"0x{random.getrandbits(64):016x}"]})
+        for i in range(n_messages)
+    ]
+    data = ("\n".join(lines) + "\n").encode()
+    chunks = [data[pos:pos + 1500] for pos in range(0, len(data), 1500)]
+
+    framer = LineFramer()
+    start = time.perf_counter()
+    count = sum(len(framer.feed(chunk)) for chunk in chunks)
+    seconds = time.perf_counter() - start
+    print(f"[Bench] framed {count} messages in {seconds:.3f}s, {count / seconds:.0f} messages/s, "
+          f"{len(data) / seconds / 1024 / 1024:.1f} MB/s")
+
+
+async def bench(args):
+    if args.framing:
+        measure_framing(args.framing)
+    if not args.sessions:
+        return
+
+    host, port = args.stratum.rsplit(":", 1)
+    raise_fd_limit(args.sessions)
+
+    rss_before = rss_kb(args.pid)
+    clients = await open_sessions(args, host, int(port))
+    if not clients:
+        return
+
+    await asyncio.sleep(1)
+    rss_after = rss_kb(args.pid)
+    if rss_before is not None and rss_after is not None:
+        per_session = (rss_after - rss_before) * 1024 / len(clients)
+        print(f"[Bench] proxy RSS {rss_before} KB -> {rss_after} KB, "
+              f"{per_session:.0f} bytes per session")
+
+    try:
+        if await measure_fan_out(args, clients):
+            await measure_submits(args, clients)
+    finally:
+        for client in clients:
+            client.close()
+
+
+def build_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark stratum sessions of proxy",
+    )
+    parser.add_argument("-p", "--proxy", default=default_config["proxy_server"],
+                        help=f"host of proxy server, default {default_config['proxy_server']}")
+    parser.add_argument("-s", "--stratum", default="127.0.0.1:33456",
+                        help="host:port of stratum server, default 127.0.0.1:33456")
+    parser.add_argument("-n", "--sessions", default=1000, type=int,
+                        help="# of stratum sessions to open, default 1000")
+    parser.add_argument("--nicehash", default=0.5, type=float,
+                        help=f"ratio of sessions using {NICEHASH_PROTOCOL}, default 0.5")
+    parser.add_argument("--concurrency", default=500, type=int,
+                        help="# of connections opening at the same time, default 500")
+    parser.add_argument("--submits", default=10, type=int,
+                        help="# of submits per session, default 10")
+    parser.add_argument("--framing", default=20000, type=int,
+                        help="# of messages to measure framing throughput, 0 to skip, default 20000")
+    parser.add_argument("--pid", default=0, type=int,
+                        help="pid of proxy to measure memory per session")
+    parser.add_argument("-w", "--wallet", default="0x" + "0" * 40,
+                        help="miner wallet address for all sessions")
+    parser.add_argument("-t", "--timeout", default=30, type=int,
+                        help="seconds to wait for replies, default 30")
+    parser.add_argument("-pow", "--pow", default=default_config["pow_window"], type=int,
+                        help=f"seconds of PoW window, default {default_config['pow_window']}")
+    parser.add_argument("-b", "--block", default=default_config["start_block"], type=int,
+                        help=f"block num of the work, default {default_config['start_block']}")
+    parser.add_argument("-d", "--diff", default=default_config["difficulty"], type=int,
+                        help=f"work difficulty, default {default_config['difficulty']}")
+    parser.add_argument("-k", "--keys", default=default_config["keys_file"],
+                        help=f"file of keys, default {default_config['keys_file']}")
+    return parser.parse_args(sys.argv[1:])
+
+
+def main():
+    args = build_args()
+    asyncio.get_event_loop().run_until_complete(bench(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# Zilliqa Mining Proxy
+# Copyright (C) 2019  Gully Chen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+  fakes shared by stratum tests
+"""
+
+from zilpool.stratum.cluster import WorkRecord
+
+
+def make_work(i, block_num=1):
+    return WorkRecord(pk=f"work_{i}", header=f"0x{i:064x}", seed="0x" + "0" * 64,
+                      boundary="0x" + "f" * 64, block_num=block_num, expire_time=2e9)
+
+
+class FakeTransport:
+    """ buffers written bytes, the protocol pauses and resumes writing """
+    def __init__(self, buffered=0, closing=False):
+        self.written = []
+        self.buffered = buffered
+        self.closed = closing
+        self.aborted = False
+
+    def is_closing(self):
+        return self.closed or self.aborted
+
+    def write(self, data):
+        self.written.append(data)
+        self.buffered += len(data)
+
+    def get_write_buffer_size(self):
+        return self.buffered
+
+    def close(self):
+        self.closed = True
+
+    def abort(self):
+        self.aborted = True
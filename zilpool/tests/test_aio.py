@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# Zilliqa Mining Proxy
+# Copyright (C) 2019  Gully Chen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+import asyncio
+import threading
+from contextvars import ContextVar
+
+from zilpool.database import aio
+
+request_id = ContextVar("request_id", default=None)
+
+
+class Model:
+    aio = aio.AsyncAccessor()
+    name = "model"
+
+    def __init__(self, value):
+        self.value = value
+
+    @classmethod
+    def create(cls, value):
+        return cls(value), threading.current_thread().name, request_id.get()
+
+    def add(self, n):
+        return self.value + n
+
+
+class TestAio:
+    def test_run(self):
+        async def main():
+            request_id.set(42)
+            obj, thread_name, rid = await Model.aio.create(1)
+            assert thread_name.startswith("db") and rid == 42
+            assert await obj.aio.add(2) == 3
+            assert await aio.run(sum, [1, 2, 3]) == 6
+
+        aio.init_executor(2)
+        asyncio.run(main())
+
+    def test_not_callable(self):
+        with pytest.raises(AttributeError):
+            Model.aio.name
@@ -17,6 +17,7 @@
 
 import pytest
 import random
+from concurrent.futures import ThreadPoolExecutor
 
 from zilpool.database import init_db, connect_to_db
 from zilpool.database.basemodel import db, drop_all
@@ -107,6 +108,96 @@ class TestDatabase:
 
         drop_all()
 
+    def test_pow_window(self):
+        from datetime import timedelta
+        from zilpool.database.pow import PowWork, PoWWindow, PoWWindowTracker
+
+        drop_all()
+        PoWWindowTracker.reset()
+
+        assert PoWWindow.get_latest_block_num() == -1
+        assert PoWWindow.seconds_to_next_pow() == 0
+
+        def new_work(block_num, timeout=60):
+            header = rand_hex_str(64, prefix="0x")
+            boundary = rand_hex_str(64, prefix="0x")
+            work = PowWork.new_work(header, block_num, boundary, timeout=timeout)
+            PoWWindow.update_pow_window(work)
+            return work
+
+        work1 = new_work(10)
+        work2 = new_work(10, timeout=120)
+        assert PoWWindow.get_latest_block_num() == 10
+        pow_start, pow_end = PoWWindow.get_pow_window()
+        assert pow_start == work1.start_time
+        assert pow_end == work2.expire_time
+
+        work3 = new_work(11)
+        PoWWindowTracker.flush()
+        assert PoWWindow.get_latest_block_num() == 11
+        assert PoWWindowTracker.pow_windows[-1] == \
+            (work2.expire_time - work1.start_time).total_seconds()
+
+        records = PoWWindow.get_all(order="create_time")
+        assert len(records) == 2
+        assert records[0].block_num == 10
+        assert records[0].pow_end == work2.expire_time
+        assert records[1].block_num == 11
+        assert records[1].estimated_next_pow == work3.start_time + timedelta(
+            seconds=PoWWindowTracker.avg_epoch)
+
+        # reload from database
+        PoWWindowTracker.reset()
+        assert PoWWindow.get_latest_block_num() == 11
+        assert list(PoWWindowTracker.pow_windows) == [records[0].pow_window]
+
+        # concurrent first calls wait for the records loaded
+        PoWWindowTracker.reset()
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            block_nums = list(executor.map(lambda _: PoWWindow.get_latest_block_num(),
+                                           range(8)))
+        assert block_nums == [11] * 8
+        assert list(PoWWindowTracker.pow_windows) == [records[0].pow_window]
+
+        drop_all()
+
+    def test_result_fan_out(self):
+        from zilpool.pyzil import crypto, ethash
+        from zilpool.database.pow import PowWork, PowResult
+
+        drop_all()
+
+        block_num = 22
+        header = "0x372eca2454ead349c3df0ab5d00b0b706b23e49d469387db91811cee0358fc6d"
+        nonce = 0x495732e0ed7a801c
+        mix_digest, hash_result = ethash.pow_hash(block_num, crypto.hex_str_to_bytes(header), nonce)
+
+        def boundary(difficulty):
+            return crypto.bytes_to_hex_str_0x(ethash.difficulty_to_boundary(difficulty))
+
+        shard_work = PowWork.new_work(header, block_num, boundary(12))
+        ds_work = PowWork.new_work(header, block_num, boundary(20))
+        hard_work = PowWork.new_work(header, block_num, boundary(21))
+
+        works = PowWork.find_works_by_header(header)
+        assert len(works) == 3
+        assert PowWork.pick_work(works) == shard_work
+        assert PowWork.pick_work(works, boundary(20)) == ds_work
+
+        saved = PowWork.save_result_to_works(
+            [ds_work, shard_work, hard_work], crypto.int_to_hex_str(nonce, n_bytes=8, prefix="0x"),
+            crypto.bytes_to_hex_str_0x(mix_digest), hash_result, "miner", "worker"
+        )
+        assert saved == [ds_work, shard_work]
+        assert PowResult.get_pow_result(header, boundary(12))
+        assert PowResult.get_pow_result(header, boundary(20))
+        assert not PowResult.get_pow_result(header, boundary(21))
+
+        # the same result again is not better than the saved ones
+        assert not shard_work.reload().check_result(hash_result)
+
+        drop_all()
+
     def test_node_owner(self):
         import time
         from datetime import datetime
@@ -292,6 +383,294 @@ class TestDatabase:
         rewards = PowResult.rewards_by_miners(block_num=5)
         assert len(rewards) == 2
 
+    def test_reward_ledger(self):
+        from zilpool.database.pow import PowResult, RewardLedger
+
+        config = get_database_debug_config()
+        drop_all()
+        init_db(config)
+
+        for i in range(10):
+            for args in [(i, "miner1", "worker1"), (i * 2 + 10, "miner1", "worker2"),
+                         (i * 5, "miner2", "worker1")]:
+                pow_result = self.save_result(i, *args)
+                RewardLedger.add_result(pow_result)
+                if pow_result.verified:
+                    RewardLedger.add_verified(pow_result)
+
+        for block_range, miner_wallet in [((0, 9), None), ((0, 4), None),
+                                          ((9, 9), "miner1"), ((3, 6), "miner2")]:
+            ledger = RewardLedger.epoch_rewards(block_num=block_range, miner_wallet=miner_wallet)
+            results = PowResult.epoch_rewards(block_num=block_range, miner_wallet=miner_wallet)
+            assert ledger == results
+
+        blocks = RewardLedger.rewards_by_blocks([1, 5, 8])
+        assert sorted(blocks) == [1, 5, 8]
+        rewards = {r["miner_wallet"]: r for r in blocks[5]}
+        assert rewards["miner1"]["rewards"] == 5 + 20
+        assert rewards["miner1"]["finished"] == 2
+        assert rewards["miner2"]["verified"] == 0
+
+        RewardLedger.rebuild()
+        assert RewardLedger.rewards_by_blocks([5])[5] == blocks[5]
+
+    def test_work_counter(self, monkeypatch):
+        from datetime import datetime, timedelta
+        from pymongo.errors import AutoReconnect
+        from zilpool.database.pow import PowWork, PowResult, WorkCounter
+
+        config = get_database_debug_config()
+        drop_all()
+        init_db(config)
+
+        works = [PowWork.new_work(header=f"header_{i}", block_num=i // 2, boundary="0x" + "f" * 64,
+                                  pub_key=f"pub_key_{i % 2}", timeout=60) for i in range(4)]
+        assert WorkCounter.global_stats() == {"all": 4, "working": 4, "finished": 0, "verified": 0}
+
+        works[0].increase_dispatched(max_dispatch=10)
+        works[0].increase_dispatched(max_dispatch=10)
+        assert WorkCounter.block_counters([0])[0].dispatched == 1
+
+        # a better result of a finished work is not counted again
+        assert works[0].save_result("nonce", "mix_digest", "0x" + "e" * 64, "miner1", "worker1")
+        assert works[0].save_result("nonce", "mix_digest", "0x" + "d" * 64, "miner2", "worker1")
+        assert PowWork.get_one(header="header_0").miner_wallet == "miner2"
+        # verified twice, turned verified once
+        pow_result = PowResult.get_one(header="header_0", miner_wallet="miner2")
+        assert pow_result.set_verified(True).verified is False
+        assert pow_result.set_verified(True).verified is True
+        assert pow_result.verified and pow_result.verified_time
+        WorkCounter.inc("pub_key_0", 0, verified=1)
+
+        assert WorkCounter.global_stats() == {"all": 4, "working": 3, "finished": 1, "verified": 1}
+        assert WorkCounter.node_stats(["pub_key_0"])["pub_key_0"]["finished"] == 1
+
+        # finished works are not expired
+        later = datetime.utcnow() + timedelta(seconds=120)
+        assert PowWork.sweep_expired(now=later) == 3
+        assert PowWork.sweep_expired(now=later) == 0
+        assert WorkCounter.global_stats() == {"all": 4, "working": 0, "finished": 1, "verified": 1}
+        assert WorkCounter.block_counters([1])[1].expired == 2
+
+        counters = {c.key: c.to_mongo().to_dict() for c in WorkCounter.objects}
+        WorkCounter.rebuild()
+        rebuilt = {c.key: c.to_mongo().to_dict() for c in WorkCounter.objects}
+        assert sorted(rebuilt) == sorted(counters)
+        for key, counter in rebuilt.items():
+            counter.pop("_id")
+            counters[key].pop("_id")
+            assert counter == counters[key]
+
+        # works are saved even if counters failed
+        class Unavailable:
+            def bulk_write(self, *args, **kwargs):
+                raise AutoReconnect("counters unavailable")
+
+        monkeypatch.setattr(WorkCounter, "_get_collection", classmethod(lambda cls: Unavailable()))
+        assert PowWork.new_work(header="header_4", block_num=2, boundary="0x" + "f" * 64,
+                                pub_key="pub_key_0", timeout=60)
+        assert PowWork.count() == 5
+
+    def test_archive(self):
+        from zilpool.common.utils import MagicDict
+        from zilpool.database import archive, retention, roundtrip
+        from zilpool.database.pow import PowWork, PowResult, RewardLedger
+
+        config = get_database_debug_config()
+        drop_all()
+        init_db(config)
+
+        for i in range(10):
+            PowWork.new_work(header=f"header_{i}", block_num=i, boundary="0x" + "f" * 64,
+                             pub_key="pub_key", pow_fee=i)
+            self.save_result(i, i, "miner1", "worker1")
+            self.save_result(i, i * 5, "miner2", "worker1")
+        RewardLedger.rebuild()
+
+        before = [PowResult.epoch_rewards(block_num=i) for i in range(10)]
+        all_rewards = PowResult.epoch_rewards(block_num=(2, 7))
+
+        archive.init_archive(MagicDict({"database": {"archive": {"keep_blocks": 4,
+                                                                  "compressor": "zstd"}}}))
+        moved = archive.archive_old_blocks(keep_blocks=4)
+        assert moved == {"zil_pow_works": 6, "zil_pow_results": 12}
+        assert archive.archive_old_blocks(keep_blocks=4) == {"zil_pow_works": 0, "zil_pow_results": 0}
+
+        assert PowWork.count() == 4
+        assert PowWork.archive_objects().count() == 6
+        assert PowWork.archived_block() == 5
+        assert PowWork.get_latest_block_num() == 9
+        assert PowWork.get_first_block_num() == 0
+        assert PowWork.get_latest_work(block_num=3).header == "header_3"
+        assert PowWork.avg_pow_fee(2) == 2
+
+        assert [PowResult.epoch_rewards(block_num=i) for i in range(10)] == before
+        assert PowResult.epoch_rewards(block_num=(2, 7)) == all_rewards
+        assert len(PowResult.rewards_by_miners(block_num=1)) == 2
+
+        blocks = RewardLedger.rewards_by_blocks(range(10))
+        RewardLedger.rebuild()
+        assert RewardLedger.rewards_by_blocks(range(10)) == blocks
+
+        # lookups of archived blocks read the archive only, writes are refused
+        with roundtrip.counting() as counter:
+            assert PowWork.new_work(header="header_late", block_num=5, boundary="0x" + "f" * 64,
+                                    pub_key="pub_key") is None
+        assert roundtrip.total(counter) == 0
+        work = PowWork.archive_objects(block_num=5).first()
+        assert work.save_result("nonce", "mix_digest", "0x" + "e" * 64, "miner1", "worker1") is None
+        assert PowResult.count(block_num=5) == 0
+
+        # results without finished time
+        PowResult.objects(block_num__gte=6).update(unset__finished_time=True)
+        rewards = PowResult.epoch_rewards(block_num=(2, 7))
+        assert rewards["first_work_at"] == all_rewards["first_work_at"]
+        assert rewards["last_work_at"] <= all_rewards["last_work_at"]
+        assert PowResult.epoch_rewards(block_num=(6, 7))["first_work_at"] is None
+
+        retention.init_retention(MagicDict({"database": {"retention": {"results": 30}}}))
+        indexes = archive.get_archive_collection(PowResult).index_information()
+        assert indexes[retention.ttl_index_name("finished_time")]["expireAfterSeconds"] == \
+            30 * retention.SECONDS_PER_DAY
+
+        # archival disabled, no lookup of the last block archived
+        archive.init_archive(config)
+        archive.reset_marks()
+        with roundtrip.counting() as counter:
+            assert PowWork.new_work(header="header_late", block_num=5, boundary="0x" + "f" * 64,
+                                    pub_key="pub_key")
+        assert "find" not in counter
+
+    def test_update_stat(self):
+        from zilpool.database.miner import Miner, Worker
+        from zilpool.database.zilnode import ZilNode
+
+        config = get_database_debug_config()
+        drop_all()
+        init_db(config)
+
+        node = ZilNode(pub_key="pub_key", pow_fee=1.0, email="email").save()
+        ZilNode.objects(pk=node.pk).update(set__email="changed")
+        assert node.update(only=["pow_fee"], inc__pow_fee=0.5) is node
+        assert node.pow_fee == 1.5
+        assert node.email == "email"    # not in only, kept in memory
+        assert node.update(set__authorized=False).email == "changed"
+
+        Miner.get_or_create("wallet", "worker1")
+        Miner.get_or_create("wallet", "worker2")
+        worker = Worker.get_one(wallet_address="wallet", worker_name="worker1")
+        worker.update_stat(inc_submitted=2, inc_failed=1)
+        worker.update_stat(inc_finished=1)
+        worker.update_stat()
+
+        worker = Worker.get_one(wallet_address="wallet", worker_name="worker1")
+        assert worker.works_stats() == {"work_submitted": 2, "work_failed": 1,
+                                        "work_finished": 1, "work_verified": 0}
+        miner = Miner.get_one(wallet_address="wallet")
+        assert miner.works_stats() == worker.works_stats()
+        assert Worker.get_one(wallet_address="wallet", worker_name="worker2").work_submitted == 0
+
+        node.delete()
+        assert node.update(only=["pow_fee"], inc__pow_fee=1) is None
+
+    def test_concurrent_get_or_create(self, monkeypatch):
+        from concurrent.futures import ThreadPoolExecutor
+        from zilpool.database.basemodel import init_indexes
+        from zilpool.database.miner import Miner, Worker
+
+        config = get_database_debug_config()
+        drop_all()
+        init_db(config)
+
+        workers = [f"worker{i % 4}" for i in range(32)]
+        with ThreadPoolExecutor(16) as executor:
+            miners = list(executor.map(lambda name: Miner.get_or_create("wallet", name), workers))
+        assert all(miners)
+        assert Worker.count(wallet_address="wallet") == 4
+        assert sorted(Miner.get_one(wallet_address="wallet").workers_name) == sorted(set(workers))
+
+        # duplicates created before the index was unique
+        collection = Worker._get_collection()
+        collection.drop_indexes()
+        collection.insert_one({"wallet_address": "wallet", "worker_name": "worker0",
+                               "work_submitted": 3, "work_failed": 0,
+                               "work_finished": 1, "work_verified": 0})
+        assert Worker.merge_duplicates() == 1
+        init_indexes()
+        worker = Worker.get_one(wallet_address="wallet", worker_name="worker0")
+        assert (worker.work_submitted, worker.work_finished) == (3, 1)
+
+        # no aggregation once the unique index is in place
+        def aggregate(*args, **kwargs):
+            raise AssertionError("aggregate with the unique index")
+
+        monkeypatch.setattr(collection, "aggregate", aggregate)
+        assert Worker.merge_duplicates() == 0
+
+    def test_hashrate_epoch(self):
+        from datetime import datetime, timedelta
+        from zilpool.database.pow import PoWWindow, PoWWindowTracker
+        from zilpool.database.miner import HashRate, HashRateMinute, HashRateHour, HashRateEpoch
+
+        config = get_database_debug_config()
+        drop_all()
+        init_db(config)
+        PoWWindowTracker.reset()
+
+        now = datetime(2019, 6, 1, 12, 30, 45, 123000)
+        assert HashRateMinute.period_of(now) == datetime(2019, 6, 1, 12, 30)
+        assert HashRateHour.period_of(now) == datetime(2019, 6, 1, 12)
+
+        # concurrent samples of a new period, none dropped
+        recent = datetime.utcnow()
+        with ThreadPoolExecutor(16) as executor:
+            list(executor.map(lambda i: HashRateMinute.add(i, "miner0", "worker0", recent), range(32)))
+        rollup = HashRateMinute.get_one(wallet_address="miner0", worker_name="worker0")
+        assert (rollup.samples, rollup.max_hashrate, rollup.sum_hashrate) == (32, 31, sum(range(32)))
+        HashRateMinute.objects(wallet_address="miner0").delete()
+
+        # recent samples, not removed by TTL indexes
+        start = datetime.utcnow() - timedelta(hours=3)
+        for block_num in range(3):
+            pow_start = start + timedelta(hours=block_num)
+            PoWWindow.create(block_num=block_num, create_time=pow_start,
+                             pow_start=pow_start, pow_end=pow_start + timedelta(minutes=5))
+
+        # block 0 before minute rollups began, only raw samples
+        for worker, hashrate in [("worker1", 100), ("worker1", 300), ("worker2", 50)]:
+            HashRate(wallet_address="miner1", worker_name=worker, hashrate=hashrate,
+                     updated_time=start + timedelta(minutes=1)).save()
+        minute = HashRateMinute.period_of(start + timedelta(hours=1))
+        for worker, hashrate, samples in [("worker1", 500, 2), ("worker2", 70, 1)]:
+            HashRateMinute(wallet_address="miner1", worker_name=worker, period=minute,
+                           max_hashrate=hashrate, sum_hashrate=hashrate * samples,
+                           samples=samples).save()
+
+        # closed epochs are read from minute rollups until rolled up
+        assert HashRate.epoch_hashrate(block_num=0) == 0
+        assert HashRate.epoch_hashrate(block_num=1) == 570
+        assert HashRateEpoch.count() == 0
+
+        assert HashRateEpoch.roll_closed_epochs(grace=0) == 2
+        assert HashRateEpoch.roll_closed_epochs(grace=0) == 0
+        assert all(w.hashrate_rolled for w in PoWWindow.get_all(block_num__lt=2))
+        assert not PoWWindow.get_one(block_num=2).hashrate_rolled
+
+        assert HashRate.epoch_hashrate(block_num=0) == 350
+        assert HashRate.epoch_hashrate(block_num=0, wallet_address="miner1",
+                                       worker_name="worker1") == 300
+        assert HashRateEpoch.get_one(block_num=0, worker_name="worker1").avg_hashrate == 200
+        assert HashRate.epoch_hashrate(block_num=1) == 570
+
+        # rolled up again without duplicates
+        PoWWindow.objects(block_num=1).update(set__hashrate_rolled=False)
+        assert HashRateEpoch.roll_epoch(1)
+        assert HashRateEpoch.count(block_num=1) == 2
+        assert HashRate.epoch_hashrate(block_num=1) == 570
+
+        PoWWindowTracker.reset()
+        drop_all()
+
     def test_paginate(self):
         from zilpool.database.miner import Miner
         from zilpool.database.zilnode import ZilNode
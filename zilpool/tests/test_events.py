@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# Zilliqa Mining Proxy
+# Copyright (C) 2019  Gully Chen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import threading
+
+from zilpool.common.events import Waiters, Listeners
+
+
+class TestWaiters:
+    def test_notify(self):
+        waiters = Waiters()
+
+        async def run():
+            key = ("header", "boundary")
+            waiter = waiters.add(key)
+            assert waiters.count(key) == 1
+
+            # notify from another thread, like a database write in executor
+            timer = threading.Timer(0.05, waiters.notify, args=(key, "result"))
+            timer.start()
+            res = await waiters.wait(waiter, timeout=2)
+            waiters.remove(key, waiter)
+            assert res == "result"
+            assert waiters.count() == 0
+
+        asyncio.run(run())
+
+    def test_timeout(self):
+        waiters = Waiters()
+
+        async def run():
+            waiter = waiters.add("key")
+            assert waiters.notify("other key") == 0
+            res = await waiters.wait(waiter, timeout=0.05)
+            waiters.remove("key", waiter)
+            assert res is None
+            assert waiters.count("key") == 0
+
+        asyncio.run(run())
+
+    def test_notify_before_wait(self):
+        waiters = Waiters()
+
+        async def run():
+            waiter = waiters.add("key")
+            assert waiters.notify("key", 42) == 1
+            await asyncio.sleep(0)
+            assert await waiters.wait(waiter, timeout=1) == 42
+            waiters.remove("key", waiter)
+
+        asyncio.run(run())
+
+
+class TestListeners:
+    def test_emit(self):
+        listeners = Listeners()
+
+        async def run():
+            closed = asyncio.Queue()
+
+            def on_closed(header, boundary):
+                closed.put_nowait((header, boundary, threading.current_thread()))
+
+            listeners.add(on_closed)
+            assert len(listeners) == 1
+
+            # emit from another thread, callback runs in event loop thread
+            timer = threading.Timer(0.05, listeners.emit, args=("header", "boundary"))
+            timer.start()
+            header, boundary, thread = await asyncio.wait_for(closed.get(), 2)
+            assert (header, boundary) == ("header", "boundary")
+            assert thread is threading.current_thread()
+
+            listeners.remove(on_closed)
+            assert listeners.emit("header", "boundary") == 0
+
+        asyncio.run(run())
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# Zilliqa Mining Proxy
+# Copyright (C) 2019  Gully Chen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from zilpool.database.retention import apply_ttl, ttl_index_name, SECONDS_PER_DAY
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.commands = []
+
+    def command(self, *args, **kwargs):
+        self.commands.append((args, kwargs))
+
+
+class FakeCollection:
+    name = "zil_pow_works"
+
+    def __init__(self):
+        self.database = FakeDatabase()
+        self.indexes = {}
+
+    def index_information(self):
+        return self.indexes
+
+    def create_index(self, keys, name, **kwargs):
+        self.indexes[name] = dict(key=keys, **kwargs)
+
+    def drop_index(self, name):
+        del self.indexes[name]
+
+
+class TestRetention:
+    def test_apply_ttl(self):
+        col = FakeCollection()
+        name = ttl_index_name("expire_time")
+        partial = {"finished": False}
+
+        assert apply_ttl(col, "expire_time", 0) is None
+        assert apply_ttl(col, "expire_time", 7, partial) == "created"
+        assert col.indexes[name]["expireAfterSeconds"] == 7 * SECONDS_PER_DAY
+        assert col.indexes[name]["partialFilterExpression"] == partial
+        assert apply_ttl(col, "expire_time", 7, partial) is None
+
+        assert apply_ttl(col, "expire_time", 0.5, partial) == "changed"
+        (args, kwargs), = col.database.commands
+        assert args == ("collMod", "zil_pow_works")
+        assert kwargs["index"] == {"name": name, "expireAfterSeconds": SECONDS_PER_DAY // 2}
+
+        assert apply_ttl(col, "expire_time", 0) == "dropped"
+        assert not col.indexes
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Zilliqa Mining Proxy
+# Copyright (C) 2019  Gully Chen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import namedtuple
+
+from zilpool.database import roundtrip
+
+Event = namedtuple("Event", ["command_name", "command"])
+
+
+class TestRoundTrip:
+    def test_counting(self):
+        listener = roundtrip.RoundTripListener()
+        listener.started(Event("find", {}))    # not counting
+
+        with roundtrip.counting() as counter:
+            listener.started(Event("find", {}))
+            listener.started(Event("findAndModify", {"writeConcern": {"w": 1}}))
+            listener.started(Event("update", {"writeConcern": {"w": 0}}))
+            listener.started(Event("insert", {"writeConcern": {"w": 0}}))
+
+            with roundtrip.counting() as inner:
+                listener.started(Event("find", {}))
+
+        listener.started(Event("find", {}))
+        assert counter == {"find": 1, "findAndModify": 1, roundtrip.UNACKNOWLEDGED: 2}
+        assert roundtrip.total(counter) == 2
+        assert roundtrip.total(inner) == 1
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+# Zilliqa Mining Proxy
+# Copyright (C) 2019  Gully Chen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import asyncio
+
+import pytest
+from pymongo import monitoring
+
+from zilpool.common.utils import MagicDict
+from zilpool.database import routing
+
+# uri of a local replica set, e.g. "mongodb://127.0.0.1:27017/zil_pool?replicaSet=rs0"
+REPLICA_SET_URI = os.getenv("ZILPOOL_TEST_REPLICA_SET")
+
+
+def routing_config(mode, max_staleness=-1, uri=None):
+    return MagicDict({"database": {
+        "uri": uri,
+        "stats_read_preference": mode,
+        "max_staleness": max_staleness,
+    }})
+
+
+class TestRouting:
+    def teardown_method(self):
+        routing.configure(routing_config("primary"))
+
+    def test_make_read_preference(self):
+        assert routing.make_read_preference("primary") is None
+
+        pref = routing.make_read_preference("secondaryPreferred", 120)
+        assert pref.mongos_mode == "secondaryPreferred"
+        assert pref.max_staleness == 120
+
+        with pytest.raises(ValueError):
+            routing.make_read_preference("secondaryPreferred", 30)
+        with pytest.raises(ValueError):
+            routing.make_read_preference("anywhere")
+
+    def test_secondary_reads(self):
+        routing.configure(routing_config("secondary", 90))
+        assert routing.current_read_preference() is None
+
+        with routing.secondary_reads():
+            assert routing.current_read_preference().mongos_mode == "secondary"
+        assert routing.current_read_preference() is None
+
+        routing.configure(routing_config("primary"))
+        with routing.secondary_reads():
+            assert routing.current_read_preference() is None
+
+    def test_primary_reads(self):
+        routing.configure(routing_config("secondary", 90))
+
+        @routing.primary_reads()
+        def roll():
+            return routing.current_read_preference()
+
+        with routing.secondary_reads():
+            assert roll() is None
+            with routing.primary_reads():
+                assert routing.current_read_preference() is None
+            assert routing.current_read_preference().mongos_mode == "secondary"
+
+    def test_stats_reads(self):
+        routing.configure(routing_config("nearest"))
+
+        @routing.stats_reads
+        async def handler():
+            await asyncio.sleep(0)
+            return routing.current_read_preference()
+
+        pref = asyncio.run(handler())
+        assert pref.mongos_mode == "nearest"
+        assert routing.current_read_preference() is None
+
+
+class CommandAddresses(monitoring.CommandListener):
+    def __init__(self):
+        self.addresses = {}
+
+    def started(self, event):
+        self.addresses.setdefault(event.command_name, set()).add(event.connection_id)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+@pytest.mark.skipif(not REPLICA_SET_URI, reason="ZILPOOL_TEST_REPLICA_SET not set")
+def test_replica_set():
+    from mongoengine import disconnect
+    from mongoengine.connection import get_connection
+    from zilpool.database import connect_to_db
+    from zilpool.database.zilnode import ZilNode
+
+    listener = CommandAddresses()
+    monitoring.register(listener)
+    disconnect()
+    connect_to_db(routing_config("secondary", 90, uri=REPLICA_SET_URI))
+    client = get_connection()
+    client.admin.command("ping")
+
+    ZilNode.objects.first()
+    assert listener.addresses["find"] == {client.primary}
+
+    listener.addresses.clear()
+    with routing.secondary_reads():
+        ZilNode.objects.first()
+        ZilNode.estimated_count()
+    addresses = set.union(*listener.addresses.values())
+    assert client.primary not in addresses
+
+    disconnect()
+    routing.configure(routing_config("primary"))
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+# Zilliqa Mining Proxy
+# Copyright (C) 2019  Gully Chen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import stat
+import asyncio
+
+import pytest
+
+from zilpool.stratum import cluster
+from zilpool.stratum.stratum_server import broadcast_works, stratumSessions
+from zilpool.stratum.cluster import ClusterHub, ClusterClient, WorkerKey, ipc_path
+from zilpool.stratum.jobs import JobRecord
+from zilpool.tests.stratum_fakes import FakeTransport, make_work
+
+
+class FakeSession:
+    def __init__(self, transport):
+        self.transport = transport
+        self.works = []
+        self._work = self._pendingWork = None
+        self.subscribed = self.authorized = False
+
+    def set_workDone(self, work):
+        pass
+
+    def notify_work(self, work, cache=None):
+        self.works.append(work)
+        return True
+
+
+class FakeStore:
+    """ database store of hub """
+    def __init__(self):
+        self.calls = []
+
+    async def get_worker(self, miner_wallet, worker_name):
+        self.calls.append(("get_worker", miner_wallet, worker_name))
+        return WorkerKey(miner_wallet, worker_name)
+
+    async def fail_submit(self, _worker):
+        self.calls.append(("fail_submit", _worker))
+
+    async def log_hashrate(self, hashrate, wallet_address, worker_name):
+        self.calls.append(("log_hashrate", hashrate, wallet_address, worker_name))
+
+
+class TestCluster:
+    def test_broadcast_works(self):
+        sessions = [FakeSession(FakeTransport()) for _ in range(3)]
+        sessions.append(FakeSession(FakeTransport(closing=True)))
+        sessions.append(FakeSession(FakeTransport(buffered=1024)))
+        counts = []
+
+        async def fetch_works(count):
+            counts.append(count)
+            return [make_work(i) for i in range(count)]
+
+        sent, skipped = asyncio.run(broadcast_works(fetch_works, high_water=512,
+                                                    sessions=sessions))
+        assert (sent, skipped) == (3, 2)
+        assert counts == [3]
+        assert [s.works[0].pk for s in sessions[:3]] == ["work_0", "work_1", "work_2"]
+        assert sessions[3].works == sessions[4].works == []
+
+    def test_pull_works(self, tmp_path):
+        counts = []
+
+        async def fetch_works(count):
+            counts.append(count)
+            return [make_work(i) for i in range(min(count, 2))]
+
+        async def run():
+            hub = ClusterHub(str(tmp_path / "hub.sock"))
+            await hub.start()
+            client = ClusterClient(hub.path)
+            await client.connect()
+            client_task = asyncio.ensure_future(client.run())
+            try:
+                return await client.fetch_works(5)
+            finally:
+                client.writer.close()
+                await client_task
+                hub.server.close()
+
+        cluster.work_fetcher = fetch_works
+        try:
+            works = asyncio.run(run())
+        finally:
+            cluster.work_fetcher = None
+
+        assert counts == [5]
+        assert works == [make_work(0), make_work(1)]
+
+    def test_pull_closed_works(self, tmp_path):
+        released, mining = (FakeSession(FakeTransport()) for _ in range(2))
+        closed = released._work = make_work(0)
+        mining._work = make_work(1)
+        counts = []
+
+        async def fetch_works(count):
+            counts.append(count)
+            return [make_work(i + 2) for i in range(count)]
+
+        async def run():
+            hub = ClusterHub(str(tmp_path / "hub.sock"))
+            await hub.start()
+            client = ClusterClient(hub.path)
+            await client.connect()
+            client_task = asyncio.ensure_future(client.run())
+            try:
+                while not hub.workers:
+                    await asyncio.sleep(0.01)
+                hub.publish_closed(closed.header, closed.boundary)
+                while not released.works:
+                    await asyncio.sleep(0.01)
+            finally:
+                client.writer.close()
+                await client_task
+                hub.server.close()
+
+        cluster.work_fetcher = fetch_works
+        try:
+            for conn, session in (("released", released), ("mining", mining)):
+                stratumSessions.add(conn, session)
+                stratumSessions.set_subscribed(conn)
+            asyncio.run(asyncio.wait_for(run(), timeout=5))
+        finally:
+            cluster.work_fetcher = None
+            for conn in ("released", "mining"):
+                stratumSessions.remove(conn)
+
+        # only the session mining the closed work pulls a new one
+        assert counts == [1]
+        assert released.works == [make_work(2)]
+        assert mining.works == [] and mining._work == make_work(1)
+
+    def test_ipc_path(self, tmp_path):
+        ipc_dir = tmp_path / "ipc"
+        path = ipc_path({"ipc_dir": str(ipc_dir)})
+        assert path == str(ipc_dir / "stratum.sock")
+        assert stat.S_IMODE(os.stat(ipc_dir).st_mode) == 0o700
+
+        os.chmod(ipc_dir, 0o755)
+        with pytest.raises(PermissionError):
+            ipc_path({"ipc_dir": str(ipc_dir)})
+
+    def test_hub_persists(self, tmp_path, monkeypatch):
+        saved = []
+
+        def save_submit(work_id, header, nonce, mix_digest, hash_result, _worker):
+            saved.append((work_id, header, nonce, mix_digest, hash_result, _worker))
+            return True
+
+        monkeypatch.setattr(cluster, "save_submit", save_submit)
+        job = JobRecord(job_id="00000001", work_id="work_0", header="0x" + "00" * 32,
+                        header_bytes=bytes(32), seed_bytes=bytes(32), block_num=1,
+                        ethash_block=0, boundary="0x" + "ff" * 32,
+                        boundary_int=2 ** 256 - 1, expire_at=2e9)
+
+        async def run():
+            hub = ClusterHub(ipc_path({"ipc_dir": str(tmp_path / "ipc")}))
+            hub.store = store = FakeStore()
+            await hub.start()
+            assert stat.S_IMODE(os.stat(hub.path).st_mode) == 0o600
+            client = ClusterClient(hub.path)
+            await client.connect()
+            client_task = asyncio.ensure_future(client.run())
+            try:
+                _worker = await client.get_worker("wallet", "rig1")
+                assert _worker == WorkerKey("wallet", "rig1")
+                await client.fail_submit(_worker)
+                await client.log_hashrate(100, "wallet", "rig1")
+                assert await client.save_submit(_worker, job, "0x01", "0x02", b"\x03")
+                while len(store.calls) < 3:
+                    await asyncio.sleep(0.01)
+                return store.calls
+            finally:
+                client.writer.close()
+                await client_task
+                hub.server.close()
+
+        calls = asyncio.run(asyncio.wait_for(run(), timeout=5))
+        # the worker is got from database once, then cached in hub
+        assert sorted(calls) == [
+            ("fail_submit", WorkerKey("wallet", "rig1")),
+            ("get_worker", "wallet", "rig1"),
+            ("log_hashrate", 100, "wallet", "rig1"),
+        ]
+        assert saved == [("work_0", job.header, "0x01", "0x02", b"\x03",
+                          WorkerKey("wallet", "rig1"))]
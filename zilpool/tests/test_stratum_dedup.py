@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# Zilliqa Mining Proxy
+# Copyright (C) 2019  Gully Chen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from zilpool.stratum.dedup import ShareFilter
+
+
+class TestShareFilter:
+    def test_duplicate(self):
+        shares = ShareFilter(job_ttl=60)
+        worker = ("wallet", "rig1")
+        assert not shares.is_duplicate("job1", "0x00000000000000ab", worker, now=0)
+        assert shares.is_duplicate("job1", "0x00000000000000AB", worker, now=1)
+        assert shares.is_duplicate("job1", "ab", ("wallet", "rig2"), now=1)
+        assert not shares.is_duplicate("job2", "0x00000000000000ab", worker, now=1)
+        assert shares.duplicates[worker] == 1
+        assert shares.total_duplicates == 2
+
+    def test_expire(self):
+        shares = ShareFilter(job_ttl=60)
+        shares.is_duplicate("job1", "01", now=0)
+        shares.is_duplicate("job2", "01", now=30)
+        assert len(shares) == 2
+        shares.expire(now=61)
+        assert len(shares) == 1
+        assert not shares.is_duplicate("job1", "01", now=61)
+        assert shares.is_duplicate("job2", "01", now=62)
+
+    def test_bounded(self):
+        shares = ShareFilter(max_shares_per_job=3)
+        for nonce in ("01", "02", "03", "04"):
+            assert not shares.is_duplicate("job", nonce, now=0)
+        # the oldest nonce is forgotten
+        assert not shares.is_duplicate("job", "01", now=0)
+        assert shares.is_duplicate("job", "04", now=0)
+
+    def test_bounded_duplicates(self):
+        shares = ShareFilter(max_duplicate_workers=2)
+        shares.is_duplicate("job", "01", now=0)
+        for worker in ("rig1", "rig2", "rig1", "rig3"):
+            assert shares.is_duplicate("job", "01", worker, now=0)
+        # the least recent worker is forgotten, the total is kept
+        assert list(shares.duplicates.items()) == [("rig1", 2), ("rig3", 1)]
+        assert shares.total_duplicates == 4
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# Zilliqa Mining Proxy
+# Copyright (C) 2019  Gully Chen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from zilpool.stratum.extranonce import ExtranonceAllocator, ExtranonceExhausted
+
+
+def prefix_free(prefixes):
+    prefixes = sorted(prefixes)
+    return all(not b.startswith(a) for a, b in zip(prefixes, prefixes[1:]))
+
+
+class TestExtranonce:
+    def test_allocate(self):
+        allocator = ExtranonceAllocator()
+        assert allocator.capacity == 128 + 16384 + 4194304
+
+        prefixes = [allocator.allocate() for _ in range(128)]
+        assert prefixes[0] == "00" and prefixes[-1] == "7f"
+
+        prefixes += [allocator.allocate() for _ in range(20000)]
+        assert prefixes[128] == "8000" and prefixes[128 + 16383] == "bfff"
+        assert prefixes[128 + 16384] == "c00000"
+        assert len(set(prefixes)) == len(prefixes) == len(allocator)
+        assert prefix_free(prefixes)
+
+    def test_release(self):
+        allocator = ExtranonceAllocator()
+        prefixes = [allocator.allocate() for _ in range(200)]
+        for p in (prefixes[150], prefixes[1], prefixes[0]):
+            allocator.release(p)
+        allocator.release("zz")
+        assert len(allocator) == 197
+
+        # shortest first, then in FIFO order
+        assert allocator.allocate() == prefixes[1]
+        assert allocator.allocate() == prefixes[0]
+        assert allocator.allocate() == prefixes[150]
+        assert allocator.allocate() == "8048"
+
+    def test_root_and_exhausted(self):
+        allocator = ExtranonceAllocator(root="01", max_bytes=1)
+        prefixes = [allocator.allocate() for _ in range(256)]
+        assert all(p.startswith("01") and len(p) == 4 for p in prefixes)
+        with pytest.raises(ExtranonceExhausted):
+            allocator.allocate()
+
+        allocator.release("01ab")
+        assert allocator.allocate() == "01ab"
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# Zilliqa Mining Proxy
+# Copyright (C) 2019  Gully Chen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import time
+
+from zilpool.stratum.stratum_server import StratumMiner, stratumSessions, stratumJobs
+from zilpool.stratum.stratum_server import close_slow_sessions, broadcast_work, STRATUM_NICEHASH
+from zilpool.stratum import stratum_server
+from zilpool.stratum.vardiff import VarDiff
+from zilpool.tests.stratum_fakes import FakeTransport, make_work
+
+
+def notified_headers(transport):
+    return [json.loads(data)["params"][1] for data in transport.written]
+
+
+class TestFlowControl:
+    def test_coalesce_while_paused(self):
+        transport = FakeTransport()
+        miner = StratumMiner(transport)
+        coalesced = stratumSessions.flow["coalesced"]
+
+        miner.pause_writing()
+        for i in range(3):
+            assert miner.send_work(make_work(i, block_num=i))
+        assert transport.written == []
+        assert stratumSessions.flow["coalesced"] == coalesced + 2
+
+        transport.buffered = 0
+        miner.resume_writing()
+        assert miner.paused_at is None
+        assert notified_headers(transport) == [make_work(2).header[2:]]
+
+        miner.resume_writing()
+        assert len(transport.written) == 1
+
+    def test_overflow_abort(self):
+        transport = FakeTransport()
+        miner = StratumMiner(transport, max_write_buffer=64)
+        overflow_closed = stratumSessions.flow["overflow_closed"]
+
+        assert miner.write(b"x" * 64)
+        assert not transport.aborted
+        assert not miner.write(b"x")
+        assert transport.aborted
+        assert stratumSessions.flow["overflow_closed"] == overflow_closed + 1
+
+        assert not miner.write(b"x")
+        assert transport.written == [b"x" * 64, b"x"]
+
+    def test_close_slow_sessions(self):
+        slow, paused, active = (StratumMiner(FakeTransport()) for _ in range(3))
+        for conn, miner in (("slow", slow), ("paused", paused), ("active", active)):
+            stratumSessions.add(conn, miner)
+        try:
+            slow.pause_writing()
+            paused.pause_writing()
+            slow.paused_at = time.monotonic() - 120
+
+            assert close_slow_sessions(60) == 1
+            assert slow.transport.aborted
+            assert not paused.transport.aborted
+            assert not active.transport.aborted
+
+            slow.resume_writing()
+            paused.resume_writing()
+            assert close_slow_sessions(0) == 0
+        finally:
+            for conn in ("slow", "paused", "active"):
+                stratumSessions.remove(conn)
+
+    def test_retarget_live_work(self):
+        transport = FakeTransport()
+        miner = StratumMiner(transport, vardiff=VarDiff(initial_difficulty=20))
+        work = make_work(100, block_num=100)._replace(expire_time=time.time() + 60)
+        assert miner.send_work(work)
+        assert len(transport.written) == 1
+
+        # no share in a window mined all along, sent again with an easier target
+        boundary = miner.vardiff.boundary
+        miner.vardiff.window_start = miner.vardiff.mining_since = time.monotonic() - 61
+        assert miner.retarget() == 0
+        assert miner.vardiff.boundary == boundary * 4
+        assert len(transport.written) == 2
+
+        # the expired job is cleared, not sent again, target kept
+        stratumJobs.add(work._replace(expire_time=time.time() - 1))
+        miner.vardiff.window_start = time.monotonic() - 61
+        assert miner.retarget() == 0
+        assert miner._work is None
+        assert miner.vardiff.mining_since is None
+        assert miner.vardiff.boundary == boundary * 4
+        assert len(transport.written) == 2
+        assert miner.notify_work(make_work(101, block_num=100))
+
+    def test_share_target_grace(self):
+        miner = StratumMiner(FakeTransport(), vardiff=VarDiff(initial_difficulty=20))
+        work = make_work(102, block_num=102)._replace(boundary="0x" + "0" * 63 + "1")
+        miner.send_work(work)
+        easy = miner.share_target()
+        assert easy == miner.vardiff.boundary
+
+        # shares in flight for the easier target are accepted for a while
+        miner.vardiff.boundary //= 4
+        miner.send_work(work)
+        assert miner._shareBoundary == easy // 4
+        assert miner.share_target() == easy
+        assert miner.share_target(now=time.monotonic() + 60) == easy // 4
+        assert miner.share_target() == easy // 4
+
+
+class TestBroadcast:
+    def test_encode_once(self, monkeypatch):
+        encoded = []
+
+        def counted(encode):
+            def wrapper(*args):
+                encoded.append(encode.__name__)
+                return encode(*args)
+            return wrapper
+
+        monkeypatch.setattr(stratum_server, "encode_notify", counted(stratum_server.encode_notify))
+        monkeypatch.setattr(stratum_server, "encode_difficulty",
+                            counted(stratum_server.encode_difficulty))
+
+        sessions = [StratumMiner(FakeTransport(), stratumVersion=STRATUM_NICEHASH)
+                    for _ in range(3)]
+        # a session with its own share target gets its own message
+        sessions.append(StratumMiner(FakeTransport(), stratumVersion=STRATUM_NICEHASH,
+                                     vardiff=VarDiff(initial_difficulty=20)))
+        work = make_work(103, block_num=103)._replace(boundary="0x" + "0" * 63 + "1")
+        assert broadcast_work(lambda: work, sessions=sessions) == (4, 0)
+
+        assert sorted(encoded) == ["encode_difficulty"] * 2 + ["encode_notify"] * 2
+        written = [s.transport.written for s in sessions]
+        assert written[0] == written[1] == written[2] != written[3]
+        # the same bytes are written to every session
+        assert all(w[1] is written[0][1] for w in written[1:3])
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+# Zilliqa Mining Proxy
+# Copyright (C) 2019  Gully Chen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import random
+
+import pytest
+
+from zilpool.stratum.framing import LineFramer, LineTooLong
+
+
+def make_messages(n):
+    return [
+        {"id": i, "method": "mining.submit",
+         "params": ["worker", f"{i:08x}", f"0x{random.getrandbits(64):016x}"]}
+        for i in range(n)
+    ]
+
+
+def encode(messages, sep=b"\n"):
+    return b"".join(json.dumps(m).encode() + sep for m in messages)
+
+
+def random_chunks(data, max_size):
+    pos = 0
+    while pos < len(data):
+        size = random.randint(1, max_size)
+        yield data[pos:pos + size]
+        pos += size
+
+
+class TestLineFramer:
+    def test_split_and_pipelined(self):
+        framer = LineFramer()
+        msgs = framer.feed(b'{"id": 1, "method": "mining.subs')
+        assert msgs == []
+        msgs = framer.feed(b'cribe"}\n\n\r\n{"id": 2}\n{"id"')
+        assert msgs == [{"id": 1, "method": "mining.subscribe"}, {"id": 2}]
+        assert framer.feed(b": 3}\r\n") == [{"id": 3}]
+        assert len(framer) == 0
+
+    def test_invalid_lines(self):
+        framer = LineFramer()
+        msgs = framer.feed(b'not json\n{"id": 1}\n\xff\xfe\n{"id": 2}\n')
+        assert msgs == [{"id": 1}, {"id": 2}]
+        assert framer.invalid_lines == 2
+
+    def test_line_too_long(self):
+        framer = LineFramer(max_line_length=64)
+        assert framer.feed(b'{"id": 1}\n') == [{"id": 1}]
+        with pytest.raises(LineTooLong):
+            framer.feed(b"x" * 65)
+
+        framer = LineFramer(max_line_length=64)
+        with pytest.raises(LineTooLong):
+            framer.feed(b"x" * 100 + b"\n")
+
+    @pytest.mark.parametrize("max_chunk", [1, 2, 7, 64, 1500, 65536])
+    def test_fuzz_segmentation(self, max_chunk):
+        random.seed(max_chunk)
+        messages = make_messages(500)
+        data = encode(messages, sep=b"\n")
+        # blank lines between messages are skipped
+        data = data.replace(b"}\n{", b"}\n\r\n\n{")
+
+        framer = LineFramer()
+        received = []
+        for chunk in random_chunks(data, max_chunk):
+            received.extend(framer.feed(chunk))
+
+        assert received == messages
+        assert len(framer) == 0
+        assert framer.invalid_lines == 0
+
+    def test_mtu_chunks(self):
+        messages = make_messages(20000)
+        data = encode(messages)
+
+        framer = LineFramer()
+        received = []
+        for chunk in random_chunks(data, 1500):    # about one MTU per segment
+            received.extend(framer.feed(chunk))
+
+        assert received == messages
+        assert len(framer) == 0
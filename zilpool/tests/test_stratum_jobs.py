@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# Zilliqa Mining Proxy
+# Copyright (C) 2019  Gully Chen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from zilpool.pyzil import ethash
+from zilpool.stratum.jobs import JobTable, to_timestamp
+
+Work = namedtuple("Work", ["pk", "header", "seed", "boundary", "block_num", "expire_time"])
+
+
+def make_work(pk, header, diff=10, block_num=30000, expire_in=60):
+    return Work(
+        pk=pk,
+        header="0x" + header * 32,
+        seed="0x" + ethash.block_num_to_seed(block_num).hex(),
+        boundary="0x" + ethash.difficulty_to_boundary(diff).hex(),
+        block_num=block_num,
+        expire_time=datetime.utcnow() + timedelta(seconds=expire_in),
+    )
+
+
+class TestJobTable:
+    def test_add_and_get(self):
+        jobs = JobTable()
+        work = make_work("5c9a0a7a1f0b7c2d3e4f5a6b", "ab")
+        job = jobs.add(work)
+        assert len(job.job_id) == 8
+        assert jobs.add(work) is job
+        assert jobs.get(job.job_id) is job
+        assert jobs.get("unknown") is None
+
+        assert job.work_id == work.pk
+        assert job.header_bytes == b"\xab" * 32
+        assert job.ethash_block == 30000
+        assert job.boundary_int == int(work.boundary, 16)
+        assert jobs.find(work.header.upper().replace("0X", ""), work.boundary) is job
+
+        other = jobs.add(make_work("5c9a0a7a1f0b7c2d3e4f5a6c", "cd"))
+        assert other.job_id != job.job_id
+
+    def test_expire(self):
+        jobs = JobTable()
+        work = make_work("5c9a0a7a1f0b7c2d3e4f5a6b", "ab", expire_in=60)
+        job = jobs.add(work)
+        expire_at = to_timestamp(work.expire_time)
+        assert jobs.get(job.job_id, now=expire_at + 1) is None
+
+        # expire time increased when dispatched again
+        work = work._replace(expire_time=work.expire_time + timedelta(seconds=60))
+        job = jobs.add(work)
+        assert jobs.get(job.job_id, now=expire_at + 1) is job
+
+        assert jobs.expire(now=expire_at + 61) == 1
+        assert len(jobs) == 0
+        assert jobs.find(work.header, work.boundary) is None
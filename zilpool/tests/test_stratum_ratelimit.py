@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# Zilliqa Mining Proxy
+# Copyright (C) 2019  Gully Chen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+
+from zilpool.stratum.ratelimit import TokenBucket, KeyedLimiter, BanList, StratumLimits
+from zilpool.stratum.stratum_server import StratumServerProtocol, StratumMiner
+from zilpool.stratum.stratum_server import SUBMIT_ACCEPTED, SUBMIT_REJECTED, SUBMIT_INVALID
+from zilpool.tests.stratum_fakes import FakeTransport
+
+
+class TestRateLimit:
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=2, burst=4, now=0)
+        assert all(bucket.consume(now=0) for _ in range(4))
+        assert not bucket.consume(now=0)
+        assert bucket.consume(now=0.5)
+        assert not bucket.consume(now=0.5)
+        # never refill over burst
+        assert bucket.is_full(now=100)
+        assert all(bucket.consume(now=100) for _ in range(4))
+        assert not bucket.consume(now=100)
+
+    def test_keyed_limiter(self):
+        limiter = KeyedLimiter(rate=1, burst=1)
+        assert limiter.allow("a", now=0)
+        assert not limiter.allow("a", now=0)
+        assert limiter.allow("b", now=0)
+        assert len(limiter) == 2
+        limiter.prune(now=0.5)
+        assert len(limiter) == 2
+        limiter.prune(now=10)
+        assert len(limiter) == 0
+
+    def test_ban_list(self):
+        bans = BanList(min_shares=10, invalid_ratio=0.5, window=100, ban_time=60)
+        for i in range(9):
+            assert not bans.record("1.2.3.4", valid=False, now=i)
+        assert not bans.is_banned("1.2.3.4", now=9)
+        assert bans.record("1.2.3.4", valid=False, now=9)
+        assert bans.is_banned("1.2.3.4", now=10)
+        assert not bans.is_banned("1.2.3.4", now=70)
+        assert bans.banned == 1
+
+        # valid shares keep the ratio low
+        for i in range(100):
+            assert not bans.record("5.6.7.8", valid=i % 3 != 0, now=i * 0.1)
+
+        # window restarts
+        for i in range(9):
+            bans.record("9.9.9.9", valid=False, now=0)
+        assert not bans.record("9.9.9.9", valid=False, now=200)
+
+    def test_config(self):
+        assert StratumLimits.from_config(None) is None
+        assert StratumLimits.from_config({"enabled": False}) is None
+        limits = StratumLimits.from_config({"enabled": True, "ip_submit_burst": 1})
+        assert limits.allow_submit("1.2.3.4", "wallet")
+        assert not limits.allow_submit("1.2.3.4", "wallet")
+        assert limits.allow_submit("1.2.3.5", None)
+
+    def test_only_invalid_shares_recorded(self):
+        limits = StratumLimits.from_config({"enabled": True})
+        protocol = StratumServerProtocol(limits=limits)
+        protocol.transport = FakeTransport()
+        protocol.stratumMiner = StratumMiner(protocol.transport)
+        protocol.peer_ip = "1.2.3.4"
+
+        async def replied(count):
+            while len(protocol.transport.written) < count:
+                await asyncio.sleep(0)
+
+        async def submit_all(results):
+            for i, result in enumerate(results):
+                task = asyncio.ensure_future(asyncio.sleep(0, result))
+                protocol.pending_submits += 1
+                protocol.submit_queue.put_nowait((i, task))
+            protocol.reply_task = asyncio.ensure_future(protocol.reply_submits())
+            try:
+                await asyncio.wait_for(replied(len(results)), timeout=5)
+            finally:
+                protocol.reply_task.cancel()
+
+        results = [SUBMIT_ACCEPTED, SUBMIT_REJECTED, SUBMIT_INVALID, SUBMIT_REJECTED]
+        asyncio.run(submit_all(results))
+        # stale jobs and results not saved are not counted
+        assert limits.bans._shares["1.2.3.4"][1:] == [2, 1]
+        assert len(protocol.transport.written) == 4
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# Zilliqa Mining Proxy
+# Copyright (C) 2019  Gully Chen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+from zilpool.stratum.sessions import SessionRegistry
+from zilpool.tests.stratum_fakes import FakeTransport
+
+
+class FakeSession:
+    def __init__(self):
+        self.transport = FakeTransport()
+        self.connected_at = self.last_active = 0
+        self.subscribed = self.authorized = False
+        self.wallet = self.worker = None
+
+
+class TestSessionRegistry:
+    def test_add_remove(self):
+        registry = SessionRegistry()
+        conns = [object() for _ in range(5)]
+        for conn in conns:
+            registry.add(conn, FakeSession())
+        assert len(registry) == 5
+
+        for conn in conns[:3]:
+            registry.set_subscribed(conn)
+        registry.set_authorized(conns[0], "wallet1", "worker1")
+        registry.set_authorized(conns[1], "wallet1", "worker2")
+        registry.set_authorized(conns[2], "wallet2", "worker1")
+
+        assert registry.counters() == {
+            "connected": 5, "subscribed": 3, "authorized": 3, "evicted": 0
+        }
+        assert len(registry.by_wallet("wallet1")) == 2
+        assert registry.by_worker("wallet2", "worker1") == [registry.get(conns[2])]
+
+        registry.set_worker(conns[1], "worker3")
+        assert registry.by_worker("wallet1", "worker2") == []
+        assert len(registry.by_worker("wallet1", "worker3")) == 1
+
+        registry.remove(conns[0])
+        registry.remove(conns[0])
+        registry.remove(conns[4])
+        assert registry.counters() == {
+            "connected": 3, "subscribed": 2, "authorized": 2, "evicted": 0
+        }
+        assert len(registry.by_wallet("wallet1")) == 1
+        assert len(registry.subscribed_sessions()) == 2
+
+    def test_evict(self):
+        registry = SessionRegistry()
+        idle, active, handshaking = object(), object(), object()
+        for conn in (idle, active, handshaking):
+            registry.add(conn, FakeSession())
+        registry.set_subscribed(idle)
+        registry.set_subscribed(active)
+
+        # nothing is idle yet
+        assert registry.evict(idle_timeout=60, handshake_timeout=60) == 0
+
+        now = time.monotonic()
+        registry.get(idle).last_active = now - 100
+        registry.get(handshaking).connected_at = now - 100
+        registry.touch(active)
+        registry.touch(handshaking)
+
+        evicted = [registry.get(idle), registry.get(handshaking)]
+        assert registry.evict(idle_timeout=60, handshake_timeout=60) == 2
+        assert all(s.transport.closed for s in evicted)
+        assert active in registry
+        assert registry.counters()["evicted"] == 2
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+# Zilliqa Mining Proxy
+# Copyright (C) 2019  Gully Chen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import asyncio
+import logging
+
+from zilpool.stratum.stratum_server import StratumServerProtocol, StratumMiner
+from zilpool.stratum.stratum_server import SUBMIT_ACCEPTED, SUBMIT_REJECTED, STRATUM_NICEHASH
+from zilpool.stratum.stratum_server import stratumSessions, stratumJobs
+from zilpool.stratum.dedup import ShareFilter
+from zilpool.tests.stratum_fakes import FakeTransport, make_work
+
+
+def make_protocol(max_pending_submits=16):
+    protocol = StratumServerProtocol({"max_pending_submits": max_pending_submits})
+    protocol.transport = FakeTransport()
+    protocol.stratumMiner = StratumMiner(protocol.transport, stratumVersion=STRATUM_NICEHASH)
+    protocol.subscribed = True
+    return protocol
+
+
+def submit_message(id, job_id="job1", nonce=None):
+    if nonce is None:
+        nonce = f"{id:016x}"
+    return {"id": id, "method": "mining.submit", "params": ["rig1", job_id, nonce]}
+
+
+def replies(protocol):
+    return [json.loads(data) for data in protocol.transport.written]
+
+
+class SubmitHandler:
+    """ handle_submit finished by tests, in any order """
+    def __init__(self):
+        self.futures = {}
+
+    async def __call__(self, jsonMsg, job):
+        fut = self.futures[jsonMsg["id"]] = asyncio.get_running_loop().create_future()
+        return await fut
+
+
+async def wait_written(protocol, count):
+    while len(protocol.transport.written) < count:
+        await asyncio.sleep(0)
+
+
+class TestPipelinedSubmits:
+    def test_reply_order(self):
+        protocol = make_protocol()
+        handler = protocol.handle_submit = SubmitHandler()
+
+        async def run():
+            for id in (1, 2, 3):
+                protocol.process_submit(submit_message(id))
+            await asyncio.sleep(0)
+            assert protocol.pending_submits == 3
+
+            # finished in reverse order, replied in order of requests
+            handler.futures[3].set_result(SUBMIT_ACCEPTED)
+            handler.futures[2].set_result(SUBMIT_REJECTED)
+            await asyncio.sleep(0.01)
+            assert protocol.transport.written == []
+            handler.futures[1].set_result(SUBMIT_ACCEPTED)
+            await asyncio.wait_for(wait_written(protocol, 3), timeout=5)
+            protocol.reply_task.cancel()
+
+        asyncio.run(run())
+        assert [(r["id"], r["result"]) for r in replies(protocol)] == \
+            [(1, True), (2, False), (3, True)]
+        assert protocol.pending_submits == 0
+
+    def test_max_pending_submits(self):
+        protocol = make_protocol(max_pending_submits=2)
+        handler = protocol.handle_submit = SubmitHandler()
+
+        async def run():
+            for id in (1, 2, 3):
+                protocol.process_submit(submit_message(id))
+            await asyncio.sleep(0)
+            assert sorted(handler.futures) == [1, 2]
+            assert replies(protocol) == [
+                {"id": 3, "result": False, "error": "too many pending submits"}
+            ]
+
+            # accepted again once a pending submit is replied
+            handler.futures[1].set_result(SUBMIT_ACCEPTED)
+            await asyncio.wait_for(wait_written(protocol, 2), timeout=5)
+            protocol.process_submit(submit_message(4))
+            await asyncio.sleep(0)
+            assert sorted(handler.futures) == [1, 2, 4]
+            protocol.reply_task.cancel()
+
+        asyncio.run(run())
+
+    def test_duplicates_of_known_jobs(self):
+        protocol = make_protocol()
+        protocol.shares = ShareFilter()
+        handler = protocol.handle_submit = SubmitHandler()
+        job = stratumJobs.add(make_work(200))
+
+        async def run():
+            for id, job_id in enumerate(["unknown", "unknown", job.job_id, job.job_id], 1):
+                protocol.process_submit(submit_message(id, job_id, nonce="01"))
+            await asyncio.sleep(0)
+            protocol.reply_task.cancel()
+
+        asyncio.run(run())
+        # shares of unknown jobs go on to be rejected as stale, not remembered
+        assert sorted(handler.futures) == [1, 2, 3]
+        assert len(protocol.shares) == 1
+        assert replies(protocol) == [{"id": 4, "result": False, "error": "duplicate share"}]
+
+    def test_connection_lost(self, caplog):
+        protocol = make_protocol()
+        handler = protocol.handle_submit = SubmitHandler()
+        stratumSessions.add(protocol, protocol.stratumMiner)
+
+        async def run():
+            for id in (1, 2):
+                protocol.process_submit(submit_message(id))
+            await asyncio.sleep(0)
+            reply_task = protocol.reply_task
+            protocol.connection_lost(None)
+            await asyncio.sleep(0)
+            assert reply_task.cancelled()
+            assert protocol.reply_task is None
+            assert protocol not in stratumSessions
+
+            # submits still finish, errors of them are retrieved and logged
+            handler.futures[1].set_exception(RuntimeError("orphan"))
+            handler.futures[2].set_exception(RuntimeError("queued"))
+            await asyncio.sleep(0.01)
+
+        with caplog.at_level(logging.ERROR):
+            asyncio.run(run())
+        errors = [r.exc_info[1] for r in caplog.records if r.exc_info]
+        assert sorted(str(e) for e in errors) == ["orphan", "queued"]
+        assert "never retrieved" not in caplog.text
+        assert protocol.transport.written == []
+
+    def test_worker_resolved_once(self, monkeypatch):
+        fetched = []
+
+        async def fetch_worker(miner_wallet, worker_name):
+            fetched.append((miner_wallet, worker_name))
+            return None if worker_name == "down" else (miner_wallet, worker_name)
+
+        monkeypatch.setattr(StratumServerProtocol, "fetch_worker", staticmethod(fetch_worker))
+        protocol = make_protocol()
+        stratumSessions.add(protocol, protocol.stratumMiner)
+
+        async def run():
+            protocol.process_authorize({"id": 2, "params": ["wallet.rig1"]})
+            workers = await asyncio.gather(*(protocol.get_worker("rig1") for _ in range(3)))
+            assert workers == [("wallet", "rig1")] * 3
+            # not cached if failed
+            assert await protocol.get_worker("down") is None
+            assert await protocol.get_worker("down") is None
+
+        try:
+            asyncio.run(run())
+        finally:
+            stratumSessions.remove(protocol)
+        assert fetched == [("wallet", "rig1"), ("wallet", "down"), ("wallet", "down")]
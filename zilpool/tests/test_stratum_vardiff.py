@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# Zilliqa Mining Proxy
+# Copyright (C) 2019  Gully Chen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from zilpool.stratum.vardiff import VarDiff, difficulty_to_boundary_int, hashes_per_share
+
+
+class TestVarDiff:
+    def test_config(self):
+        assert VarDiff.from_config(None) is None
+        assert VarDiff.from_config({"enabled": False}) is None
+        vardiff = VarDiff.from_config({"enabled": True, "initial_difficulty": 20})
+        assert vardiff.boundary == difficulty_to_boundary_int(20)
+
+    def test_share_target(self):
+        vardiff = VarDiff(initial_difficulty=20)
+        easy, hard = difficulty_to_boundary_int(10), difficulty_to_boundary_int(30)
+        assert vardiff.share_target(hard) == vardiff.boundary
+        assert vardiff.share_target(easy) == easy
+
+    def test_retarget(self):
+        vardiff = VarDiff(share_time=10, retarget_interval=60, initial_difficulty=20,
+                          min_difficulty=16, max_difficulty=40)
+        start = vardiff.window_start
+        assert not vardiff.retarget(now=start + 30)
+
+        # 2 ** 24 hashes per second, 1 share at difficulty 20 per 1/16 second
+        for _ in range(60 * 16):
+            vardiff.record_share(vardiff.boundary)
+        assert vardiff.retarget(now=start + 60)
+        assert vardiff.hashrate == 2 ** 24
+        # change is limited to 4 times
+        assert vardiff.boundary == difficulty_to_boundary_int(22)
+
+        for i in range(3):
+            hashes = 2 ** 24 * 60
+            for _ in range(hashes // hashes_per_share(vardiff.boundary)):
+                vardiff.record_share(vardiff.boundary)
+            vardiff.retarget(now=start + 120 + 60 * i)
+        # converge to one share per 10 seconds
+        assert abs(hashes_per_share(vardiff.boundary) / 2 ** 24 - 10) < 1
+
+    def test_no_shares(self):
+        vardiff = VarDiff(initial_difficulty=17, min_difficulty=16)
+        start = vardiff.window_start
+        vardiff.set_mining(True, now=start)
+        assert vardiff.retarget(now=start + 60)
+        assert vardiff.boundary == difficulty_to_boundary_int(16)
+        assert not vardiff.retarget(now=start + 120)
+
+    def test_idle(self):
+        vardiff = VarDiff(initial_difficulty=20)
+        start, boundary = vardiff.window_start, vardiff.boundary
+        assert not vardiff.retarget(now=start + 60)
+
+        # a job sent in the middle of a window
+        vardiff.set_mining(True, now=start + 90)
+        assert not vardiff.retarget(now=start + 120)
+        assert vardiff.retarget(now=start + 180)
+        assert vardiff.boundary == boundary * 4
+
+        vardiff.set_mining(False)
+        assert not vardiff.retarget(now=start + 240)
+        assert vardiff.boundary == boundary * 4
@@ -27,6 +27,7 @@ from zilpool.apis import stats
 from zilpool.web import tools
 from zilpool.common import utils
 from zilpool.apis import admin as admin_api
+from zilpool.database import routing
 
 CUR_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -47,6 +48,7 @@ def init_web_handlers(app, config):
     app.router.add_static(f"{root_path}static", STATIC_DIR)
 
     @aiohttp_jinja2.template("index.jinja2")
+    @routing.stats_reads
     async def index(request):
         return {
             "config": config,
@@ -76,6 +78,7 @@ def init_web_handlers(app, config):
     )
 
     @aiohttp_jinja2.template("miner.jinja2")
+    @routing.stats_reads
     async def show_miner(request):
         address = request.match_info.get("address")
         address_worker = address.split(".", 2)    # address.worker_name
@@ -105,6 +108,7 @@ def init_web_handlers(app, config):
     )
 
     @aiohttp_jinja2.template("node.jinja2")
+    @routing.stats_reads
     async def show_node(request):
         pub_key = request.match_info.get("pub_key")
         node = stats.node_stats(pub_key)
@@ -141,13 +145,14 @@ def init_web_handlers(app, config):
             })
         else:
             tplt = "admin_dashboard.jinja2"
-            context.update({
-                "visa": admin.visa_without_ext_data,
-                "expire_at": admin.visa_expire_time,
-                "summary": stats.summary(),
-                "current": stats.current_work(config),
-                "per_page": 20,
-            })
+            with routing.secondary_reads():
+                context.update({
+                    "visa": admin.visa_without_ext_data,
+                    "expire_at": admin.visa_expire_time,
+                    "summary": stats.summary(),
+                    "current": stats.current_work(config),
+                    "per_page": 20,
+                })
 
         return aiohttp_jinja2.render_template(tplt, request, context)
 
@@ -166,7 +171,8 @@ def init_web_handlers(app, config):
         admin = admin_api.get_admin_from_visa(request, visa)
 
         block_list = utils.block_num_to_list(block_num)
-        blocks_rewards = admin_api.get_rewards(block_list)
+        with routing.secondary_reads():
+            blocks_rewards = admin_api.get_rewards(block_list)
 
         buf = io.StringIO()
         header = ["block_num", "date_time", "miner_wallet",